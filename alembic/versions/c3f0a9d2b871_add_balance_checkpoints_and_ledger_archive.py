@@ -0,0 +1,47 @@
+"""add balance checkpoints and ledger archive"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "c3f0a9d2b871"
+down_revision = "a5781473f094"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "balance_checkpoints",
+        sa.Column("id", sa.BigInteger().with_variant(sa.Integer(), "sqlite"), autoincrement=True, nullable=False),
+        sa.Column("user_id", sa.String(length=36), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("ledger_id", sa.BigInteger(), nullable=False),
+        sa.Column("balance", sa.Numeric(18, 6), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_balance_checkpoints_user_ledger", "balance_checkpoints", ["user_id", "ledger_id"], unique=False
+    )
+    op.create_table(
+        "ledger_archive",
+        sa.Column("id", sa.BigInteger().with_variant(sa.Integer(), "sqlite"), autoincrement=False, nullable=False),
+        sa.Column("user_id", sa.String(length=36), nullable=False),
+        sa.Column("amount", sa.Numeric(18, 6), nullable=False),
+        sa.Column("currency", sa.String(length=10), nullable=False),
+        sa.Column("reason", sa.Text(), nullable=False),
+        sa.Column("idempotency_key", sa.String(length=255), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("balance_after", sa.Numeric(18, 6), nullable=False),
+        sa.Column("archived_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("idempotency_key"),
+    )
+    op.create_index("ix_ledger_archive_user_id", "ledger_archive", ["user_id", "id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ledger_archive_user_id", table_name="ledger_archive")
+    op.drop_table("ledger_archive")
+    op.drop_index("ix_balance_checkpoints_user_ledger", table_name="balance_checkpoints")
+    op.drop_table("balance_checkpoints")
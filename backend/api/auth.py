@@ -2,7 +2,10 @@ from decimal import Decimal
 import uuid
 from datetime import datetime, timedelta, timezone
 
+from typing import Optional
+
 from fastapi import APIRouter, HTTPException, Request
+from starlette.requests import HTTPConnection
 from fastapi.responses import JSONResponse
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -10,6 +13,7 @@ from pydantic import BaseModel, EmailStr, constr
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from . import db
 from .db import engine
 from .models import User, Wallet
 from .settings import settings
@@ -54,13 +58,15 @@ def _create_refresh_token(uid: str) -> str:
     return jwt.encode({"sub": uid, "exp": exp, "type": "refresh"}, settings.JWT_SECRET, algorithm=JWT_ALG)
 
 
-def get_current_user(request: Request) -> User:
-    auth = request.headers.get("Authorization", "")
-    token = None
+def _request_token(conn: HTTPConnection) -> Optional[str]:
+    auth = conn.headers.get("Authorization", "")
     if auth.startswith("Bearer "):
-        token = auth.split(" ", 1)[1]
-    else:
-        token = request.cookies.get("token")
+        return auth.split(" ", 1)[1]
+    return conn.cookies.get("token")
+
+
+def _token_uid(request: HTTPConnection, token: Optional[str] = None) -> str:
+    token = token or _request_token(request)
     if not token:
         raise HTTPException(status_code=401, detail="Unauthorized")
     try:
@@ -69,7 +75,11 @@ def get_current_user(request: Request) -> User:
         )
     except JWTError as exc:  # pragma: no cover - security check
         raise HTTPException(status_code=401, detail="Invalid token") from exc
-    uid = payload.get("sub")
+    return payload.get("sub")
+
+
+def get_current_user(request: Request) -> User:
+    uid = _token_uid(request)
     with Session(engine) as s:
         user = s.get(User, uid)
         if not user:
@@ -77,6 +87,39 @@ def get_current_user(request: Request) -> User:
         return user
 
 
+def get_current_user_id(request: Request) -> str:
+    """Id of the authenticated user, from the token claims alone.
+
+    For routes that only key data by user id: no database lookup, so a
+    deleted user's unexpired token is not rejected here.
+    """
+    return _token_uid(request)
+
+
+async def get_current_user_async(request: Request) -> User:
+    """Same as :func:`get_current_user` without leaving the event loop."""
+    return await _load_user(_token_uid(request))
+
+
+async def get_ws_user(conn: HTTPConnection, token: Optional[str] = None) -> Optional[User]:
+    """User behind a WebSocket (explicit token, bearer header or cookie).
+
+    Returns ``None`` for anonymous sockets instead of raising, so spectators
+    can still connect; an explicit but invalid token raises 401.
+    """
+    if not token and not _request_token(conn):
+        return None
+    return await _load_user(_token_uid(conn, token))
+
+
+async def _load_user(uid: str) -> User:
+    async with db.AsyncSessionLocal() as s:
+        user = await s.get(User, uid)
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        return user
+
+
 COOKIE_ARGS = dict(
     key="token",
     httponly=True,
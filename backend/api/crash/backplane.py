@@ -0,0 +1,334 @@
+"""Backplane para compartir una única ronda de crash entre workers.
+
+Un solo proceso (el *productor*) corre el ``CrashEngine`` real. Los demás
+workers usan un ``RemoteEngine``: reciben los eventos del productor, los
+reparten a sus propios WebSockets y le reenvían las apuestas y cashouts.
+
+- ``InProcessBackplane``: un solo proceso, sin IPC (default).
+- ``UnixSocketBackplane``: IPC local por Unix socket. El productor se elige
+  con un ``flock`` sobre ``<path>.lock``; el protocolo es JSON por línea. Si
+  el productor muere, los workers reintentan el lock cada
+  ``CRASH_BACKPLANE_RETRY_MS`` y el que lo toma pasa a productor.
+
+Se elige con ``CRASH_BACKPLANE`` (``inproc`` | ``unix``) y
+``CRASH_BACKPLANE_PATH``.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .engine import CrashEngine
+from .hashchain import CRASH_CHAIN_PATH, HashChain, default_chain
+from .history import RoundHistory
+
+CRASH_BACKPLANE = os.getenv("CRASH_BACKPLANE", "inproc")
+CRASH_BACKPLANE_PATH = os.getenv("CRASH_BACKPLANE_PATH", "/tmp/crash-backplane.sock")
+# si un worker no lee y su buffer supera esto, se lo desconecta
+CRASH_BACKPLANE_MAX_BUFFER = int(os.getenv("CRASH_BACKPLANE_MAX_BUFFER", str(8 * 1024 * 1024)))
+# cada cuánto un worker sin productor reintenta conectarse (o tomar el lock)
+CRASH_BACKPLANE_RETRY_MS = int(os.getenv("CRASH_BACKPLANE_RETRY_MS", "500"))
+# límite de línea: un lote de eventos grande puede superar el default de asyncio
+_LINE_LIMIT = 16 * 1024 * 1024
+
+logger = logging.getLogger("uvicorn")
+
+Events = List[Tuple[dict, Optional[str]]]
+
+
+def _line(obj: dict) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode() + b"\n"
+
+
+class InProcessBackplane:
+    """Un solo proceso: el engine local es la fuente de verdad."""
+
+    def __init__(self, factory: Callable[[], CrashEngine]) -> None:
+        self.engine: CrashEngine = factory()
+        self.is_producer = True
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class RemoteEngine(CrashEngine):
+    """Engine espejo de un worker: estado de sólo lectura + comandos remotos."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self.local = False  # True desde que este worker pasó a productor
+
+    def _load_chain(self) -> Optional[HashChain]:
+        # sólo sirve para verificar si es el mismo archivo que usa el productor
+        return default_chain() if CRASH_CHAIN_PATH else None
+
+    # --------- espejo de eventos ----------
+    def _mirror(self, msg: dict) -> None:
+        t = msg.get("t")
+        if t == "start":
+            self.phase, self.round_id = "RUNNING", msg["rid"]
+            self.crash_at, self.multiplier = None, 1.0  # el start no lo trae
+            self.t0, self.game = self.clock.now(), msg.get("g")
+        elif t == "tick":
+            self.multiplier = msg["m"]
+        elif t == "sync":
+            self.multiplier = msg["m"]
+            self.t0 = self.clock.now() - msg["e"] / 1000.0
+        elif t == "crash":
+            self.phase, self.crash_at = "CRASHED", msg["at"]
+            self.revealed = msg.get("g") or self.revealed
+        elif t == "round":
+            self.history.add(msg["rid"], msg["crash_at"], msg["players"], msg["wagered"], msg["paid"])
+        elif t == "betting":
+            self.phase, self.round_id = "BETTING", msg["rid"]
+            self.multiplier, self.crash_at, self.t0, self.game = 1.0, None, None, None
+
+    def apply(self, events: Events) -> None:
+        for msg, _ in events:
+            self._mirror(msg)
+        if events:
+            self._record(events)
+        self.fanout.publish_events(events)
+
+    def apply_snapshot(self, snap: dict) -> None:
+        self.phase, self.round_id = snap["phase"], snap["rid"]
+        self.multiplier, self.crash_at = snap["m"], snap["at"]
+        self.game, self.revealed = snap.get("g"), snap.get("rv", self.revealed)
+        # el replay del productor no viaja: quien reconecte antes recibe un state
+        self.seq = snap.get("s", 0)
+        self.epoch = snap.get("ep", self.epoch)
+        self._replay.clear()
+        if "hist" in snap:
+            self.history = RoundHistory()
+            self.history.extend(snap["hist"])
+        self.t0 = self.clock.now() - snap["e"] / 1000.0 if snap["phase"] == "RUNNING" else None
+
+    def promote(self, proto: CrashEngine) -> None:
+        """Pasa a correr la ronda en este proceso (el productor murió). La
+        cadena y los callbacks salen de ``proto``, un engine nuevo de la
+        fábrica; la ronda espejada se descarta y se abre una limpia (la cortada
+        la cierra restore() con el snapshot del productor)."""
+        self.local = True
+        self.chain, self.on_crash = proto.chain, proto.on_crash
+        self.revealed = proto.revealed
+        self.coalesce_ms, self.schedule = proto.coalesce_ms, proto.schedule
+        self.fail_pending()
+        self._reset()
+
+    # --------- comandos ----------
+    async def _call(self, op: str, **args):
+        if self._writer is None:
+            raise RuntimeError("BACKPLANE_DOWN")
+        self._next_id += 1
+        rid = self._next_id
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[rid] = fut
+        self._writer.write(_line({"id": rid, "op": op, "args": args}))
+        return await fut
+
+    def resolve(self, reply: dict) -> None:
+        fut = self._pending.pop(reply["id"], None)
+        if fut is None or fut.done():
+            return
+        if "err" in reply:
+            exc = ValueError if reply.get("kind") == "value" else RuntimeError
+            fut.set_exception(exc(reply["err"]))
+        else:
+            fut.set_result(reply["ok"])
+
+    def fail_pending(self) -> None:
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(RuntimeError("BACKPLANE_DOWN"))
+        self._pending.clear()
+
+    async def place_bet(self, player_id: str, amount: float, auto: Optional[float] = None) -> Dict:
+        if self.local:
+            return await super().place_bet(player_id, amount, auto)
+        return await self._call("bet", player_id=player_id, amount=amount, auto=auto)
+
+    async def cashout(self, player_id: str) -> Dict:
+        if self.local:
+            return await super().cashout(player_id)
+        return await self._call("cashout", player_id=player_id)
+
+    async def state(self, player_id: Optional[str] = None):
+        if self.local:
+            return await super().state(player_id)
+        return await self._call("state", player_id=player_id)
+
+
+class UnixSocketBackplane:
+    """Productor elegido por flock + workers conectados por Unix socket."""
+
+    def __init__(self, factory: Callable[[], CrashEngine], path: str = CRASH_BACKPLANE_PATH) -> None:
+        self.factory = factory
+        self.path = path
+        self.is_producer = self._elect()
+        self.engine: CrashEngine = factory() if self.is_producer else RemoteEngine()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._workers: Set[asyncio.StreamWriter] = set()
+        self._client_task: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+        # se llama con el engine cuando este worker pasa a productor
+        self.on_promote: Optional[Callable[[CrashEngine], Awaitable[None]]] = None
+
+    def _elect(self) -> bool:
+        self._lock_fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._lock_fd)
+            self._lock_fd = -1
+            return False
+        return True
+
+    async def start(self) -> None:
+        if self.is_producer:
+            await self._listen()
+        else:
+            self._client_task = asyncio.create_task(self._client_loop())
+
+    async def _listen(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # socket viejo de un productor muerto
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path, limit=_LINE_LIMIT)
+        self.engine.on_events = self._relay
+        logger.info("crash backplane: producer on %s", self.path)
+
+    async def _promote(self) -> bool:
+        """Toma el lock si quedó libre y pasa a productor."""
+        if not self._elect():
+            return False
+        remote = self.engine
+        assert isinstance(remote, RemoteEngine)
+        remote.promote(self.factory())
+        self.is_producer = True
+        await self._listen()
+        logger.warning("crash backplane: producer lost, this worker took over")
+        if self.on_promote:
+            await self.on_promote(remote)
+        return True
+
+    async def stop(self) -> None:
+        if self._client_task:
+            self._client_task.cancel()
+        if self._server:
+            self._server.close()
+            for w in list(self._workers):
+                w.close()
+            await self._server.wait_closed()
+        if self._lock_fd >= 0:
+            os.close(self._lock_fd)  # libera el flock
+
+    # --------- productor ----------
+    def _relay(self, events: Events) -> None:
+        if not self._workers:
+            return
+        line = _line({"ev": events})  # se serializa una vez para todos
+        for w in list(self._workers):
+            if w.transport.get_write_buffer_size() > CRASH_BACKPLANE_MAX_BUFFER:
+                self._workers.discard(w)
+                w.close()
+                continue
+            w.write(line)
+
+    def _snapshot(self) -> dict:
+        e = self.engine
+        return {
+            "phase": e.phase,
+            "rid": e.round_id,
+            "m": e.multiplier,
+            # el crash_at sólo sale de este proceso una vez que crasheó
+            "at": e.crash_at if e.phase == "CRASHED" else None,
+            "e": e._elapsed_ms(),
+            "g": e.game,
+            "rv": e.revealed,
+            "hist": e.history.items(),
+            "s": e.seq,
+            "ep": e.epoch,
+        }
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.write(_line({"snap": self._snapshot()}))
+        self._workers.add(writer)
+        try:
+            while line := await reader.readline():
+                req = json.loads(line)
+                # cada comando en su tarea: un cashout no espera a otro
+                task = asyncio.create_task(self._command(writer, req))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self._workers.discard(writer)
+            writer.close()
+
+    async def _command(self, writer: asyncio.StreamWriter, req: dict) -> None:
+        op, args = req.get("op"), req.get("args", {})
+        reply: dict = {"id": req.get("id")}
+        try:
+            if op == "bet":
+                reply["ok"] = await self.engine.place_bet(args["player_id"], args["amount"], args.get("auto"))
+            elif op == "cashout":
+                reply["ok"] = await self.engine.cashout(args["player_id"])
+            elif op == "state":
+                reply["ok"] = await self.engine.state(args.get("player_id"))
+            else:
+                raise RuntimeError("BAD_OP")
+        except ValueError as exc:
+            reply.update(err=str(exc), kind="value")
+        except RuntimeError as exc:
+            reply.update(err=str(exc), kind="runtime")
+        if not writer.is_closing():
+            writer.write(_line(reply))
+
+    # --------- worker ----------
+    async def _client_loop(self) -> None:
+        remote = self.engine
+        assert isinstance(remote, RemoteEngine)
+        retry = CRASH_BACKPLANE_RETRY_MS / 1000.0
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=_LINE_LIMIT)
+            except OSError:
+                # el productor todavía no levantó, o murió y nadie lo reemplazó
+                if await self._promote():
+                    return
+                await asyncio.sleep(retry)
+                continue
+            remote._writer = writer
+            try:
+                while line := await reader.readline():
+                    msg = json.loads(line)
+                    if "ev" in msg:
+                        remote.apply([(m, mode) for m, mode in msg["ev"]])
+                    elif "snap" in msg:
+                        remote.apply_snapshot(msg["snap"])
+                    else:
+                        remote.resolve(msg)
+            except (ConnectionError, ValueError):
+                pass
+            finally:
+                remote._writer = None
+                remote.fail_pending()
+                writer.close()
+            logger.warning("crash backplane: producer connection lost, retrying")
+            if await self._promote():
+                return
+            await asyncio.sleep(retry)
+
+
+def make_backplane(kind: str, factory: Callable[[], CrashEngine]):
+    if kind == "unix":
+        return UnixSocketBackplane(factory)
+    return InProcessBackplane(factory)
@@ -0,0 +1,182 @@
+"""Libro de apuestas de una ronda en arrays paralelos (struct-of-arrays).
+
+Cada apuesta ocupa un índice; monto, objetivo auto, multiplicador de cobro y
+payout viven en ``array('d')`` contiguos (8 bytes por campo) en vez de un dict
+por jugador. ``cash_at == 0`` significa que la apuesta sigue abierta. Al
+cerrar las apuestas el libro se ordena por objetivo auto: cobrar las autos
+vencidas y juntar los perdedores son operaciones sobre slices, sin un paso de
+Python por apuesta.
+
+Todo multiplicador que paga (cobro a mano, objetivo auto) se trunca a
+centésimos con ``cents``, igual que el que se muestra.
+"""
+import base64
+import math
+from array import array
+from bisect import bisect_right
+from itertools import compress, repeat
+from operator import itemgetter, mul, not_
+from typing import Dict, Iterator, List, Optional
+
+
+def cents(m: float) -> float:
+    """``m`` truncado a centésimos (el round absorbe el error de coma flotante)."""
+    return math.floor(round(m * 100, 6)) / 100
+
+
+class BetBook:
+    def __init__(self) -> None:
+        self.players: List[str] = []  # índice -> player_id
+        self.index: Dict[str, int] = {}  # player_id -> índice
+        self.amount = array("d")
+        self.auto = array("d")  # 0.0 = sin auto cashout
+        self.cash_at = array("d")  # 0.0 = abierta
+        self.payout = array("d")
+        # seal() ordena el libro por objetivo auto (las sin auto quedan
+        # primero): las autos pendientes son el tramo auto[_auto_pos:]
+        self._sealed = True
+        self._auto_pos = 0  # todo lo anterior ya se procesó
+
+    def __len__(self) -> int:
+        return len(self.players)
+
+    def __contains__(self, player_id: object) -> bool:
+        return player_id in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.players)
+
+    def add(self, player_id: str, amount: float, auto: Optional[float] = None) -> int:
+        if player_id in self.index:
+            raise RuntimeError("ALREADY_BET")
+        i = len(self.players)
+        self.players.append(player_id)
+        self.index[player_id] = i
+        self.amount.append(float(amount))
+        self.auto.append(cents(auto) if auto else 0.0)
+        self.cash_at.append(0.0)
+        self.payout.append(0.0)
+        self._sealed = False
+        return i
+
+    def get(self, player_id: str) -> Optional[dict]:
+        """Vista dict de una apuesta (mismo formato que el engine exponía antes)."""
+        i = self.index.get(player_id)
+        if i is None:
+            return None
+        return self.view(i)
+
+    def __getitem__(self, player_id: str) -> dict:
+        return self.view(self.index[player_id])
+
+    def view(self, i: int) -> dict:
+        cashed = self.cash_at[i] > 0.0
+        return {
+            "amount": self.amount[i],
+            "auto": self.auto[i] or None,
+            "cashed": cashed,
+            "payout": self.payout[i] if cashed else None,
+            "cash_at": self.cash_at[i] if cashed else None,
+        }
+
+    def is_open(self, i: int) -> bool:
+        return self.cash_at[i] == 0.0
+
+    def cash(self, i: int, m: float) -> float:
+        payout = round(self.amount[i] * m, 2)
+        self.cash_at[i] = m
+        self.payout[i] = payout
+        return payout
+
+    def seal(self) -> None:
+        """Ordena el libro por objetivo auto; el engine lo llama al cerrar las
+        apuestas, antes de arrancar la curva. Cambia los índices (no los
+        player_id). Sólo se ordenan las autos; el resto queda en su orden."""
+        if self._sealed:
+            return
+        self._sealed = True
+        n = len(self.players)
+        order = list(compress(range(n), map(not_, self.auto)))
+        self._auto_pos = len(order)
+        if n - len(order) < 2 and order == list(range(len(order))):
+            return  # ya ordenado
+        order += sorted(compress(range(n), self.auto), key=self.auto.__getitem__)
+        take = itemgetter(*order)
+        self.players = list(take(self.players))
+        self.index = dict(zip(self.players, range(n)))
+        for k in ("amount", "auto", "cash_at", "payout"):
+            setattr(self, k, array("d", take(getattr(self, k))))
+
+    def pending_autos(self) -> int:
+        self.seal()
+        return len(self.auto) - self._auto_pos
+
+    def next_auto(self) -> Optional[float]:
+        self.seal()
+        if self._auto_pos < len(self.auto):
+            return self.auto[self._auto_pos]
+        return None
+
+    def pop_due(self, m: float) -> List[int]:
+        """Cobra las apuestas auto con objetivo <= ``m`` a su objetivo (no a
+        ``m``: un tick tardío no paga de más); devuelve sus índices.
+
+        El tramo vencido se escribe con slices (sin un paso de Python por
+        apuesta); sólo las que ya cobraron a mano se reponen una por una.
+        """
+        self.seal()
+        pos = self._auto_pos
+        end = bisect_right(self.auto, m, pos)
+        if end == pos:
+            return []
+        self._auto_pos = end
+        cash_at, payout = self.cash_at, self.payout
+        prev = cash_at[pos:end]
+        due = list(compress(range(pos, end), map(not_, prev)))
+        kept = [(i, cash_at[i], payout[i]) for i in compress(range(pos, end), prev)]
+        targets = self.auto[pos:end]
+        cash_at[pos:end] = targets
+        payout[pos:end] = array("d", map(round, map(mul, self.amount[pos:end], targets), repeat(2)))
+        for i, at, p in kept:
+            cash_at[i], payout[i] = at, p
+        return due
+
+    def losers(self) -> List[str]:
+        """Jugadores que no cobraron (sus payouts ya valen 0)."""
+        return list(compress(self.players, map(not_, self.cash_at)))
+
+    def total_wagered(self) -> float:
+        return sum(self.amount)
+
+    def total_paid(self) -> float:
+        return sum(self.payout)
+
+    def nbytes(self) -> int:
+        arrays = (self.amount, self.auto, self.cash_at, self.payout)
+        return sum(a.itemsize * len(a) for a in arrays)
+
+    def dump(self) -> Dict:
+        """Forma serializable y compacta: los arrays van como bytes en base64."""
+        arrays = {k: getattr(self, k) for k in ("amount", "auto", "cash_at", "payout")}
+        out: Dict = {"players": list(self.players)}
+        out.update((k, base64.b64encode(a.tobytes()).decode()) for k, a in arrays.items())
+        return out
+
+    @classmethod
+    def load(cls, data: Dict) -> "BetBook":
+        book = cls()
+        book.players = list(data["players"])
+        book.index = {p: i for i, p in enumerate(book.players)}
+        for k in ("amount", "auto", "cash_at", "payout"):
+            getattr(book, k).frombytes(base64.b64decode(data[k]))
+        # se ordena en el próximo seal/next_auto/pop_due; las cobradas se saltean
+        book._sealed = not book.players
+        return book
+
+    def clear(self) -> None:
+        self.players.clear()
+        self.index.clear()
+        for a in (self.amount, self.auto, self.cash_at, self.payout):
+            del a[:]
+        self._sealed = True
+        self._auto_pos = 0
@@ -0,0 +1,151 @@
+"""Reloj del crash: la hora y las esperas pasan por acá, no por ``time``.
+
+``Clock`` es el reloj real (``perf_counter`` + timers de asyncio). Un
+``VirtualClock`` tiene su propio heap de timers y sólo avanza cuando el resto
+de las tareas quedó esperando: las rondas corren a velocidad de CPU y en el
+mismo orden siempre, lo que sirve para tests deterministas y para el
+benchmark (``tools/bench_crash.py``)::
+
+    clock = VirtualClock()
+    engine = CrashEngine(clock=clock)
+    await clock.run(jugar(engine))  # minutos de juego en milisegundos
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+
+class Clock:
+    """Reloj real."""
+
+    def now(self) -> float:
+        # monotónico, para intervalos; no sobrevive al proceso
+        return time.perf_counter()
+
+    def wall(self) -> float:
+        return time.time()
+
+    def call_later(self, delay: float, cb: Callable[..., Any], *args: Any) -> Any:
+        """Programa ``cb``; el handle devuelto tiene ``cancel()``."""
+        return asyncio.get_running_loop().call_later(delay, cb, *args)
+
+    def call_at(self, when: float, cb: Callable[..., Any], *args: Any) -> Any:
+        """Como ``call_later`` pero con un instante de ``now()``."""
+        return self.call_later(when - self.now(), cb, *args)
+
+    async def sleep(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+
+
+class _Timer:
+    __slots__ = ("cb", "args", "cancelled")
+
+    def __init__(self, cb: Callable[..., Any], args: Tuple[Any, ...]) -> None:
+        self.cb, self.args, self.cancelled = cb, args, False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+def resolve(fut: asyncio.Future) -> None:
+    """Callback de timer: resuelve ``fut`` si nadie lo hizo antes."""
+    if not fut.done():
+        fut.set_result(None)
+
+
+class VirtualClock(Clock):
+    """Reloj simulado: ``now`` sólo se mueve al disparar el próximo timer."""
+
+    def __init__(self, start: float = 0.0, wall: float = 1_700_000_000.0) -> None:
+        self._now = start
+        self._wall0 = wall - start
+        self._timers: List[Tuple[float, int, _Timer]] = []
+        self._n = itertools.count()
+        self.fired = 0  # timers disparados (para métricas/tests)
+
+    def now(self) -> float:
+        return self._now
+
+    def wall(self) -> float:
+        return self._wall0 + self._now
+
+    def call_later(self, delay: float, cb: Callable[..., Any], *args: Any) -> _Timer:
+        return self.call_at(self._now + max(0.0, delay), cb, *args)
+
+    def call_at(self, when: float, cb: Callable[..., Any], *args: Any) -> _Timer:
+        # instante exacto: al disparar, now() == when (sin error de redondeo)
+        timer = _Timer(cb, args)
+        heapq.heappush(self._timers, (max(self._now, when), next(self._n), timer))
+        return timer
+
+    async def sleep(self, delay: float) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        timer = self.call_later(delay, resolve, fut)
+        try:
+            await fut
+        finally:
+            timer.cancel()
+
+    def _next_when(self) -> Optional[float]:
+        timers = self._timers
+        while timers and timers[0][2].cancelled:
+            heapq.heappop(timers)
+        return timers[0][0] if timers else None
+
+    def _fire_next(self) -> None:
+        when, _, timer = heapq.heappop(self._timers)
+        self._now = max(self._now, when)
+        self.fired += 1
+        timer.cb(*timer.args)
+
+    async def idle(self) -> None:
+        """Cede el loop hasta que ninguna otra tarea tenga algo listo para correr."""
+        loop = asyncio.get_running_loop()
+        ready = getattr(loop, "_ready", None)  # sólo el loop de asyncio lo expone
+        for _ in range(10_000):
+            await asyncio.sleep(0)
+            if ready is not None and not ready:
+                return
+        # otro loop (uvloop): alcanza con unas vueltas para la lógica del engine
+
+    async def advance(self, seconds: float) -> None:
+        """Avanza ``seconds`` de tiempo simulado disparando los timers en orden."""
+        until = self._now + seconds
+        while True:
+            await self.idle()
+            when = self._next_when()
+            if when is None or when > until:
+                break
+            self._fire_next()
+        self._now = until
+        await self.idle()
+
+    async def run(self, aw: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """Corre ``aw`` avanzando el reloj cada vez que todo queda esperando.
+
+        Sin timers pendientes se espera un poco de tiempo real: hay I/O de
+        verdad en curso (p.ej. la base de la liquidación).
+        """
+        main = asyncio.ensure_future(aw)
+        deadline = None if timeout is None else self._now + timeout
+        try:
+            while not main.done():
+                await self.idle()
+                if main.done():
+                    break
+                when = self._next_when()
+                if when is None:
+                    await asyncio.sleep(0.001)
+                elif deadline is not None and when > deadline:
+                    raise TimeoutError("VIRTUAL_TIMEOUT")
+                else:
+                    self._fire_next()
+            return main.result()
+        finally:
+            if not main.done():
+                main.cancel()
+
+
+REAL_CLOCK = Clock()
@@ -0,0 +1,174 @@
+"""Codificación de los frames del stream del crash.
+
+``json`` es el formato por defecto (texto). ``bin1`` es un formato binario
+versionado, little-endian, de layout fijo por tipo de evento; el primer byte
+es el tipo y le sigue el ``s`` del evento en ``uint32`` (0 = sin ``s``), así
+que ``?since=`` funciona igual que en JSON. Los multiplicadores viajan como
+centésimos en ``uint32``. Los eventos sin layout propio se mandan como tipo 0
+seguido del JSON en UTF-8.
+Un ``batch`` (tipo 9) es ``uint16`` con la cantidad y luego cada sub-frame
+precedido por su largo en ``uint16``.
+
+El cliente lo negocia con el subprotocolo ``crash.bin.v1`` o ``?fmt=bin1``.
+"""
+import json
+import struct
+import uuid
+from typing import Callable, Dict, Tuple, Union
+
+CODECS = ("json", "bin1")
+BINARY_SUBPROTOCOL = "crash.bin.v1"
+
+PHASES = ("BETTING", "RUNNING", "CRASHED")
+
+Frame = Union[str, bytes]
+
+# tipo -> (código, layout); todos empiezan con código y s
+_LAYOUTS: Dict[str, Tuple[int, struct.Struct]] = {
+    "tick": (1, struct.Struct("<BII")),  # m
+    "player_cash": (2, struct.Struct("<BIId")),  # at, p
+    "player_bet": (3, struct.Struct("<BId")),  # a
+    "start": (4, struct.Struct("<BI16sqdI")),  # rid, ts, k, g
+    "sync": (5, struct.Struct("<BIqII")),  # ts, e, m
+    "crash": (6, struct.Struct("<BIII32s")),  # at, g, h
+    "betting": (7, struct.Struct("<BI16s")),  # rid
+    "state": (8, struct.Struct("<BIB16sIdII")),  # phase, rid, m, k, e, ep
+}
+_BY_CODE = {code: (t, layout) for t, (code, layout) in _LAYOUTS.items()}
+GENERIC = 0
+BATCH = 9
+_BATCH_HEAD = struct.Struct("<BH")
+_LEN = struct.Struct("<H")
+
+
+def _c(m) -> int:
+    return int(round(float(m or 0) * 100))
+
+
+def _rid(rid: str) -> bytes:
+    return uuid.UUID(rid).bytes
+
+
+def encode_json(msg: dict) -> str:
+    # mismo formato que WebSocket.send_json, pero una vez por evento
+    return json.dumps(msg, separators=(",", ":"), ensure_ascii=False)
+
+
+def _fields(msg: dict) -> tuple:
+    t = msg["t"]
+    if t == "tick":
+        return (_c(msg["m"]),)
+    if t == "player_cash":
+        return (_c(msg["at"]), float(msg["p"]))
+    if t == "player_bet":
+        return (float(msg["a"]),)
+    if t == "start":
+        return (_rid(msg["rid"]), int(msg.get("ts", 0)), float(msg.get("k", 0.0)), int(msg.get("g") or 0))
+    if t == "sync":
+        return (int(msg["ts"]), int(msg["e"]), _c(msg["m"]))
+    if t == "crash":
+        # sin cadena: g = 0 y hash en ceros
+        g = int(msg.get("g") or 0)
+        return (_c(msg["at"]), g, bytes.fromhex(msg["h"]) if g else bytes(32))
+    if t == "betting":
+        return (_rid(msg["rid"]),)
+    if t == "state":
+        return (
+            PHASES.index(msg["phase"]),
+            _rid(msg["rid"]),
+            _c(msg["m"]),
+            float(msg.get("k", 0.0)),
+            int(msg.get("e", 0)),
+            int(msg.get("ep", 0)),
+        )
+    raise KeyError(t)
+
+
+def _encode_batch(events: list) -> bytes:
+    out = bytearray(_BATCH_HEAD.pack(BATCH, len(events)))
+    for ev in events:
+        f = encode_binary(ev)
+        out += _LEN.pack(len(f))
+        out += f
+    return bytes(out)
+
+
+def encode_binary(msg: dict) -> bytes:
+    if msg.get("t") == "batch":
+        try:
+            return _encode_batch(msg["ev"])
+        except struct.error:
+            pass  # demasiado grande para los largos uint16
+    spec = _LAYOUTS.get(msg.get("t", ""))
+    if spec:
+        code, layout = spec
+        try:
+            return layout.pack(code, int(msg.get("s") or 0), *_fields(msg))
+        except (KeyError, ValueError, TypeError, struct.error):
+            pass  # no entra en el layout fijo: va genérico
+    return bytes((GENERIC,)) + encode_json(msg).encode()
+
+
+def decode_binary(frame: bytes) -> dict:
+    """Inversa de :func:`encode_binary` (para tests y clientes Python)."""
+    if frame[0] == GENERIC:
+        return json.loads(frame[1:])
+    if frame[0] == BATCH:
+        _, n = _BATCH_HEAD.unpack_from(frame)
+        pos, ev = _BATCH_HEAD.size, []
+        for _ in range(n):
+            (size,) = _LEN.unpack_from(frame, pos)
+            pos += _LEN.size
+            ev.append(decode_binary(frame[pos:pos + size]))
+            pos += size
+        return {"t": "batch", "ev": ev}
+    t, layout = _BY_CODE[frame[0]]
+    s, *v = layout.unpack(frame)[1:]
+    msg = _decode_fields(t, v)
+    if s:
+        msg["s"] = s
+    return msg
+
+
+def _decode_fields(t: str, v: list) -> dict:
+    if t == "tick":
+        return {"t": t, "m": v[0] / 100}
+    if t == "player_cash":
+        return {"t": t, "at": v[0] / 100, "p": v[1]}
+    if t == "player_bet":
+        return {"t": t, "a": v[0]}
+    if t == "start":
+        start = {"t": t, "rid": str(uuid.UUID(bytes=v[0])), "ts": v[1], "k": v[2]}
+        if v[3]:
+            start["g"] = v[3]
+        return start
+    if t == "sync":
+        return {"t": t, "ts": v[0], "e": v[1], "m": v[2] / 100}
+    if t == "crash":
+        crash = {"t": t, "at": v[0] / 100}
+        if v[1]:
+            crash.update(g=v[1], h=v[2].hex())
+        return crash
+    if t == "betting":
+        return {"t": t, "rid": str(uuid.UUID(bytes=v[0]))}
+    state = {
+        "t": t,
+        "phase": PHASES[v[0]],
+        "rid": str(uuid.UUID(bytes=v[1])),
+        "m": v[2] / 100,
+        "k": v[3],
+        "e": v[4],
+    }
+    if v[5]:
+        state["ep"] = v[5]
+    return state
+
+
+ENCODERS: Dict[str, Callable[[dict], Frame]] = {
+    "json": encode_json,
+    "bin1": encode_binary,
+}
+
+
+def encode(msg: dict, codec: str = "json") -> Frame:
+    return ENCODERS[codec](msg)
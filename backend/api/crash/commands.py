@@ -0,0 +1,126 @@
+"""Canal de comandos sobre ``/crash/stream``.
+
+El socket se autentica una sola vez (cookie o header al conectar, o un
+comando ``auth``) y después acepta comandos JSON con id; cada uno recibe un
+``ack`` por la misma cola que los eventos, así que llega en orden con ellos::
+
+    -> {"id": 7, "op": "bet", "amount": 10, "auto": 2.0}
+    <- {"t": "ack", "id": 7, "ok": true, "r": {"rid": "..."}}
+    -> {"id": 8, "op": "cashout"}
+    <- {"t": "ack", "id": 8, "ok": false, "err": "NOT_RUNNING"}
+
+Ops: ``auth`` (``token``), ``bet`` (``amount``, ``auto``), ``cashout`` y
+``state``. El cashout toma el multiplicador al recibir el frame; el ack sale
+cuando la liquidación se aplicó, igual que la respuesta HTTP. Cualquier otro
+texto (keepalives) se ignora como antes.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+from functools import partial
+from typing import Any, Dict, Optional, Set
+
+from fastapi import HTTPException, WebSocket
+
+from ..auth import get_ws_user
+from .engine import CrashEngine
+from .rooms import stored_room
+from .settlement import pipeline, settle_bet, settle_cashout
+
+# comandos en vuelo por socket: el rate limit HTTP no ve estos frames
+CRASH_WS_MAX_INFLIGHT = int(os.getenv("CRASH_WS_MAX_INFLIGHT", "8"))
+
+logger = logging.getLogger("uvicorn")
+
+
+async def place_bet(engine: CrashEngine, user_id: str, amount: float, auto: Optional[float]) -> Dict:
+    """Apuesta en el engine + débito en el próximo lote del pipeline."""
+    info = await engine.place_bet(user_id, amount, auto)
+    await pipeline.submit(partial(settle_bet, info["rid"], info["at"], user_id, amount, stored_room(engine.room)))
+    return {"rid": info["rid"]}  # "at" es el crash: no sale de acá
+
+
+async def cash_out(engine: CrashEngine, user_id: str) -> Dict:
+    data = await engine.cashout(user_id)
+    round_id = data.pop("rid")
+    await pipeline.submit(partial(settle_cashout, round_id, user_id, data["at"], data["payout"]))
+    return data
+
+
+def _number(value: Any, code: str) -> float:
+    # json.loads acepta NaN e Infinity: no llegan ni al Decimal ni al libro
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(code)
+    return float(value)
+
+
+class CommandChannel:
+    """Comandos de un socket; cada uno corre en su tarea (un cashout no
+    espera a que se liquide una apuesta anterior)."""
+
+    def __init__(self, ws: WebSocket, engine: CrashEngine, user_id: Optional[str] = None) -> None:
+        self.ws = ws
+        self.engine = engine
+        self.user_id = user_id
+        self._tasks: Set[asyncio.Task] = set()
+
+    def handle(self, raw: str) -> None:
+        try:
+            cmd = json.loads(raw)
+        except ValueError:
+            return
+        if not isinstance(cmd, dict) or "op" not in cmd:
+            return
+        if len(self._tasks) >= CRASH_WS_MAX_INFLIGHT:
+            self._ack(cmd.get("id"), err="BUSY")
+            return
+        task = asyncio.create_task(self._run(cmd))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, cmd: Dict) -> None:
+        try:
+            result = await self._dispatch(cmd)
+        except (ValueError, RuntimeError) as exc:
+            self._ack(cmd.get("id"), err=str(exc))
+        except HTTPException as exc:
+            self._ack(cmd.get("id"), err="UNAUTHORIZED" if exc.status_code == 401 else str(exc.detail))
+        except Exception:
+            logger.exception("crash ws command failed: %s", cmd.get("op"))
+            self._ack(cmd.get("id"), err="INTERNAL")
+        else:
+            self._ack(cmd.get("id"), result)
+
+    async def _dispatch(self, cmd: Dict) -> Any:
+        op = cmd["op"]
+        if op == "auth":
+            user = await get_ws_user(self.ws, str(cmd.get("token") or "")) if cmd.get("token") else None
+            if user is None:
+                raise RuntimeError("UNAUTHORIZED")
+            self.user_id = user.id
+            return {"user": user.id}
+        if op == "state":
+            return await self.engine.state(self.user_id)
+        if op not in ("bet", "cashout"):
+            raise RuntimeError("BAD_OP")
+        if self.user_id is None:
+            raise RuntimeError("UNAUTHORIZED")
+        if op == "cashout":
+            return await cash_out(self.engine, self.user_id)
+        amount = _number(cmd.get("amount"), "BAD_AMOUNT")
+        auto = cmd.get("auto")
+        if auto is not None:
+            auto = _number(auto, "BAD_AUTO")
+            if auto < 1.01:
+                raise ValueError("BAD_AUTO")
+        return await place_bet(self.engine, self.user_id, amount, auto)
+
+    def _ack(self, cid: Any, result: Any = None, err: Optional[str] = None) -> None:
+        msg: Dict[str, Any] = {"t": "ack", "id": cid, "ok": err is None}
+        if err is None:
+            msg["r"] = result
+        else:
+            msg["err"] = err
+        self.engine.fanout.send(self.ws, msg)
@@ -1,50 +1,210 @@
-import asyncio, math, os, time, uuid, random
-from typing import Dict, Optional, Set, Awaitable, Callable, List
+import asyncio, itertools, math, os, time, uuid
+from collections import deque
+from typing import TYPE_CHECKING, Optional, Awaitable, Callable, Deque, Dict, List, Tuple
 from fastapi import WebSocket
 
+from .betbook import BetBook, cents
+from .clock import REAL_CLOCK, Clock, resolve
+from .fanout import Fanout
+from .hashchain import HashChain, default_chain
+from .history import RoundHistory
+from .metrics import TICK_BROADCAST, TICK_LATENESS, TICK_WORK, TICKS_SKIPPED
+
+if TYPE_CHECKING:
+    from .rooms import Scheduler
+
 CRASH_MIN_BET = float(os.getenv("CRASH_MIN_BET", "1"))
 CRASH_TICK_MS = int(os.getenv("CRASH_TICK_MS", "100"))
 CRASH_GROWTH_RATE = float(os.getenv("CRASH_GROWTH_RATE", "0.06"))
 CRASH_INTERMISSION_SECONDS = float(os.getenv("CRASH_INTERMISSION_SECONDS", "4"))
+# cada cuánto se manda un "sync" a los clientes en modo keyframes
+CRASH_SYNC_MS = int(os.getenv("CRASH_SYNC_MS", "1000"))
+# ventana para juntar eventos (apuestas, cashouts) en un solo frame "batch"; 0 = sin demora
+CRASH_COALESCE_MS = int(os.getenv("CRASH_COALESCE_MS", str(CRASH_TICK_MS)))
+# "ticks": despierta en cada tick; "events": sólo para autos, crash y la
+# cadencia que necesitan los sockets conectados (t = ln(m) / k)
+CRASH_SCHEDULE = os.getenv("CRASH_SCHEDULE", "ticks")
+# eventos recientes que se reenvían a quien reconecta con ?since=<seq>
+CRASH_REPLAY_SIZE = int(os.getenv("CRASH_REPLAY_SIZE", "512"))
 
 class CrashEngine:
-    def __init__(self) -> None:
+    def __init__(self, chain: Optional[HashChain] = None, clock: Optional[Clock] = None) -> None:
+        # hora y esperas inyectables: VirtualClock corre rondas en tiempo simulado
+        self.clock: Clock = clock if clock is not None else REAL_CLOCK
         self.phase: str = "BETTING"  # BETTING | RUNNING | CRASHED
         self.round_id: str = str(uuid.uuid4())
         self.multiplier: float = 1.0
         self.crash_at: Optional[float] = None
         self.started: bool = False  # si ya arrancó la ronda actual
-        self.bets: Dict[str, Dict] = {}  # player_id -> {amount, cashed:bool, payout:Optional[float], cash_at:Optional[float]}
-        self.connections: Set[WebSocket] = set()
+        self.t0: Optional[float] = None  # clock.now() del arranque de la ronda
+        # resultados precomprometidos; game = juego de la cadena de esta ronda
+        self.chain: Optional[HashChain] = chain if chain is not None else self._load_chain()
+        self.game: Optional[int] = None
+        # último juego cuyo hash ya se puede publicar
+        self.revealed: int = self.chain.cursor - 1 if self.chain else 0
+        self.bets = BetBook()  # arrays paralelos: monto, auto, cash_at, payout
+        self.fanout = Fanout()
+        self.history = RoundHistory()  # últimas rondas, sin ir a la base
+        # eventos decididos bajo el lock; se publican al soltarlo
+        self._outbox: List[Tuple[dict, Optional[str]]] = []
+        # cada evento lleva "s" creciente; seq = último publicado. seq vuelve a
+        # 0 en cada arranque: epoch (distinto de 0) identifica esta secuencia
+        self._seq = 0
+        self.seq = 0
+        self.epoch = uuid.uuid4().int % 0xFFFFFFFF + 1
+        self._replay: Deque[Tuple[dict, Optional[str]]] = deque(maxlen=CRASH_REPLAY_SIZE)
+        self.coalesce_ms = CRASH_COALESCE_MS
+        self._flush_handle = None  # timer del clock
         self._lock = asyncio.Lock()
         self._runner_task: Optional[asyncio.Task] = None
+        self.schedule = CRASH_SCHEDULE
+        self._waker: Optional[asyncio.Future] = None
+        # estado del loop de la ronda en curso (ver _begin_round)
+        self._deadline = self._next_sync = self._t_crash = math.inf
+        # Scheduler compartido (rooms.py); None = una tarea propia por ronda
+        self.scheduler: Optional["Scheduler"] = None
+        self.room: Optional[str] = None
         self.on_crash: Optional[Callable[[str, List[str]], Awaitable[None]]] = None
+        # recibe cada lote publicado (p.ej. para retransmitirlo a otros workers)
+        self.on_events: Optional[Callable[[List[Tuple[dict, Optional[str]]]], None]] = None
 
     # --------- utilidades ----------
+    def _load_chain(self) -> Optional[HashChain]:
+        return default_chain()
+
     def _gen_crash_at(self) -> float:
-        # cola pesada simple (exponencial) + pequeños límites
-        u = random.random()
-        base = 1 + (-math.log(max(1e-9, 1 - u)))
-        return round(max(1.01, base), 2)
-
-    async def _broadcast(self, msg: dict) -> None:
-        dead = []
-        for ws in list(self.connections):
-            try:
-                await ws.send_json(msg)
-            except Exception:
-                dead.append(ws)
-        for ws in dead:
-            self.connections.discard(ws)
+        # el próximo juego de la cadena (ya calculado fuera del loop)
+        assert self.chain is not None
+        self.game, crash_at = self.chain.take()
+        return crash_at
+
+    def _emit(self, msg: dict, mode: Optional[str] = None) -> None:
+        self._seq += 1
+        msg["s"] = self._seq
+        self._outbox.append((msg, mode))
+
+    def _record(self, out: List[Tuple[dict, Optional[str]]]) -> None:
+        self._replay.extend(out)
+        self.seq = out[-1][0].get("s", self.seq)
+
+    def _missed(self, since: int, mode: str, epoch: Optional[int] = None) -> Optional[List[dict]]:
+        """Eventos posteriores a ``since`` para ``mode``; None si ya no están."""
+        if epoch != self.epoch:
+            return None  # el seq es de otro arranque (u otro productor)
+        if since == self.seq:
+            return []
+        if since > self.seq or not self._replay:
+            return None  # otra instancia o reinicio
+        first = self._replay[0][0]["s"]
+        if since + 1 < first:
+            return None  # quedó demasiado atrás
+        # los seq son contiguos: se salta directo al primero perdido
+        tail = itertools.islice(self._replay, since + 1 - first, None)
+        return [msg for msg, m in tail if m is None or m == mode]
+
+    def _flush(self) -> None:
+        # nunca se llama con self._lock tomado
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        out, self._outbox = self._outbox, []
+        if not out:
+            return
+        self._record(out)
+        # todo lo acumulado sale en un frame por conexión
+        self.fanout.publish_events(out)
+        if self.on_events:
+            self.on_events(out)
+
+    def _flush_later(self) -> None:
+        # junta los eventos de la ventana; el tick loop también vacía el outbox
+        if self.coalesce_ms <= 0:
+            self._flush()
+        elif self._flush_handle is None and self._outbox:
+            self._flush_handle = self.clock.call_later(self.coalesce_ms / 1000.0, self._flush)
+
+    def _at(self, m: float) -> float:
+        # instante (clock.now) en que la curva llega a m
+        assert self.t0 is not None
+        return self.t0 + math.log(m) / CRASH_GROWTH_RATE
+
+    def _multiplier_now(self, now: Optional[float] = None) -> float:
+        """Multiplicador exacto de la curva (truncado a centésimos, como se muestra)."""
+        if self.t0 is None:
+            return self.multiplier
+        if now is None:
+            now = self.clock.now()
+        return cents(math.exp(CRASH_GROWTH_RATE * (now - self.t0)))
+
+    def _watching(self, mode: str) -> bool:
+        # con backplane no se ven los sockets de los otros workers
+        return self.fanout.count(mode) > 0 or self.on_events is not None
+
+    async def _sleep_until(self, deadline: float) -> None:
+        delay = deadline - self.clock.now()
+        if delay <= 0:
+            await asyncio.sleep(0)
+            return
+        self._waker = fut = asyncio.get_running_loop().create_future()
+        handle = self.clock.call_at(deadline, resolve, fut)
+        try:
+            await fut
+        finally:
+            handle.cancel()
+            self._waker = None
+
+    def _wake_up(self) -> None:
+        # modo events: un suscriptor nuevo necesita la cadencia ya
+        if self.scheduler is not None:
+            self.scheduler.wake(self)
+            return
+        if self._waker is not None and not self._waker.done():
+            self._waker.set_result(None)
+
+    def _elapsed_ms(self) -> int:
+        if self.t0 is None:
+            return 0
+        return int((self.clock.now() - self.t0) * 1000)
 
     # --------- API pública ----------
-    async def subscribe(self, ws: WebSocket):
-        await ws.accept()
-        self.connections.add(ws)
-        # estado inicial compacto
-        await ws.send_json({"t": "state", "phase": self.phase, "m": self.multiplier, "rid": self.round_id})
+    async def subscribe(
+        self,
+        ws: WebSocket,
+        mode: str = "ticks",
+        codec: str = "json",
+        subprotocol: Optional[str] = None,
+        batch: bool = True,
+        since: Optional[int] = None,
+        epoch: Optional[int] = None,
+    ):
+        await ws.accept(subprotocol=subprotocol)
+        self.fanout.add(ws, mode, codec, batch)
+        if self.schedule == "events":
+            self._wake_up()
+        if since is not None:
+            missed = self._missed(since, mode, epoch)
+            if missed is not None:
+                # reconexión: sólo lo que se perdió
+                self.fanout.send_many(ws, missed)
+                return
+        # estado inicial compacto (por la misma cola para mantener el orden)
+        msg = {
+            "t": "state",
+            "phase": self.phase,
+            "m": self.multiplier,
+            "rid": self.round_id,
+            "s": self.seq,
+            "ep": self.epoch,
+        }
+        if mode == "keyframes" and self.phase == "RUNNING":
+            # lo necesario para extrapolar la curva desde ya
+            msg.update(k=CRASH_GROWTH_RATE, e=self._elapsed_ms())
+        self.fanout.send(ws, msg)
 
-    async def place_bet(self, player_id: str, amount: float, auto: Optional[float] = None):
+    def unsubscribe(self, ws: WebSocket) -> None:
+        self.fanout.discard(ws)
+
+    async def place_bet(self, player_id: str, amount: float, auto: Optional[float] = None) -> Dict:
         if amount < CRASH_MIN_BET:
             raise ValueError("MIN_BET")
         async with self._lock:
@@ -52,38 +212,46 @@ class CrashEngine:
                 raise RuntimeError("NOT_BETTING")
             if player_id in self.bets:
                 raise RuntimeError("ALREADY_BET")
-            self.bets[player_id] = {
-                "amount": float(amount),
-                "auto": auto,
-                "cashed": False,
-                "payout": None,
-                "cash_at": None,
-            }
-            await self._broadcast({"t": "player_bet", "a": amount})
             # si es la primera apuesta de la ronda, arrancamos
-            if not self.started:
-                self.started = True
+            first = not self.started
+            if first:
+                # antes de tocar nada: puede fallar (CHAIN_EXHAUSTED)
                 self.crash_at = self._gen_crash_at()
+            self.bets.add(player_id, amount, auto)
+            self._emit({"t": "player_bet", "a": amount})
+            if first:
+                self.started = True
                 self.phase = "RUNNING"
                 self.multiplier = 1.0
-                if self._runner_task is None or self._runner_task.done():
+                if self.scheduler is not None:
+                    # sala de un registro: la maneja el timer compartido
+                    self.scheduler.start(self)
+                elif self._runner_task is None or self._runner_task.done():
                     # El loop se dispara únicamente acá
                     self._runner_task = asyncio.create_task(self._run_loop())
+            info = {"rid": self.round_id, "at": self.crash_at}
+        self._flush_later()
+        return info
 
-    async def cashout(self, player_id: str):
+    async def cashout(self, player_id: str) -> Dict:
         async with self._lock:
             if self.phase != "RUNNING":
                 raise RuntimeError("NOT_RUNNING")
-            bet = self.bets.get(player_id)
-            if not bet:
+            i = self.bets.index.get(player_id)
+            if i is None:
                 raise RuntimeError("NO_ACTIVE_BET")
-            if bet["cashed"]:
-                return {"at": bet["cash_at"], "payout": bet["payout"]}
-            bet["cashed"] = True
-            bet["payout"] = round(bet["amount"] * self.multiplier, 2)
-            bet["cash_at"] = self.multiplier
-            await self._broadcast({"t": "player_cash", "at": self.multiplier, "p": bet["payout"]})
-            return {"at": bet["cash_at"], "payout": bet["payout"]}
+            if not self.bets.is_open(i):
+                return {"at": self.bets.cash_at[i], "payout": self.bets.payout[i], "rid": self.round_id}
+            # al momento del pedido, no al último tick: el tick es sólo presentación
+            now = self.clock.now()
+            if self.t0 is not None and self.crash_at and now >= self._at(self.crash_at):
+                raise RuntimeError("NOT_RUNNING")  # ya crasheó aunque el loop no despertó
+            m = self._multiplier_now(now)
+            payout = self.bets.cash(i, m)
+            self._emit({"t": "player_cash", "at": m, "p": payout})
+            result = {"at": m, "payout": payout, "rid": self.round_id}
+        self._flush_later()
+        return result
 
     async def state(self, player_id: Optional[str] = None):
         you = None
@@ -98,48 +266,156 @@ class CrashEngine:
             "min_bet": CRASH_MIN_BET,
         }
 
+    def _settle_due_autos(self) -> int:
+        # sólo se tocan las apuestas cuyo objetivo ya se alcanzó; cada una
+        # cobra a su objetivo aunque el tick llegue más arriba
+        due = self.bets.pop_due(self.multiplier)
+        cash_at, payout = self.bets.cash_at, self.bets.payout
+        for i in due:
+            self._emit({"t": "player_cash", "at": cash_at[i], "p": payout[i]})
+        return len(due)
+
     # --------- loop de ejecución ----------
+    # Una ronda es begin -> tick* -> crash -> (intermedio) -> reset. _run_loop
+    # la recorre en una tarea propia; un Scheduler compartido (rooms.py) llama
+    # los mismos pasos para muchas salas desde un solo timer.
+    def _begin_round(self) -> None:
+        # cierre de apuestas: el libro se ordena una vez acá, antes de que
+        # corra la curva, y no en el primer tick
+        self.bets.seal()
+        self.t0 = t0 = self.clock.now()
+        # keyframe: con ts y k el cliente calcula m = exp(k * e) por su cuenta;
+        # el crash_at sólo sale en el frame "crash" (si no, la cadena no sirve)
+        self._emit({
+            "t": "start",
+            "rid": self.round_id,
+            "ts": int(t0 * 1000),
+            "k": CRASH_GROWTH_RATE,
+            "g": self.game,
+        })
+        self._flush()
+        if self.chain:
+            self.chain.ensure_lookahead()
+        # deadlines absolutos desde t0: el trabajo de un tick no corre al siguiente
+        self._deadline = t0 + CRASH_TICK_MS / 1000.0
+        self._next_sync = t0 + CRASH_SYNC_MS / 1000.0
+        # el crash tiene hora exacta: no espera al tick siguiente
+        self._t_crash = self._at(self.crash_at) if self.crash_at else math.inf
+
+    def _next_wake(self) -> float:
+        """Próximo instante en que la ronda tiene algo que hacer."""
+        if self.schedule != "events":
+            return min(self._deadline, self._t_crash)
+        # modo events: sólo crash, autos y la cadencia que alguien mira
+        wake = self._t_crash
+        auto = self.bets.next_auto()
+        if auto is not None:
+            wake = min(wake, self._at(auto))
+        if self._watching("ticks"):
+            wake = min(wake, self._deadline)
+        if self._watching("keyframes"):
+            wake = min(wake, self._next_sync)
+        return wake
+
+    def _tick(self, now: float, wake: float) -> bool:
+        """Un despertar de la ronda; devuelve True si ya crasheó."""
+        assert self.t0 is not None
+        t0 = self.t0
+        started = time.perf_counter()  # costo real del tick, aun con reloj virtual
+        events = self.schedule == "events"
+        period = CRASH_TICK_MS / 1000.0
+        TICK_LATENESS.observe(max(0.0, now - wake))
+        # crecimiento exponencial suave (nunca más allá del crash), truncado
+        # a centésimos como el cashout
+        m = self._multiplier_now(now)
+        self.multiplier = min(m, self.crash_at) if self.crash_at else m
+        if now >= self._deadline:
+            late = now - self._deadline
+            if events and not self._watching("ticks"):
+                # nadie mira ticks: sólo se realinea la grilla
+                self._deadline += (late // period + 1) * period
+            else:
+                if late >= period:
+                    # atrasados: se saltean los ticks perdidos en vez de encolarlos
+                    skipped = int(late // period)
+                    TICKS_SKIPPED.inc(skipped)
+                    self._deadline += skipped * period
+                self._deadline += period
+                self._emit({"t": "tick", "m": self.multiplier}, "ticks")
+        if now >= self._next_sync:
+            self._next_sync = now + CRASH_SYNC_MS / 1000.0
+            if not events or self._watching("keyframes"):
+                sync = {"t": "sync", "ts": int(now * 1000), "e": int((now - t0) * 1000), "m": self.multiplier}
+                self._emit(sync, "keyframes")
+        self._settle_due_autos()
+        sent = time.perf_counter()
+        self._flush()
+        done = time.perf_counter()
+        TICK_BROADCAST.observe(done - sent)
+        TICK_WORK.observe(done - started)
+        return now >= self._t_crash
+
+    def _crash(self) -> List[str]:
+        """CRASH: publica el crash y el resumen; devuelve los perdedores."""
+        self.phase = "CRASHED"
+        crash = {"t": "crash", "at": self.crash_at}
+        if self.game and self.chain:
+            # recién ahora se revela el hash del juego
+            self.revealed = self.chain.reveal(self.game)
+            crash.update(g=self.game, h=self.chain.hash(self.game))
+        self._emit(crash)
+        # resumen de la ronda: al historial y a los clientes (y workers)
+        entry = self.history.add(
+            self.round_id,
+            self.crash_at or self.multiplier,
+            len(self.bets),
+            self.bets.total_wagered(),
+            self.bets.total_paid(),
+        )
+        self._emit({"t": "round", **entry})
+        self._flush()
+        # liquidar perdedores (sin cashout)
+        return self.bets.losers()
+
+    async def _settle_losers(self, round_id: str, losers: List[str]) -> None:
+        if self.on_crash and losers:
+            try:
+                await self.on_crash(round_id, losers)
+            except Exception:
+                pass
+
+    def _reset(self) -> None:
+        self.phase = "BETTING"
+        self.round_id = str(uuid.uuid4())
+        self.multiplier = 1.0
+        self.crash_at = None
+        self.t0 = None
+        self.game = None
+        self.started = False
+        self.bets.clear()
+        self._emit({"t": "betting", "rid": self.round_id})
+        self._flush()
+
     async def _run_loop(self):
         # corre hasta crash; luego CRASHED un rato; luego reset a BETTING
-        t0 = time.perf_counter()
-        await self._broadcast({"t": "start", "rid": self.round_id, "at": self.crash_at})
+        self._begin_round()
         try:
             while True:
-                await asyncio.sleep(CRASH_TICK_MS / 1000.0)
-                # crecimiento exponencial suave
-                self.multiplier = round(math.exp(CRASH_GROWTH_RATE * (time.perf_counter() - t0)), 2)
-                await self._broadcast({"t": "tick", "m": self.multiplier})
-                # auto cashout
-                for pid, b in list(self.bets.items()):
-                    if not b["cashed"] and b["auto"] and self.multiplier >= float(b["auto"]):
-                        b["cashed"] = True
-                        b["payout"] = round(b["amount"] * self.multiplier, 2)
-                        b["cash_at"] = self.multiplier
-                        await self._broadcast({"t": "player_cash", "at": self.multiplier, "p": b["payout"]})
-                if self.crash_at and self.multiplier >= self.crash_at:
+                wake = self._next_wake()
+                await self._sleep_until(wake)
+                if self._tick(self.clock.now(), wake):
                     break
-        finally:
-            # CRASH!
-            self.phase = "CRASHED"
-            await self._broadcast({"t": "crash", "at": self.crash_at})
-            # liquidar perdedores (sin cashout)
-            losers = []
-            for pid, b in self.bets.items():
-                if not b["cashed"]:
-                    b["payout"] = 0.0
-                    losers.append(pid)
-            if self.on_crash and losers:
-                try:
-                    await self.on_crash(self.round_id, losers)
-                except Exception:
-                    pass
-            await asyncio.sleep(CRASH_INTERMISSION_SECONDS)
-            # reset
-            self.phase = "BETTING"
-            self.round_id = str(uuid.uuid4())
-            self.multiplier = 1.0
-            self.crash_at = None
-            self.started = False
-            self.bets.clear()
-            self._runner_task = None
-            await self._broadcast({"t": "betting", "rid": self.round_id})
+        except asyncio.CancelledError:
+            # apagado: el proceso no decide la ronda; la cierra restore() con el snapshot
+            raise
+        except Exception:
+            await self._end_round()
+            raise
+        await self._end_round()
+
+    async def _end_round(self) -> None:
+        losers = self._crash()
+        await self._settle_losers(self.round_id, losers)
+        await self.clock.sleep(CRASH_INTERMISSION_SECONDS)
+        self._runner_task = None
+        self._reset()
@@ -0,0 +1,183 @@
+"""Fan-out de eventos del crash hacia los WebSockets suscriptos.
+
+Cada evento se serializa una sola vez por codec y se encola en una cola
+acotada por conexión; una tarea por conexión la drena. Un cliente lento nunca
+bloquea al resto: si su cola se llena se lo desconecta.
+"""
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import WebSocket
+
+from .codec import CODECS, Frame, encode
+
+CRASH_WS_QUEUE = int(os.getenv("CRASH_WS_QUEUE", "256"))
+# "ticks": frame por tick (default); "keyframes": start + sync, el cliente extrapola
+STREAM_MODES = ("ticks", "keyframes")
+# 1013 = "try again later": el cliente puede reconectar
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class _Subscriber:
+    __slots__ = ("ws", "mode", "codec", "batch", "queue", "task", "evicted")
+
+    def __init__(self, ws: WebSocket, size: int, mode: str, codec: str, batch: bool) -> None:
+        self.ws = ws
+        self.mode = mode
+        self.codec = codec
+        self.batch = batch  # False: quiere los eventos de a uno (compatibilidad)
+        self.queue: "asyncio.Queue[Frame]" = asyncio.Queue(maxsize=size)
+        self.task: Optional[asyncio.Task] = None
+        self.evicted = False
+
+
+class Fanout:
+    def __init__(self, queue_size: int = CRASH_WS_QUEUE) -> None:
+        self.queue_size = queue_size
+        self._subs: Dict[WebSocket, _Subscriber] = {}
+        self._by_mode: Dict[str, Dict[WebSocket, _Subscriber]] = {m: {} for m in STREAM_MODES}
+        self.evicted = 0  # contador de consumidores lentos desconectados
+
+    def __len__(self) -> int:
+        return len(self._subs)
+
+    def __contains__(self, ws: WebSocket) -> bool:
+        return ws in self._subs
+
+    def count(self, mode: str) -> int:
+        return len(self._by_mode[mode])
+
+    def add(self, ws: WebSocket, mode: str = "ticks", codec: str = "json", batch: bool = True) -> None:
+        if ws in self._subs:
+            return
+        if mode not in STREAM_MODES:
+            raise ValueError("BAD_MODE")
+        if codec not in CODECS:
+            raise ValueError("BAD_CODEC")
+        sub = _Subscriber(ws, self.queue_size, mode, codec, batch)
+        sub.task = asyncio.create_task(self._drain(sub))
+        self._subs[ws] = sub
+        self._by_mode[mode][ws] = sub
+
+    def discard(self, ws: WebSocket) -> None:
+        sub = self._subs.pop(ws, None)
+        if not sub:
+            return
+        self._by_mode[sub.mode].pop(ws, None)
+        if sub.task and sub.task is not asyncio.current_task():
+            sub.task.cancel()
+
+    def send(self, ws: WebSocket, msg: dict) -> None:
+        """Encola un mensaje para una sola conexión."""
+        sub = self._subs.get(ws)
+        if sub:
+            self._offer(sub, encode(msg, sub.codec))
+
+    def send_many(self, ws: WebSocket, msgs: List[dict]) -> None:
+        """Encola varios mensajes para una conexión (un ``batch`` si acepta)."""
+        sub = self._subs.get(ws)
+        if not sub or not msgs:
+            return
+        if sub.batch and len(msgs) > 1:
+            self._offer(sub, encode({"t": "batch", "ev": msgs}, sub.codec))
+            return
+        for msg in msgs:
+            if not self._offer(sub, encode(msg, sub.codec)):
+                return
+
+    def publish(self, msg: dict, mode: Optional[str] = None) -> int:
+        """Serializa ``msg`` una vez por codec y lo encola en todas las
+        conexiones (o sólo en las del ``mode`` indicado)."""
+        subs = self._subs if mode is None else self._by_mode[mode]
+        if not subs:
+            return 0
+        frames: Dict[str, Frame] = {}
+        n = 0
+        for sub in list(subs.values()):
+            frame = frames.get(sub.codec)
+            if frame is None:
+                frame = frames[sub.codec] = encode(msg, sub.codec)
+            if self._offer(sub, frame):
+                n += 1
+        return n
+
+    def publish_batch(self, msgs: List[dict], mode: Optional[str] = None) -> int:
+        """Publica varios eventos como un único frame ``batch`` (o de a uno
+        para las conexiones sin batch)."""
+        if len(msgs) == 1:
+            return self.publish(msgs[0], mode)
+        subs = self._subs if mode is None else self._by_mode[mode]
+        if not subs or not msgs:
+            return 0
+        batch = {"t": "batch", "ev": msgs}
+        frames: Dict[Tuple[str, bool], List[Frame]] = {}
+        n = 0
+        for sub in list(subs.values()):
+            key = (sub.codec, sub.batch)
+            out = frames.get(key)
+            if out is None:
+                if sub.batch:
+                    out = [encode(batch, sub.codec)]
+                else:
+                    out = [encode(m, sub.codec) for m in msgs]
+                frames[key] = out
+            if all(self._offer(sub, f) for f in out):
+                n += 1
+        return n
+
+    def publish_events(self, out: List[Tuple[dict, Optional[str]]]) -> None:
+        """Publica lo acumulado en un outbox: un frame por conexión y modo."""
+        if not out:
+            return
+        if all(mode is None for _, mode in out):
+            self.publish_batch([msg for msg, _ in out])
+            return
+        for m in STREAM_MODES:
+            msgs = [msg for msg, mode in out if mode is None or mode == m]
+            if msgs:
+                self.publish_batch(msgs, m)
+
+    def _offer(self, sub: _Subscriber, frame: Frame) -> bool:
+        try:
+            sub.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            self._evict(sub)
+            return False
+
+    def _evict(self, sub: _Subscriber) -> None:
+        sub.evicted = True
+        self.evicted += 1
+        self.discard(sub.ws)
+
+    async def _drain(self, sub: _Subscriber) -> None:
+        ws, q = sub.ws, sub.queue
+        try:
+            while True:
+                frame = await q.get()
+                if isinstance(frame, bytes):
+                    await ws.send_bytes(frame)
+                else:
+                    await ws.send_text(frame)
+        except asyncio.CancelledError:
+            if sub.evicted:
+                try:
+                    await ws.close(code=SLOW_CONSUMER_CLOSE_CODE)
+                except Exception:
+                    pass
+        except Exception:
+            # socket muerto: lo sacamos sin afectar al resto
+            if self._subs.get(ws) is sub:
+                del self._subs[ws]
+                self._by_mode[sub.mode].pop(ws, None)
+
+    async def close(self) -> None:
+        subs = list(self._subs.values())
+        self._subs.clear()
+        for by_mode in self._by_mode.values():
+            by_mode.clear()
+        for sub in subs:
+            if sub.task:
+                sub.task.cancel()
+        await asyncio.gather(*(s.task for s in subs if s.task), return_exceptions=True)
@@ -0,0 +1,230 @@
+"""Resultados del crash precomprometidos en una cadena de hashes SHA-256.
+
+Se genera de una vez ``h[N] = semilla`` y ``h[i-1] = sha256(h[i])``; sólo se
+publica ``h[0]`` (el hash terminal). El juego ``g`` (1..N) usa ``h[g]`` y su
+multiplicador sale del mismo esquema HMAC de ``services/rng.py``::
+
+    crash_multiplier(h[g], CRASH_CHAIN_SALT, g, CRASH_HOUSE_EDGE)
+
+Como ``sha256(h[g]) == h[g-1]``, cualquiera puede comprobar que un juego
+revelado estaba fijado desde antes de arrancar la cadena.
+
+La cadena vive en un archivo plano de ``32 * (N + 1)`` bytes que se abre con
+``mmap`` (``CRASH_CHAIN_PATH``); el próximo juego sin usar se guarda en
+``<path>.pos``. Sin path, se genera en memoria al arrancar.
+
+Para generar una cadena::
+
+    python -m api.crash.hashchain /var/lib/crash/chain.bin 10000000
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional, Set, Tuple, Union
+
+from ..services.rng import crash_multiplier
+
+CRASH_CHAIN_PATH = os.getenv("CRASH_CHAIN_PATH", "")
+CRASH_CHAIN_LENGTH = int(os.getenv("CRASH_CHAIN_LENGTH", "100000"))
+# semilla pública (p.ej. un hash de bloque futuro) fijada después de publicar h[0]
+CRASH_CHAIN_SALT = os.getenv("CRASH_CHAIN_SALT", "")
+# resultados precalculados por adelantado, fuera del event loop
+CRASH_CHAIN_LOOKAHEAD = int(os.getenv("CRASH_CHAIN_LOOKAHEAD", "64"))
+CRASH_HOUSE_EDGE = float(os.getenv("CRASH_HOUSE_EDGE", "0.01"))
+
+H = 32  # bytes por hash
+
+Buffer = Union[bytes, bytearray, mmap.mmap]
+
+
+def build(length: int, seed: Optional[bytes] = None) -> bytearray:
+    """Devuelve los ``length + 1`` hashes de la cadena, ``h[0]`` primero."""
+    buf = bytearray(H * (length + 1))
+    h = seed or os.urandom(H)
+    sha = hashlib.sha256
+    for i in range(length, -1, -1):
+        buf[i * H:(i + 1) * H] = h
+        h = sha(h).digest()
+    return buf
+
+
+def generate(path: str, length: int, seed: Optional[bytes] = None) -> None:
+    # rename atómico: un lector nunca ve una cadena a medio escribir
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(build(length, seed))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class HashChain:
+    def __init__(
+        self,
+        buf: Buffer,
+        path: Optional[str] = None,
+        salt: str = CRASH_CHAIN_SALT,
+        house_edge: float = CRASH_HOUSE_EDGE,
+        lookahead: int = CRASH_CHAIN_LOOKAHEAD,
+    ) -> None:
+        if len(buf) < 2 * H or len(buf) % H:
+            raise ValueError("BAD_CHAIN")
+        self._buf = buf
+        self.path = path
+        self.salt = salt
+        self.house_edge = house_edge
+        self.length = len(buf) // H - 1
+        self.lookahead = lookahead
+        self.cursor = self._load_cursor()  # primer juego todavía sin reservar
+        # el hilo de la cadena y take() persisten el cursor: uno a la vez
+        self._cursor_lock = threading.Lock()
+        self._saved = self.cursor
+        self._next = self.cursor  # próximo juego a entregar
+        self._live: Set[int] = set()  # entregados y todavía sin crashear
+        self._ahead: Deque[Tuple[int, float]] = deque()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="crash-chain")
+        self._filling: Optional[Future] = None
+        self._verified = 0  # h[1..n] ya comprobados contra h[0] (ver verify)
+
+    @classmethod
+    def open(cls, path: str, **kw) -> "HashChain":
+        with open(path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buf, path=path, **kw)
+
+    @classmethod
+    def in_memory(cls, length: int, seed: Optional[bytes] = None, **kw) -> "HashChain":
+        return cls(build(length, seed), **kw)
+
+    # --------- cadena ----------
+    @property
+    def terminal(self) -> str:
+        return self.hash(0)
+
+    def hash(self, game: int) -> str:
+        return bytes(self._buf[game * H:(game + 1) * H]).hex()
+
+    def outcome(self, game: int) -> float:
+        return crash_multiplier(self.hash(game), self.salt, game, self.house_edge)
+
+    # --------- cursor ----------
+    def _load_cursor(self) -> int:
+        if not self.path:
+            return 1
+        try:
+            with open(f"{self.path}.pos") as f:
+                return max(1, int(f.read().strip()))
+        except (OSError, ValueError):
+            return 1
+
+    def _save_cursor(self, cursor: int) -> None:
+        if not self.path:
+            return
+        with self._cursor_lock:
+            if cursor <= self._saved:
+                return  # otro escritor ya dejó uno igual o más adelante
+            tmp = f"{self.path}.pos.tmp"
+            with open(tmp, "w") as f:
+                f.write(str(cursor))
+            os.replace(tmp, f"{self.path}.pos")
+            self._saved = cursor
+
+    def _reserve(self, n: int) -> Tuple[int, int]:
+        start = self.cursor
+        n = min(n, self.length + 1 - start)
+        if n <= 0:
+            raise RuntimeError("CHAIN_EXHAUSTED")
+        self.cursor = start + n
+        return start, n
+
+    def _fill(self, start: int, n: int) -> None:
+        # corre en el hilo de la cadena; el cursor se persiste antes de entregar
+        self._save_cursor(start + n)
+        self._ahead.extend((g, self.outcome(g)) for g in range(start, start + n))
+
+    # --------- resultados ----------
+    def ensure_lookahead(self) -> None:
+        """Agenda el cálculo del próximo bloque si quedan pocos resultados."""
+        if self._filling is not None and not self._filling.done():
+            return
+        if len(self._ahead) > self.lookahead // 2 or self.cursor > self.length:
+            return
+        start, n = self._reserve(self.lookahead)
+        self._filling = self._executor.submit(self._fill, start, n)
+
+    def take(self) -> Tuple[int, float]:
+        """Próximo ``(juego, multiplicador)``; siempre en orden creciente."""
+        g = self._next
+        ahead = self._ahead
+        while ahead and ahead[0][0] < g:
+            ahead.popleft()  # ya se calcularon de forma sincrónica
+        if ahead and ahead[0][0] == g:
+            _, m = ahead.popleft()
+        else:
+            # el buffer no llegó: un solo HMAC en el momento
+            if g >= self.cursor:
+                self._reserve(1)
+                self._save_cursor(self.cursor)
+            m = self.outcome(g)
+        self._next = g + 1
+        self._live.add(g)
+        return g, m
+
+    def reveal(self, game: int) -> int:
+        """Marca ``game`` como terminado; devuelve hasta qué juego se puede
+        publicar (con varias salas, uno posterior puede terminar antes)."""
+        self._live.discard(game)
+        return min(self._live) - 1 if self._live else self._next - 1
+
+    def _links(self, start: int, end: int) -> bool:
+        """``sha256(h[g]) == h[g-1]`` para cada ``g`` de ``[start, end]``."""
+        buf, sha = self._buf, hashlib.sha256
+        return all(sha(buf[g * H:(g + 1) * H]).digest() == buf[(g - 1) * H:g * H] for g in range(start, end + 1))
+
+    def verify(self, start: int, end: int) -> Dict:
+        """Comprueba sólo el tramo ``[start, end]`` y que ``h[start-1]`` llegue
+        a ``h[0]``. Esa segunda parte se recorre una sola vez por proceso:
+        ``_verified`` es el último juego ya enlazado con el terminal, así que
+        cada consulta cuesta O(end - start) salvo la primera que pasa de ahí."""
+        ok = self._links(start, end)
+        verified = self._verified
+        if ok and start - 1 > verified:
+            ok = self._links(verified + 1, start - 1)
+        if ok:
+            # puede correr en varios hilos: el máximo nunca retrocede
+            self._verified = max(self._verified, end)
+        rounds: List[Dict] = [
+            {"game": g, "hash": self.hash(g), "crash_at": self.outcome(g)} for g in range(start, end + 1)
+        ]
+        return {"terminal": self.terminal, "ok": ok, "rounds": rounds}
+
+_default: Optional[HashChain] = None
+
+
+def default_chain() -> HashChain:
+    """Cadena del proceso: la de ``CRASH_CHAIN_PATH`` o una en memoria."""
+    global _default
+    if _default is None:
+        if CRASH_CHAIN_PATH:
+            if not os.path.exists(CRASH_CHAIN_PATH):
+                # varios workers pueden arrancar juntos: genera uno solo
+                with open(f"{CRASH_CHAIN_PATH}.gen.lock", "w") as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    if not os.path.exists(CRASH_CHAIN_PATH):
+                        generate(CRASH_CHAIN_PATH, CRASH_CHAIN_LENGTH)
+            _default = HashChain.open(CRASH_CHAIN_PATH)
+        else:
+            _default = HashChain.in_memory(CRASH_CHAIN_LENGTH)
+    return _default
+
+
+if __name__ == "__main__":  # pragma: no cover - herramienta de operación
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m api.crash.hashchain <path> <length>")
+    generate(sys.argv[1], int(sys.argv[2]))
+    print(HashChain.open(sys.argv[1]).terminal)
@@ -0,0 +1,96 @@
+"""Historial en memoria de las últimas rondas del crash.
+
+Un ring buffer de tamaño fijo (``CRASH_HISTORY_SIZE``) con lo necesario para
+la tira de últimas rondas: id, crash_at, jugadores, total apostado y total
+pagado. El cuerpo JSON y su ETag se arman una vez por ronda, así que leer el
+historial nunca toca la base; sólo se lee de ``crash_rounds`` al arrancar.
+"""
+import json
+import logging
+import os
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy import func, select
+
+from .. import db
+from ..models import CrashBet, CrashRound
+
+CRASH_HISTORY_SIZE = int(os.getenv("CRASH_HISTORY_SIZE", "50"))
+
+logger = logging.getLogger("uvicorn")
+
+
+class RoundHistory:
+    def __init__(self, size: int = CRASH_HISTORY_SIZE) -> None:
+        self._rounds: Deque[Dict] = deque(maxlen=size)  # la más reciente primero
+        self._render()
+
+    def __len__(self) -> int:
+        return len(self._rounds)
+
+    def add(self, rid: str, crash_at: float, players: int, wagered: float, paid: float) -> Dict:
+        entry = {
+            "rid": rid,
+            "crash_at": crash_at,
+            "players": players,
+            "wagered": round(wagered, 2),
+            "paid": round(paid, 2),
+        }
+        self._rounds.appendleft(entry)
+        self._render()
+        return entry
+
+    def extend(self, entries: List[Dict]) -> None:
+        """Carga rondas viejas (la más reciente primero) detrás de las actuales."""
+        for e in entries:
+            if len(self._rounds) == self._rounds.maxlen:
+                break
+            self._rounds.append(e)
+        self._render()
+
+    def items(self) -> List[Dict]:
+        return list(self._rounds)
+
+    def _render(self) -> None:
+        # el id de la última ronda identifica el contenido en todos los workers
+        items = self.items()
+        self.body = json.dumps(items, separators=(",", ":")).encode()
+        self.etag = f'"{items[0]["rid"]}"' if items else '"empty"'
+
+    async def warm(self, room: Optional[str] = None) -> None:
+        """Precarga el buffer con las últimas rondas guardadas de la sala
+        (``room`` como en ``crash_rounds.room``: None es la sala por defecto)."""
+        n = self._rounds.maxlen or 0
+        same_room = CrashRound.room.is_(None) if room is None else CrashRound.room == room
+        stmt = (
+            select(
+                CrashRound.id,
+                CrashRound.crash_at,
+                func.count(CrashBet.id),
+                func.coalesce(func.sum(CrashBet.amount), 0),
+                func.coalesce(func.sum(CrashBet.payout), 0),
+            )
+            .outerjoin(CrashBet, CrashBet.round_id == CrashRound.id)
+            .where(same_room)
+            .group_by(CrashRound.id, CrashRound.crash_at, CrashRound.created_at)
+            .order_by(CrashRound.created_at.desc())
+            .limit(n)
+        )
+        try:
+            async with db.AsyncSessionLocal() as s:
+                rows = (await s.execute(stmt)).all()
+        except Exception:
+            logger.exception("crash history: warm-up failed")
+            return
+        self.extend([
+            {
+                "rid": rid,
+                "crash_at": float(at),
+                "players": players,
+                "wagered": round(float(w), 2),
+                "paid": round(float(p), 2),
+            }
+            for rid, at, players, w, p in rows
+            if not any(r["rid"] == rid for r in self._rounds)
+        ])
@@ -0,0 +1,29 @@
+"""Métricas del loop de ticks del crash (en el registry de ``/metrics``).
+
+- ``crash_tick_lateness_seconds``: cuánto después de su deadline despertó el tick.
+- ``crash_tick_work_seconds``: trabajo del tick (multiplicador, autos, fan-out).
+- ``crash_tick_broadcast_seconds``: sólo la publicación del outbox.
+- ``crash_ticks_skipped_total``: ticks salteados por ir atrasados.
+
+Si la latencia crece, el event loop está saturado antes de que se note en
+los clientes.
+"""
+from prometheus_client import Counter, Histogram
+
+from ..routers.metrics import registry
+
+# de 0.5 ms a 1 s: un tick dura CRASH_TICK_MS (100 ms por defecto)
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+TICK_LATENESS = Histogram(
+    "crash_tick_lateness_seconds", "Crash tick wake-up delay past its deadline", buckets=_BUCKETS, registry=registry
+)
+TICK_WORK = Histogram(
+    "crash_tick_work_seconds", "Crash tick processing time", buckets=_BUCKETS, registry=registry
+)
+TICK_BROADCAST = Histogram(
+    "crash_tick_broadcast_seconds", "Crash tick outbox publish time", buckets=_BUCKETS, registry=registry
+)
+TICKS_SKIPPED = Counter(
+    "crash_ticks_skipped", "Crash ticks skipped because the loop fell behind", registry=registry
+)
@@ -0,0 +1,193 @@
+"""Varias salas de crash en un solo proceso con un único timer.
+
+Cada sala es un ``CrashEngine`` independiente (su ronda, apuestas, sockets e
+historial). En vez de una tarea asyncio por sala, un ``Scheduler`` mantiene
+un heap con el próximo despertar de cada una y llama sus pasos
+(``_begin_round`` / ``_tick`` / ``_crash`` / ``_reset``) desde una sola tarea.
+Una sala sin ronda en curso no cuesta nada.
+
+Se configuran con ``CRASH_ROOMS`` (p.ej. ``vip,low,ar``) y se sirven en
+``/crash/{room}/...``; ``CRASH_DEFAULT_ROOM`` es la de ``/crash/...``.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from . import engine as _engine
+from .clock import REAL_CLOCK, Clock, resolve
+from .engine import CrashEngine
+
+CRASH_DEFAULT_ROOM = os.getenv("CRASH_DEFAULT_ROOM", "main")
+CRASH_ROOMS = [r.strip() for r in os.getenv("CRASH_ROOMS", "").split(",") if r.strip()]
+
+logger = logging.getLogger("uvicorn")
+
+
+def stored_room(room: Optional[str]) -> Optional[str]:
+    """La sala como queda en ``crash_rounds.room``: NULL es la sala por
+    defecto (y las rondas guardadas antes de que hubiera salas)."""
+    return None if room is None or room == CRASH_DEFAULT_ROOM else room
+
+
+class Scheduler:
+    """Timer compartido: heap de ``(cuándo, n, sala, generación)``."""
+
+    def __init__(self, clock: Optional[Clock] = None) -> None:
+        self.clock: Clock = clock if clock is not None else REAL_CLOCK
+        self._heap: List[Tuple[float, int, CrashEngine, int]] = []
+        self._n = itertools.count()
+        # paso pendiente por sala: begin | tick | reset; la generación
+        # invalida las entradas viejas del heap al reprogramar
+        self._step: Dict[CrashEngine, str] = {}
+        self._gen: Dict[CrashEngine, int] = {}
+        self._settling: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._waker: Optional[asyncio.Future] = None
+        self.wakeups = 0  # pasos ejecutados (para métricas/tests)
+
+    def __len__(self) -> int:
+        return len(self._step)  # salas con una ronda en curso
+
+    def _ensure_task(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._task = loop.create_task(self._run())
+
+    def start(self, engine: CrashEngine) -> None:
+        """Arranca la ronda de ``engine`` (se llama desde ``place_bet``)."""
+        self._ensure_task()
+        if engine not in self._step:
+            self._schedule(engine, "begin", self.clock.now())
+
+    def wake(self, engine: CrashEngine) -> None:
+        # modo events: un suscriptor nuevo adelanta el próximo tick
+        if self._step.get(engine) == "tick":
+            self._schedule(engine, "tick", self.clock.now())
+
+    def _schedule(self, engine: CrashEngine, step: str, when: float) -> None:
+        gen = self._gen.get(engine, 0) + 1
+        self._gen[engine] = gen
+        self._step[engine] = step
+        heapq.heappush(self._heap, (when, next(self._n), engine, gen))
+        if self._heap[0][2] is engine and self._waker is not None and not self._waker.done():
+            self._waker.set_result(None)  # hay algo antes de lo que se esperaba
+
+    async def _sleep(self, until: Optional[float]) -> None:
+        loop = asyncio.get_running_loop()
+        self._waker = fut = loop.create_future()
+        handle = None
+        if until is not None:
+            handle = self.clock.call_at(until, resolve, fut)
+        try:
+            await fut
+        finally:
+            if handle:
+                handle.cancel()
+            self._waker = None
+
+    async def _run(self) -> None:
+        # al cancelarla (apagado) las rondas en curso quedan como están: el
+        # proceso no decide su resultado, lo hace restore() con el snapshot
+        heap = self._heap
+        while True:
+            if not heap:
+                await self._sleep(None)
+                continue
+            now = self.clock.now()
+            if heap[0][0] > now:
+                await self._sleep(heap[0][0])
+                continue
+            while heap and heap[0][0] <= now:
+                when, _, engine, gen = heapq.heappop(heap)
+                if self._gen.get(engine) != gen:
+                    continue  # reprogramada
+                self.wakeups += 1
+                try:
+                    self._dispatch(engine, when, now)
+                except Exception:
+                    logger.exception("crash room %s: step failed", engine.room)
+                    self._abort(engine)
+            await asyncio.sleep(0)  # no monopoliza el loop con muchas salas
+
+    def _dispatch(self, engine: CrashEngine, when: float, now: float) -> None:
+        step = self._step[engine]
+        if step == "begin":
+            engine._begin_round()
+            self._schedule(engine, "tick", engine._next_wake())
+        elif step == "tick":
+            if engine._tick(now, when):
+                losers = engine._crash()
+                task = asyncio.create_task(engine._settle_losers(engine.round_id, losers))
+                self._settling.add(task)
+                task.add_done_callback(self._settling.discard)
+                self._schedule(engine, "reset", now + _engine.CRASH_INTERMISSION_SECONDS)
+            else:
+                self._schedule(engine, "tick", engine._next_wake())
+        else:
+            self._forget(engine)
+            engine._reset()
+
+    def _forget(self, engine: CrashEngine) -> None:
+        self._step.pop(engine, None)
+        self._gen[engine] = self._gen.get(engine, 0) + 1
+
+    def _abort(self, engine: CrashEngine) -> None:
+        step = self._step.get(engine)
+        self._forget(engine)
+        if step == "tick":
+            engine._crash()
+        engine._reset()
+
+    async def stop(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # las rondas siguen como estaban; sólo se olvida lo programado
+        self._heap.clear()
+        self._step.clear()
+
+
+class RoomRegistry:
+    """Salas por nombre, todas movidas por el mismo ``Scheduler``."""
+
+    def __init__(
+        self,
+        factory: Callable[[], CrashEngine],
+        rooms: Optional[List[str]] = None,
+        clock: Optional[Clock] = None,
+    ) -> None:
+        self.factory = factory
+        # las salas tienen que usar el mismo reloj que el scheduler
+        self.scheduler = Scheduler(clock)
+        self._rooms: Dict[str, CrashEngine] = {}
+        for room in rooms or ():
+            self.add(room)
+
+    def __len__(self) -> int:
+        return len(self._rooms)
+
+    def __contains__(self, room: str) -> bool:
+        return room in self._rooms
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._rooms)
+
+    def add(self, room: str, engine: Optional[CrashEngine] = None) -> CrashEngine:
+        if room in self._rooms:
+            raise RuntimeError("ROOM_EXISTS")
+        engine = engine if engine is not None else self.factory()
+        engine.room = room
+        engine.scheduler = self.scheduler
+        self._rooms[room] = engine
+        return engine
+
+    def get(self, room: str) -> Optional[CrashEngine]:
+        return self._rooms.get(room)
@@ -1,27 +1,52 @@
-from decimal import Decimal
+import asyncio
+import os
+from functools import partial
+from urllib.parse import urlsplit
 
-from fastapi import APIRouter, Depends, HTTPException, WebSocket
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, WebSocket
 from pydantic import BaseModel, Field
-from sqlalchemy import select
-from sqlalchemy.orm import Session
 
-from ..auth import get_current_user
-from .. import db
-from ..models import CrashBet, CrashRound, User
-from ..services.wallet import apply_transaction
+from ..auth import get_current_user_async, get_ws_user
+from ..models import User
+from .commands import CommandChannel, cash_out, place_bet
 from .engine import CrashEngine, CRASH_MIN_BET
+from .settlement import pipeline, settle_losers
+from .codec import BINARY_SUBPROTOCOL, CODECS
+from .fanout import STREAM_MODES
+from .rooms import CRASH_DEFAULT_ROOM
 
 router = APIRouter(prefix="/crash", tags=["crash"])
 
+# máximo de rondas por consulta a /crash/verify
+CRASH_VERIFY_MAX = int(os.getenv("CRASH_VERIFY_MAX", "1000"))
 
-def get_engine() -> CrashEngine:
-    # Asumimos engine en app.state (configurado en main.py)
+
+def get_engine(room: str = CRASH_DEFAULT_ROOM) -> CrashEngine:
+    # Asumimos engine en app.state (configurado en main.py); /crash/{room}/...
+    # busca la sala en el registro
     from api.main import app
-    return app.state.crash_engine  # type: ignore
+    if room == CRASH_DEFAULT_ROOM:
+        return app.state.crash_engine  # type: ignore
+    engine = app.state.crash_rooms.get(room)
+    if engine is None:
+        raise HTTPException(status_code=404, detail="NO_SUCH_ROOM")
+    return engine
+
+
+@router.get("/rooms")
+async def rooms():
+    from api.main import app
+    registry = app.state.crash_rooms
+    out = []
+    for name in registry:
+        e = registry.get(name)
+        out.append({"room": name, "phase": e.phase, "rid": e.round_id, "players": len(e.bets)})
+    return out
 
 
 @router.get("/state")
-async def state(user: User = Depends(get_current_user), engine: CrashEngine = Depends(get_engine)):
+@router.get("/{room}/state")
+async def state(user: User = Depends(get_current_user_async), engine: CrashEngine = Depends(get_engine)):
     return await engine.state(user.id)
 
 class BetIn(BaseModel):
@@ -30,13 +55,15 @@ class BetIn(BaseModel):
 
 
 @router.post("/bet", status_code=201)
+@router.post("/{room}/bet", status_code=201)
 async def bet(
     body: BetIn,
     engine: CrashEngine = Depends(get_engine),
-    user: User = Depends(get_current_user),
+    user: User = Depends(get_current_user_async),
 ):
     try:
-        await engine.place_bet(user.id, body.amount, body.auto_cashout)
+        # débito + CrashBet en el próximo lote del pipeline
+        await place_bet(engine, user.id, body.amount, body.auto_cashout)
     except ValueError as e:
         if str(e) == "MIN_BET":
             raise HTTPException(status_code=422, detail=f"amount must be >= {CRASH_MIN_BET}")
@@ -44,77 +71,116 @@ async def bet(
     except RuntimeError as e:
         code = 409 if str(e) in {"NOT_BETTING", "ALREADY_BET"} else 400
         raise HTTPException(status_code=code, detail=str(e))
-
-    with Session(db.engine) as s, s.begin():
-        if not s.get(CrashRound, engine.round_id):
-            s.add(CrashRound(id=engine.round_id, crash_at=engine.crash_at or 0.0))
-        apply_transaction(
-            s,
-            user.id,
-            Decimal(str(-body.amount)),
-            "crash_bet",
-            f"crash_bet:{engine.round_id}:{user.id}",
-        )
-        s.add(
-            CrashBet(
-                round_id=engine.round_id,
-                user_id=user.id,
-                amount=Decimal(str(body.amount)),
-            )
-        )
     return {"ok": True}
 
 @router.post("/cashout")
+@router.post("/{room}/cashout")
 async def cashout(
     engine: CrashEngine = Depends(get_engine),
-    user: User = Depends(get_current_user),
+    user: User = Depends(get_current_user_async),
 ):
     try:
-        data = await engine.cashout(user.id)
+        return await cash_out(engine, user.id)
     except RuntimeError as e:
         code = 409 if str(e) in {"NOT_RUNNING", "NO_ACTIVE_BET"} else 400
         raise HTTPException(status_code=code, detail=str(e))
 
-    with Session(db.engine) as s, s.begin():
-        bet = s.execute(
-            select(CrashBet).where(
-                CrashBet.round_id == engine.round_id, CrashBet.user_id == user.id
-            ).with_for_update()
-        ).scalar_one_or_none()
-        if bet and bet.status == "OPEN":
-            bet.status = "CASHED"
-            bet.cashout_multiplier = data["at"]
-            bet.payout = Decimal(str(data["payout"]))
-            apply_transaction(
-                s,
-                user.id,
-                Decimal(str(data["payout"])),
-                "crash_win",
-                f"crash_cashout:{engine.round_id}:{user.id}",
-            )
-    return data
+@router.get("/history")
+@router.get("/{room}/history")
+async def history(request: Request, engine: CrashEngine = Depends(get_engine)):
+    # sale del ring buffer del engine; el cuerpo ya está serializado
+    h = engine.history
+    headers = {"ETag": h.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == h.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(h.body, media_type="application/json", headers=headers)
+
+
+@router.get("/chain")
+async def chain(engine: CrashEngine = Depends(get_engine)):
+    if engine.chain is None:
+        raise HTTPException(status_code=503, detail="CHAIN_UNAVAILABLE")
+    c = engine.chain
+    return {
+        "terminal": c.terminal,
+        "length": c.length,
+        "salt": c.salt,
+        "house_edge": c.house_edge,
+        "game": engine.game,
+        "revealed": engine.revealed,
+    }
+
+
+@router.get("/verify")
+async def verify(start: int, end: int, engine: CrashEngine = Depends(get_engine)):
+    # sólo juegos ya jugados: revelar uno futuro regalaría el resultado
+    if engine.chain is None:
+        raise HTTPException(status_code=503, detail="CHAIN_UNAVAILABLE")
+    if not 1 <= start <= end <= engine.revealed:
+        raise HTTPException(status_code=400, detail="BAD_RANGE")
+    if end - start + 1 > CRASH_VERIFY_MAX:
+        raise HTTPException(status_code=400, detail="RANGE_TOO_LARGE")
+    # hashes del tramo (y, la primera vez, hasta h[0]): fuera del event loop
+    return await asyncio.to_thread(engine.chain.verify, start, end)
+
+
+def _origin_allowed(ws: WebSocket) -> bool:
+    # el navegador manda la cookie (samesite=none) desde cualquier página: un
+    # socket abierto desde otro origen podría apostar como el usuario
+    origin = ws.headers.get("origin")
+    if origin is None:
+        return True  # no es un navegador: la cookie no viaja sola
+    from api.main import ALLOWED_ORIGINS
+    return origin in ALLOWED_ORIGINS or urlsplit(origin).netloc == ws.headers.get("host")
+
 
 @router.websocket("/stream")
-async def stream(ws: WebSocket, engine: CrashEngine = Depends(get_engine)):
-    await engine.subscribe(ws)
+@router.websocket("/{room}/stream")
+async def stream(
+    ws: WebSocket,
+    mode: str = "ticks",
+    fmt: str = "json",
+    batch: bool = True,
+    since: int | None = None,
+    ep: int | None = None,
+    engine: CrashEngine = Depends(get_engine),
+):
+    # mode=keyframes: sin ticks, sólo start/sync + eventos; el cliente extrapola
+    if mode not in STREAM_MODES:
+        mode = "ticks"
+    # binario por subprotocolo (crash.bin.v1) o ?fmt=bin1; JSON por defecto
+    subprotocol = None
+    if BINARY_SUBPROTOCOL in ws.scope.get("subprotocols", []):
+        fmt, subprotocol = "bin1", BINARY_SUBPROTOCOL
+    if fmt not in CODECS:
+        fmt = "json"
+    if not _origin_allowed(ws):
+        await ws.close(code=1008)
+        return
+    # batch=0: compatibilidad con clientes que esperan los eventos de a uno
+    # since=<seq>&ep=<epoch>: al reconectar llegan sólo los eventos perdidos
+    # (o un state si el epoch no es el de este arranque)
+    # con cookie/header el socket ya viene autenticado; si no, es espectador
+    # hasta que mande {"op": "auth"}
+    try:
+        user = await get_ws_user(ws)
+    except HTTPException:
+        user = None
+    await engine.subscribe(ws, mode, fmt, subprotocol, batch, since, ep)
+    # bet/cashout/state con id y ack por la misma cola que los eventos;
+    # las tareas no se cancelan al cortar: son movimientos de plata
+    channel = CommandChannel(ws, engine, user.id if user else None)
     try:
         while True:
-            # Sólo mantenemos viva la conexión; el engine hace broadcast
-            await ws.receive_text()
+            channel.handle(await ws.receive_text())
     except Exception:
         pass
+    finally:
+        engine.unsubscribe(ws)
 
 
 async def handle_crash(round_id: str, losers: list[str]):
     """Mark losing bets as lost in the database."""
     if not losers:
         return
-    with Session(db.engine) as s, s.begin():
-        s.execute(
-            select(CrashBet)  # dummy select to ensure table exists in tests
-        )
-        s.query(CrashBet).filter(
-            CrashBet.round_id == round_id,
-            CrashBet.user_id.in_(losers),
-            CrashBet.status == "OPEN",
-        ).update({"status": "LOST", "payout": Decimal("0")}, synchronize_session=False)
+    await pipeline.submit(partial(settle_losers, round_id, losers))
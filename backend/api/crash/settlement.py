@@ -0,0 +1,301 @@
+"""Pipeline de liquidación en lote para apuestas y cashouts del crash.
+
+Los handlers encolan una operación y esperan su resultado; un único flusher
+toma lo acumulado (hasta ``CRASH_SETTLE_BATCH`` operaciones, esperando
+``CRASH_SETTLE_MS`` si se configura) y lo aplica en una sola transacción
+con ``AsyncSessionLocal`` (asyncpg / aiosqlite): ninguna llamada a la base
+bloquea el event loop.
+
+Las apuestas y cashouts consecutivos del lote se aplican juntos (``BULK``):
+un ``apply_transactions_bulk`` y un executemany por tramo, con sentencias
+armadas una sola vez. El resto de las operaciones corre de a una, cada una en
+su savepoint.
+
+El orden de encolado se respeta dentro y entre lotes. Las claves de
+idempotencia son las mismas de siempre (``crash_bet:<ronda>:<user>``...). Un
+rechazo de negocio (``HTTPException``, p.ej. saldo insuficiente) sólo falla su
+operación y no deja nada escrito; cualquier otro error hace que el lote se
+reintente de a una.
+"""
+import asyncio
+import os
+from decimal import Decimal
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, cast
+
+from fastapi import HTTPException
+from sqlalchemy import Table, bindparam, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import db
+from ..models import CrashBet, CrashRound
+from ..services.wallet import Movement, apply_transactions_bulk_async
+
+# 0 = sin espera: se junta lo que llegue mientras corre el lote anterior
+CRASH_SETTLE_MS = int(os.getenv("CRASH_SETTLE_MS", "0"))
+CRASH_SETTLE_BATCH = int(os.getenv("CRASH_SETTLE_BATCH", "500"))
+
+# await op(session, ctx) -> resultado; ctx es un cache compartido por el lote
+Op = Callable[[AsyncSession, Dict[str, Any]], Awaitable[Any]]
+
+
+# sentencias armadas una vez: por lote sólo cambian los parámetros
+# (Core sobre las tablas: executemany simple, sin el bulk ORM)
+_bets = cast(Table, CrashBet.__table__)
+_FIND_ROUNDS = select(CrashRound.id).where(CrashRound.id.in_(bindparam("ids", expanding=True)))
+_INSERT_ROUNDS = insert(cast(Table, CrashRound.__table__))
+_INSERT_BETS = insert(_bets)
+_OPEN_BETS = (
+    select(_bets.c.id, _bets.c.round_id, _bets.c.user_id)
+    .where(
+        _bets.c.round_id.in_(bindparam("rids", expanding=True)),
+        _bets.c.user_id.in_(bindparam("uids", expanding=True)),
+        _bets.c.status == "OPEN",
+    )
+    .with_for_update()
+)
+_CASH_BETS = (
+    update(_bets)
+    .where(_bets.c.id == bindparam("bet_id"))
+    .values(status="CASHED", cashout_multiplier=bindparam("at"), payout=bindparam("pay"))
+)
+
+
+async def settle_bets(s: AsyncSession, ctx: Dict[str, Any], bets: Sequence[Tuple[str, Optional[float], str, float, Optional[str]]]) -> List[Optional[HTTPException]]:
+    """Versión en lote de :func:`settle_bet`: un solo ``apply_transactions_bulk``
+    para los débitos y un INSERT multi-fila para las apuestas. Devuelve, por
+    apuesta, None o el ``HTTPException`` que la rechazó (sin escribir nada)."""
+    debits: List[Movement] = [
+        (user_id, Decimal(str(-amount)), "crash_bet", f"crash_bet:{round_id}:{user_id}")
+        for round_id, _, user_id, amount, _ in bets
+    ]
+    results = await apply_transactions_bulk_async(s, debits)
+    ok = [bet for bet, r in zip(bets, results) if not isinstance(r, HTTPException)]
+    rounds = ctx.setdefault("rounds", set())
+    new = {round_id: (crash_at, room) for round_id, crash_at, _, _, room in ok if round_id not in rounds}
+    if new:
+        found = set(await s.scalars(_FIND_ROUNDS, {"ids": list(new)}))
+        missing = [{"id": r, "crash_at": at or 0.0, "room": room} for r, (at, room) in new.items() if r not in found]
+        if missing:
+            await s.execute(_INSERT_ROUNDS, missing)
+        rounds.update(new)
+    # la misma apuesta repetida en el lote se registra una vez (el débito también)
+    rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for round_id, _, user_id, amount, _ in ok:
+        rows.setdefault((round_id, user_id), {"round_id": round_id, "user_id": user_id, "amount": Decimal(str(amount))})
+    if rows:
+        await s.execute(_INSERT_BETS, list(rows.values()))
+    return [r if isinstance(r, HTTPException) else None for r in results]
+
+
+async def settle_bet(round_id: str, crash_at: Optional[float], user_id: str, amount: float, room: Optional[str], s: AsyncSession, ctx: Dict[str, Any]):
+    # el débito va primero: si no hay saldo no se escribe nada más;
+    # room: la sala de la ronda en crash_rounds (None = la sala por defecto)
+    rejected = (await settle_bets(s, ctx, [(round_id, crash_at, user_id, amount, room)]))[0]
+    if rejected is not None:
+        raise rejected
+
+
+async def settle_cashouts(s: AsyncSession, ctx: Dict[str, Any], cashouts: Sequence[Tuple[str, str, float, float]]) -> List[None]:
+    """Versión en lote de :func:`settle_cashout`: una lectura de las apuestas
+    abiertas, un UPDATE executemany y un ``apply_transactions_bulk`` para los
+    créditos. Una apuesta ya cobrada (o repetida en el lote) no paga de nuevo."""
+    hits: Dict[Tuple[str, str], Tuple[float, float]] = {}
+    for round_id, user_id, at, payout in cashouts:
+        hits.setdefault((round_id, user_id), (at, payout))
+    params = {"rids": list({r for r, _ in hits}), "uids": list({u for _, u in hits})}
+    cashed: List[Dict[str, Any]] = []
+    credits: List[Movement] = []
+    for bet_id, round_id, user_id in await s.execute(_OPEN_BETS, params):
+        hit = hits.get((round_id, user_id))
+        if hit is None:
+            continue
+        pay = Decimal(str(hit[1]))
+        cashed.append({"bet_id": bet_id, "at": hit[0], "pay": pay})
+        credits.append((user_id, pay, "crash_win", f"crash_cashout:{round_id}:{user_id}"))
+    if cashed:
+        await s.execute(_CASH_BETS, cashed)
+        await apply_transactions_bulk_async(s, credits)
+    return [None] * len(cashouts)
+
+
+async def settle_cashout(round_id: str, user_id: str, at: float, payout: float, s: AsyncSession, ctx: Dict[str, Any]):
+    await settle_cashouts(s, ctx, [(round_id, user_id, at, payout)])
+
+
+async def settle_losers(round_id: str, losers: List[str], s: AsyncSession, ctx: Dict[str, Any]):
+    await s.execute(
+        update(CrashBet)
+        .where(
+            CrashBet.round_id == round_id,
+            CrashBet.user_id.in_(losers),
+            CrashBet.status == "OPEN",
+        )
+        .values(status="LOST", payout=Decimal("0"))
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def settle_interrupted(round_id: str, cashed: Dict[str, Tuple[float, float]], crashed: bool, s: AsyncSession, ctx: Dict[str, Any]):
+    """Cierra una ronda cortada por un reinicio con una sola lectura de sus
+    apuestas abiertas: ``cashed`` cobra, el resto pierde si la ronda llegó a
+    crashear o se devuelve (cobro a 1.00x) si no. Los créditos van juntos en un
+    solo ``apply_transactions_bulk``."""
+    bets = (
+        await s.execute(
+            select(CrashBet).where(
+                CrashBet.round_id == round_id, CrashBet.status == "OPEN"
+            ).with_for_update()
+        )
+    ).scalars().all()
+    credits: List[Movement] = []
+    for bet in bets:
+        hit = cashed.get(bet.user_id)
+        if hit is None and crashed:
+            bet.status = "LOST"
+            bet.payout = Decimal("0")
+            continue
+        at, payout = hit if hit is not None else (1.0, bet.amount)
+        bet.status = "CASHED"
+        bet.cashout_multiplier = at
+        bet.payout = Decimal(str(payout))
+        # misma clave que el cashout: una apuesta se acredita una sola vez
+        credits.append((
+            bet.user_id,
+            bet.payout,
+            "crash_win" if hit is not None else "crash_refund",
+            f"crash_cashout:{round_id}:{bet.user_id}",
+        ))
+    await apply_transactions_bulk_async(s, credits)
+
+
+# ops que el lote aplica juntas: func de la op -> su versión en lote, que
+# recibe los args de cada ``partial`` y devuelve un resultado por op
+BULK: Dict[Callable[..., Any], Callable[..., Awaitable[List[Any]]]] = {
+    settle_bet: settle_bets,
+    settle_cashout: settle_cashouts,
+}
+
+
+def _bulk_of(op: Op) -> Optional[Callable[..., Awaitable[List[Any]]]]:
+    if isinstance(op, partial) and not op.keywords:
+        return BULK.get(op.func)
+    return None
+
+
+def _runs(ops: List[Op]) -> Iterator[List[Op]]:
+    """Tramos consecutivos de ops con la misma versión en lote (el orden se
+    respeta); las que no tienen van de a una."""
+    run: List[Op] = []
+    for op in ops:
+        if run and (_bulk_of(op) is None or _bulk_of(op) is not _bulk_of(run[0])):
+            yield run
+            run = []
+        run.append(op)
+    if run:
+        yield run
+
+
+class SettlementPipeline:
+    def __init__(
+        self,
+        window_ms: int = CRASH_SETTLE_MS,
+        max_batch: int = CRASH_SETTLE_BATCH,
+        sessions: Optional[Callable[[], AsyncSession]] = None,
+    ) -> None:
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        # fábrica de sesiones propia (p.ej. el benchmark); None = db.AsyncSessionLocal
+        self.sessions = sessions
+        self._pending: List[Tuple[Op, asyncio.Future]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0  # lotes aplicados (para métricas/tests)
+
+    def _ensure_flusher(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # loop nuevo (tests, reload): lo pendiente del viejo no se puede resolver
+            self._loop, self._pending = loop, []
+            self._wake, self._task = asyncio.Event(), None
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._flusher())
+
+    async def submit(self, op: Op):
+        """Encola ``op`` y espera a que se aplique el lote que la contiene."""
+        self._ensure_flusher()
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((op, fut))
+        assert self._wake is not None
+        self._wake.set()
+        return await fut
+
+    async def _flusher(self) -> None:
+        wake = self._wake
+        assert wake is not None
+        batch: List[Tuple[Op, asyncio.Future]] = []
+        try:
+            while True:
+                await wake.wait()
+                wake.clear()
+                if self.window_ms > 0 and len(self._pending) < self.max_batch:
+                    await asyncio.sleep(self.window_ms / 1000.0)
+                while self._pending:
+                    batch = self._pending[: self.max_batch]
+                    del self._pending[: self.max_batch]
+                    ops = [op for op, _ in batch]
+                    # un solo flusher: los lotes nunca se pisan
+                    results = await self._run_batch(ops)
+                    self.batches += 1
+                    for (_, fut), (ok, value) in zip(batch, results):
+                        if fut.done():
+                            continue
+                        if ok:
+                            fut.set_result(value)
+                        else:
+                            fut.set_exception(value)
+                    batch = []
+        except asyncio.CancelledError:
+            # apagado: nadie se queda esperando un lote que no va a llegar
+            for _, fut in batch + self._pending:
+                if not fut.done():
+                    fut.set_exception(RuntimeError("SETTLEMENT_STOPPED"))
+            self._pending = []
+            raise
+
+    async def _run_batch(self, ops: List[Op]) -> List[Tuple[bool, Any]]:
+        results: List[Tuple[bool, Any]] = []
+        try:
+            async with self._session() as s, s.begin():
+                ctx: Dict[str, Any] = {}
+                for run in _runs(ops):
+                    bulk = _bulk_of(run[0])
+                    if bulk is not None:
+                        # un rechazo en lote no escribe nada: no hace falta savepoint
+                        out = await bulk(s, ctx, [cast(partial, op).args for op in run])
+                        results.extend((not isinstance(r, HTTPException), r) for r in out)
+                        continue
+                    try:
+                        # savepoint: lo que escribió una op rechazada se deshace
+                        async with s.begin_nested():
+                            results.append((True, await run[0](s, ctx)))
+                    except HTTPException as exc:
+                        results.append((False, exc))
+        except Exception:
+            # la transacción del lote falló: se aísla cada operación
+            return [await self._run_one(op) for op in ops]
+        return results
+
+    def _session(self) -> AsyncSession:
+        return (self.sessions or db.AsyncSessionLocal)()
+
+    async def _run_one(self, op: Op) -> Tuple[bool, Any]:
+        try:
+            async with self._session() as s, s.begin():
+                return True, await op(s, {})
+        except Exception as exc:
+            return False, exc
+
+
+pipeline = SettlementPipeline()
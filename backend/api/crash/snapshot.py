@@ -0,0 +1,150 @@
+"""Snapshot en disco del estado del crash para sobrevivir a un reinicio.
+
+Cada ``CRASH_SNAPSHOT_MS`` se escribe (si cambió algo) un JSON compacto con la
+fase, la ronda, su arranque, el crash_at y el libro de apuestas, con rename
+atómico: un lector nunca ve un archivo a medio escribir. Las apuestas ya están
+debitadas, así que al arrancar la ronda cortada se cierra en un solo lote:
+
+- las cobradas (a mano o auto, incluidas las autos que la curva alcanzó
+  mientras el proceso estaba caído) se acreditan a su multiplicador;
+- el resto pierde si el reloj ya pasó el crash, o se devuelve si no.
+
+Con salas, cada una usa ``<CRASH_SNAPSHOT_PATH>.<sala>``.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+from functools import partial
+from typing import Dict, Optional, Tuple
+
+from . import engine as _engine
+from .betbook import BetBook
+from .engine import CrashEngine
+from .rooms import CRASH_DEFAULT_ROOM
+from .settlement import pipeline, settle_interrupted
+
+CRASH_SNAPSHOT_PATH = os.getenv("CRASH_SNAPSHOT_PATH", "")  # vacío = sin snapshots
+CRASH_SNAPSHOT_MS = int(os.getenv("CRASH_SNAPSHOT_MS", "1000"))
+
+logger = logging.getLogger("uvicorn")
+
+
+def snapshot_path(room: Optional[str] = None, base: str = CRASH_SNAPSHOT_PATH) -> str:
+    return base if room in (None, CRASH_DEFAULT_ROOM) else f"{base}.{room}"
+
+
+def take(engine: CrashEngine) -> Dict:
+    # t0 es del reloj monotónico (no sobrevive al proceso): se guarda lo transcurrido + la hora
+    return {
+        "phase": engine.phase,
+        "rid": engine.round_id,
+        "at": engine.crash_at,
+        "g": engine.game,
+        "k": _engine.CRASH_GROWTH_RATE,
+        "e": engine._elapsed_ms(),
+        "wall": engine.clock.wall(),
+        "bets": engine.bets.dump(),
+    }
+
+
+def write(path: str, snap: Dict) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(snap, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.exception("crash snapshot: unreadable %s", path)
+        return None
+
+
+def outcome(snap: Dict, wall: float) -> Tuple[BetBook, bool, float]:
+    """Libro con los cobros resueltos, si la ronda crasheó y hasta dónde llegó
+    (``wall`` es la hora actual)."""
+    book = BetBook.load(snap["bets"])
+    crash_at = snap["at"] or math.inf
+    if snap["phase"] == "CRASHED":
+        crashed, m = True, crash_at
+    else:
+        elapsed = snap["e"] / 1000.0 + max(0.0, wall - snap["wall"])
+        m = math.exp(snap["k"] * elapsed)
+        crashed = m >= crash_at
+        m = min(m, crash_at)
+    # autos alcanzadas durante la caída: cobran a su objetivo
+    book.pop_due(m)
+    return book, crashed, m
+
+
+async def restore(engine: CrashEngine, path: str) -> bool:
+    """Cierra la ronda que dejó el snapshot; devuelve True si había una."""
+    snap = read(path)
+    if not snap or snap["phase"] == "BETTING" or not snap["bets"]["players"]:
+        return False
+    book, crashed, m = outcome(snap, engine.clock.wall())
+    cashed = {
+        p: (book.cash_at[i], book.payout[i])
+        for i, p in enumerate(book.players)
+        if not book.is_open(i)
+    }
+    try:
+        await pipeline.submit(partial(settle_interrupted, snap["rid"], cashed, crashed))
+    except Exception:
+        # el archivo queda: el próximo arranque lo reintenta (es idempotente)
+        logger.exception("crash snapshot: resettle of %s failed", snap["rid"])
+        return False
+    if crashed:
+        engine.history.add(snap["rid"], snap["at"], len(book), book.total_wagered(), book.total_paid())
+    os.remove(path)
+    logger.info("crash snapshot: closed round %s (%d bets)", snap["rid"], len(book))
+    return True
+
+
+class Snapshotter:
+    """Escribe el snapshot de un engine cada ``interval_ms`` si cambió."""
+
+    def __init__(self, engine: CrashEngine, path: str, interval_ms: int = CRASH_SNAPSHOT_MS) -> None:
+        self.engine = engine
+        self.path = path
+        self.interval_ms = interval_ms
+        self._seq = -1  # seq del último snapshot escrito
+        self._task: Optional[asyncio.Task] = None
+        self.writes = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def save(self) -> None:
+        if self.engine.seq == self._seq:
+            return
+        self._seq = self.engine.seq
+        # se arma en el loop (consistente) y se escribe fuera
+        await asyncio.to_thread(write, self.path, take(self.engine))
+        self.writes += 1
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_ms / 1000.0)
+            try:
+                await self.save()
+            except OSError:
+                logger.exception("crash snapshot: write failed")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.save()  # el último estado, con la ronda en curso si la hay
@@ -3,6 +3,7 @@ import os
 import subprocess
 import uuid
 import json
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -19,8 +20,12 @@ from .middleware.ratelimit import RateLimitMiddleware
 from .middleware.security_headers import SecureHeadersMiddleware
 from .auth import router as auth_router
 from .admin_routes import router as admin_router
+from api.crash.backplane import CRASH_BACKPLANE, make_backplane
 from api.crash.engine import CrashEngine
+from api.crash.rooms import CRASH_DEFAULT_ROOM, CRASH_ROOMS, RoomRegistry, stored_room
+from api.crash.snapshot import CRASH_SNAPSHOT_PATH, Snapshotter, restore, snapshot_path
 from api.crash.router import router as crash_router, handle_crash
+from .services.balance_cache import BALANCE_CACHE_BUS, balances
 
 
 def _parse_origins(raw: str | None) -> list[str]:
@@ -54,10 +59,79 @@ except Exception:
 
 ALLOWED_ORIGINS = _parse_origins(os.getenv("ALLOWED_ORIGINS"))
 
-app = FastAPI(title="FastAPI", version="0.1.0")
-engine = CrashEngine()
-engine.on_crash = handle_crash
+
+def _make_engine() -> CrashEngine:
+    eng = CrashEngine()
+    eng.on_crash = handle_crash
+    return eng
+
+
+# Con varios workers y CRASH_BACKPLANE=unix, un solo proceso corre la ronda
+backplane = make_backplane(CRASH_BACKPLANE, _make_engine)
+
+# Salas extra (CRASH_ROOMS): todas en este proceso, movidas por un solo scheduler
+if CRASH_ROOMS and CRASH_BACKPLANE != "inproc":
+    raise RuntimeError("CRASH_ROOMS_NEEDS_INPROC")
+rooms = RoomRegistry(_make_engine, [r for r in CRASH_ROOMS if r != CRASH_DEFAULT_ROOM])
+if CRASH_BACKPLANE == "inproc":
+    rooms.add(CRASH_DEFAULT_ROOM, backplane.engine)
+
+
+def _local_rooms() -> dict[str, CrashEngine]:
+    # las salas cuya ronda corre en este proceso (un worker del backplane no tiene)
+    if CRASH_BACKPLANE == "inproc":
+        return {name: rooms.get(name) for name in rooms}
+    return {CRASH_DEFAULT_ROOM: backplane.engine} if backplane.is_producer else {}
+
+
+snapshots: list[Snapshotter] = []
+
+
+async def _resume(room: str, eng: CrashEngine) -> None:
+    # la ronda que cortó el último apagado (o el productor caído) se liquida
+    # antes de servir; desde acá el engine de la sala guarda snapshots
+    if not CRASH_SNAPSHOT_PATH:
+        return
+    await restore(eng, snapshot_path(room))
+    snapshots.append(Snapshotter(eng, snapshot_path(room)))
+    snapshots[-1].start()
+
+
+async def _promoted(eng: CrashEngine) -> None:
+    await _resume(CRASH_DEFAULT_ROOM, eng)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if CRASH_BACKPLANE != "inproc":
+        backplane.on_promote = _promoted
+    await backplane.start()
+    for room, eng in _local_rooms().items():
+        await _resume(room, eng)
+    # cada sala con sus rondas; sin inproc el registro está vacío y la
+    # default es el engine del backplane (productor o RemoteEngine)
+    for room in rooms:
+        await rooms.get(room).history.warm(stored_room(room))
+    if CRASH_BACKPLANE != "inproc":
+        await backplane.engine.history.warm(stored_room(CRASH_DEFAULT_ROOM))
+    if BALANCE_CACHE_BUS:
+        # invalidaciones de saldo compartidas entre workers del mismo host
+        balances.start_bus(BALANCE_CACHE_BUS)
+    yield
+    balances.stop_bus()
+    # primero el snapshot: la ronda en curso (con sus apuestas abiertas) queda
+    # para restore(); detener el scheduler no la crashea ni la liquida
+    for snap in snapshots:
+        await snap.stop()
+    snapshots.clear()
+    await rooms.scheduler.stop()
+    await backplane.stop()
+
+
+app = FastAPI(title="FastAPI", version="0.1.0", lifespan=lifespan)
+engine = backplane.engine
 app.state.crash_engine = engine
+app.state.crash_rooms = rooms
 
 logger = logging.getLogger("uvicorn")
 logger.info("CORS: %d allowed origins", len(ALLOWED_ORIGINS))
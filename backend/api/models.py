@@ -16,6 +16,7 @@ from sqlalchemy import (
     Boolean,
     Enum,
     DateTime,
+    Index,
     func,
     text,
 )
@@ -106,6 +107,46 @@ class LedgerEntry(Base):
     balance_after: Mapped[Decimal] = mapped_column(Numeric(18, 6))
 
 
+class BalanceCheckpoint(Base):
+    """Ledger balance of a wallet as of entry ``ledger_id`` (inclusive)."""
+
+    __tablename__ = "balance_checkpoints"
+    __table_args__ = (Index("ix_balance_checkpoints_user_ledger", "user_id", "ledger_id"),)
+
+    id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True
+    )
+    user_id: Mapped[str] = mapped_column(ForeignKey("users.id"))
+    ledger_id: Mapped[int] = mapped_column(BigInteger)
+    balance: Mapped[Decimal] = mapped_column(Numeric(18, 6))
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
+    )
+
+
+class LedgerArchive(Base):
+    """Cold copy of ledger entries already covered by a checkpoint."""
+
+    __tablename__ = "ledger_archive"
+    __table_args__ = (Index("ix_ledger_archive_user_id", "user_id", "id"),)
+
+    # same id as in ledger_entries
+    id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=False
+    )
+    user_id: Mapped[str] = mapped_column(String(36))
+    amount: Mapped[Decimal] = mapped_column(Numeric(18, 6))
+    currency: Mapped[str] = mapped_column(String(10))
+    reason: Mapped[str] = mapped_column(Text)
+    # archived keys stay spent: the wallet writers check here too
+    idempotency_key: Mapped[str] = mapped_column(String(255), unique=True)
+    created_at: Mapped[datetime] = mapped_column()
+    balance_after: Mapped[Decimal] = mapped_column(Numeric(18, 6))
+    archived_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
+    )
+
+
 class AuditLog(Base):
     """Simple audit log to track user actions."""
 
@@ -127,6 +168,8 @@ class CrashRound(Base):
 
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     crash_at: Mapped[float] = mapped_column(Numeric(10, 2))
+    # NULL = the default room (also every round written before rooms existed)
+    room: Mapped[Optional[str]] = mapped_column(String(64), index=True, nullable=True)
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
     )
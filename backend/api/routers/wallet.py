@@ -3,11 +3,13 @@ from typing import Any
 
 from fastapi import APIRouter, Depends
 from pydantic import BaseModel
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from ..auth import get_current_user
+from ..auth import get_current_user, get_current_user_id
 from .. import db
 from ..models import User, Wallet
+from ..services.balance_cache import balances
 from ..services.wallet import apply_transaction
 
 router = APIRouter(prefix="/wallet")
@@ -28,8 +30,12 @@ def wallet_txn(body: TxnReq, user: User = Depends(get_current_user)) -> dict[str
 
 
 @router.get("/balance")
-def wallet_balance(user: User = Depends(get_current_user)) -> dict[str, Any]:
-    with Session(db.engine) as s:
-        acc = s.query(Wallet).filter(Wallet.user_id == user.id).first()
-        bal = float(acc.balance) if acc and acc.balance is not None else 0.0
-    return {"balance": bal}
+def wallet_balance(user_id: str = Depends(get_current_user_id)) -> dict[str, Any]:
+    def load() -> Decimal | None:
+        with Session(db.engine) as s:
+            return s.scalar(select(Wallet.balance).where(Wallet.user_id == user_id))
+
+    # el usuario sale del token: con el saldo en cache no hay ninguna query;
+    # se invalida al commitear cualquier movimiento de la wallet
+    bal = balances.read(user_id, load)
+    return {"balance": float(bal) if bal is not None else 0.0}
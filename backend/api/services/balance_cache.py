@@ -0,0 +1,236 @@
+"""In-process read-through cache of wallet balances.
+
+Reads go through :meth:`BalanceCache.read`; writes never update entries, they
+invalidate them once the transaction that moved the balance commits (see the
+session hooks at the bottom, which cover both the Core statements of
+``services.wallet`` and ORM writes such as the admin routes).
+
+Every invalidation bumps a monotonically increasing version. A reader takes
+the current version before going to the database and its result is only
+cached if no invalidation of that user happened since, so a read that raced
+a commit can never pin a stale balance.
+
+With several workers on one host, ``BALANCE_CACHE_BUS`` names a directory
+where each worker binds a Unix datagram socket; invalidations are sent to all
+of them, so another worker serves a stale balance for at most the delivery
+time of one datagram. Without a bus a worker never hears about another's
+writes, so the cache is off unless the bus is set or ``BALANCE_CACHE_SIZE``
+is given explicitly (single worker). Entries also expire after
+``BALANCE_CACHE_TTL`` seconds, which bounds staleness if a datagram is
+dropped.
+"""
+import asyncio
+import glob
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..models import Wallet
+
+BALANCE_CACHE_BUS = os.getenv("BALANCE_CACHE_BUS", "")  # empty = this process only
+# 0 = disabled; off by default without a bus, other workers' writes would go unseen
+BALANCE_CACHE_SIZE = int(os.getenv("BALANCE_CACHE_SIZE", "10000" if BALANCE_CACHE_BUS else "0"))
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", "5"))  # seconds; 0 = no expiry
+
+# uids per datagram; well under the default Unix datagram size limit
+_BUS_CHUNK = 200
+_TOUCHED = "wallet_touched"
+
+logger = logging.getLogger("uvicorn")
+
+
+class UnixBus:
+    """Same-host invalidation bus: one datagram socket per worker in ``path``."""
+
+    def __init__(self, path: str, on_message: Callable[[List[str]], None]) -> None:
+        self.path = path
+        self.on_message = on_message
+        self.addr = os.path.join(path, f"{os.getpid()}.sock")
+        self._rx: Optional[socket.socket] = None
+        self._tx: Optional[socket.socket] = None
+
+    def start(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        if os.path.exists(self.addr):
+            os.unlink(self.addr)
+        self._rx = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._rx.bind(self.addr)
+        self._rx.setblocking(False)
+        self._tx = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # bounded wait if a peer is not reading; publish may run on the event loop
+        self._tx.settimeout(0.05)
+        asyncio.get_running_loop().add_reader(self._rx.fileno(), self._read)
+
+    def _read(self) -> None:
+        assert self._rx is not None
+        while True:
+            try:
+                data = self._rx.recv(65536)
+            except BlockingIOError:
+                return
+            self.on_message(data.decode().split("\n"))
+
+    def publish(self, uids: List[str]) -> None:
+        if self._tx is None:
+            return
+        frames = ["\n".join(uids[i : i + _BUS_CHUNK]).encode() for i in range(0, len(uids), _BUS_CHUNK)]
+        for peer in glob.glob(os.path.join(self.path, "*.sock")):
+            if peer == self.addr:
+                continue
+            try:
+                for frame in frames:
+                    self._tx.sendto(frame, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # worker gone without cleaning up
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+            except OSError:
+                logger.warning("balance cache: invalidation to %s dropped", peer)
+
+    def stop(self) -> None:
+        if self._rx is not None:
+            asyncio.get_running_loop().remove_reader(self._rx.fileno())
+            self._rx.close()
+            self._rx = None
+            try:
+                os.unlink(self.addr)
+            except OSError:
+                pass
+        if self._tx is not None:
+            self._tx.close()
+            self._tx = None
+
+
+class BalanceCache:
+    """Bounded LRU of balances by user id; safe to use from worker threads."""
+
+    def __init__(self, size: int = BALANCE_CACHE_SIZE, ttl: float = BALANCE_CACHE_TTL) -> None:
+        self.size = size
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.bus: Optional[UnixBus] = None
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Decimal, float]]" = OrderedDict()  # balance, expiry
+        # version of each user's last invalidation, bounded like the entries;
+        # anything forgotten is covered by _floor
+        self._written: "OrderedDict[str, int]" = OrderedDict()
+        self._floor = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        # with a bus, peers may cache even if this worker does not
+        return self.size > 0 or self.bus is not None
+
+    def get(self, user_id: str) -> Optional[Decimal]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or (self.ttl > 0 and entry[1] <= time.monotonic()):
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def fill(self, user_id: str, balance: Decimal, version: int) -> bool:
+        """Cache a balance read from the database when ``version`` was current."""
+        with self._lock:
+            if self.size <= 0 or version < self._floor or self._written.get(user_id, 0) > version:
+                return False
+            self._entries[user_id] = (balance, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            return True
+
+    def read(self, user_id: str, load: Callable[[], Optional[Decimal]]) -> Optional[Decimal]:
+        """Cached balance, or ``load()`` (which may return ``None``) cached."""
+        balance = self.get(user_id)
+        if balance is not None:
+            return balance
+        version = self.version
+        balance = load()
+        if balance is not None:
+            self.fill(user_id, balance, version)
+        return balance
+
+    def invalidate(self, user_ids: Iterable[str], publish: bool = True) -> None:
+        uids = [uid for uid in user_ids if uid]
+        if not uids:
+            return
+        with self._lock:
+            self.version += 1
+            for uid in uids:
+                self._entries.pop(uid, None)
+                self._written[uid] = self.version
+                self._written.move_to_end(uid)
+            while len(self._written) > max(self.size, 1):
+                _, version = self._written.popitem(last=False)
+                self._floor = max(self._floor, version)
+        if publish and self.bus is not None:
+            self.bus.publish(uids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._written.clear()
+            self._floor = self.version
+
+    def start_bus(self, path: str = BALANCE_CACHE_BUS) -> None:
+        self.bus = UnixBus(path, lambda uids: self.invalidate(uids, publish=False))
+        self.bus.start()
+
+    def stop_bus(self) -> None:
+        if self.bus is not None:
+            self.bus.stop()
+            self.bus = None
+
+
+balances = BalanceCache()
+
+
+def touch(session: Union[Session, AsyncSession], user_ids: Iterable[str]) -> None:
+    """Invalidate these users' cached balances when ``session`` commits."""
+    if not balances.enabled:
+        return  # nothing cached anywhere: keep the wallet hot path free
+    # an AsyncSession shares info with its sync_session, where the hooks fire
+    session.info.setdefault(_TOUCHED, set()).update(user_ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _touch_flushed_wallets(session: Session, flush_context) -> None:
+    # ORM writes (admin credit/decide, registration) need no explicit touch()
+    uids = {
+        obj.user_id
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(obj, Wallet)
+    }
+    if uids:
+        touch(session, uids)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session: Session) -> None:
+    # a rolled-back transaction keeps its set until the next commit: at worst
+    # an extra invalidation
+    uids = session.info.pop(_TOUCHED, None)
+    if uids:
+        balances.invalidate(sorted(uids))
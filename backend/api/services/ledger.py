@@ -0,0 +1,224 @@
+"""Balance checkpoints and ledger archival.
+
+A checkpoint stores a wallet's ledger balance (``balance_after`` of its newest
+entry) together with that entry's id as a high-water mark. Per user, ledger
+ids follow balance order: every writer in ``services.wallet`` inserts its
+entry while holding the wallet row lock, so no entry below a checkpoint can
+commit after it.
+
+- :func:`take_checkpoints` checkpoints every user with entries above their
+  last checkpoint, in one ``INSERT ... SELECT``.
+- :func:`archive_ledger` copies entries covered by a checkpoint and older
+  than ``LEDGER_ARCHIVE_DAYS`` to ``ledger_archive``, a batch at a time;
+  :func:`purge_archived` then deletes the copies from ``ledger_entries``.
+- :func:`verify_balance` rebuilds a balance from the last checkpoint, reading
+  only the entries after it.
+
+Archived idempotency keys stay spent: ``services.wallet`` checks
+``ledger_archive`` (unique on the key) as well as the hot table. The copy
+commits before the purge starts, and the purge holds the wallet row locks,
+so a concurrent replay either still finds its entry in the hot table or
+runs after the purge and sees the committed archive row; a key is never
+missing from both.
+
+Run periodically (``make ledger``)::
+
+    python -m api.services.ledger checkpoint
+    python -m api.services.ledger archive --days 30   # copy, then purge
+    python -m api.services.ledger verify <user_id>
+"""
+import argparse
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Executable, delete, exists, func, insert, literal, or_, select
+from sqlalchemy.engine import CursorResult
+from sqlalchemy.orm import Session
+
+from ..models import BalanceCheckpoint, LedgerArchive, LedgerEntry, Wallet
+
+LEDGER_ARCHIVE_DAYS = int(os.getenv("LEDGER_ARCHIVE_DAYS", "30"))
+LEDGER_ARCHIVE_BATCH = int(os.getenv("LEDGER_ARCHIVE_BATCH", "5000"))
+
+_ARCHIVE_COLUMNS = ["id", "user_id", "amount", "currency", "reason", "idempotency_key", "created_at", "balance_after"]
+
+
+def checkpoint_marks() -> Any:
+    """Subquery: ``user_id`` and ``ledger_id`` of each user's last checkpoint."""
+    return (
+        select(BalanceCheckpoint.user_id, func.max(BalanceCheckpoint.ledger_id).label("ledger_id"))
+        .group_by(BalanceCheckpoint.user_id)
+        .subquery("marks")
+    )
+
+
+def _checkpoint_stmt(now: datetime) -> Executable:
+    marks = checkpoint_marks()
+    newest = (
+        select(LedgerEntry.user_id, func.max(LedgerEntry.id).label("id"))
+        .outerjoin(marks, marks.c.user_id == LedgerEntry.user_id)
+        .where(or_(marks.c.ledger_id.is_(None), LedgerEntry.id > marks.c.ledger_id))
+        .group_by(LedgerEntry.user_id)
+        .subquery("newest")
+    )
+    src = select(
+        LedgerEntry.user_id,
+        LedgerEntry.id,
+        LedgerEntry.balance_after,
+        # a typed bind, not CAST: on SQLite CAST(... AS DATETIME) yields a number
+        literal(now, BalanceCheckpoint.created_at.type),
+    ).join(newest, newest.c.id == LedgerEntry.id)
+    return insert(BalanceCheckpoint).from_select(["user_id", "ledger_id", "balance", "created_at"], src)
+
+
+def take_checkpoints(session: Session) -> int:
+    """Checkpoint every user with new entries; returns how many were taken."""
+    result = session.execute(_checkpoint_stmt(datetime.now(timezone.utc)))
+    assert isinstance(result, CursorResult)
+    return result.rowcount
+
+
+def archive_ledger(session: Session, cutoff: datetime, limit: int = LEDGER_ARCHIVE_BATCH) -> int:
+    """Copy up to ``limit`` checkpointed entries created before ``cutoff``.
+
+    Returns how many were copied; call again (after committing) until 0, then
+    :func:`purge_archived`.
+    """
+    marks = checkpoint_marks()
+    ids = session.scalars(
+        select(LedgerEntry.id)
+        .join(marks, marks.c.user_id == LedgerEntry.user_id)
+        .where(
+            LedgerEntry.id <= marks.c.ledger_id,
+            LedgerEntry.created_at < cutoff,
+            ~exists().where(LedgerArchive.id == LedgerEntry.id),
+        )
+        .order_by(LedgerEntry.id)
+        .limit(limit)
+    ).all()
+    if not ids:
+        return 0
+    cols = [getattr(LedgerEntry, c) for c in _ARCHIVE_COLUMNS]
+    now = literal(datetime.now(timezone.utc), LedgerArchive.archived_at.type)
+    session.execute(
+        insert(LedgerArchive).from_select(
+            _ARCHIVE_COLUMNS + ["archived_at"],
+            select(*cols, now).where(LedgerEntry.id.in_(ids)),
+        )
+    )
+    return len(ids)
+
+
+def purge_archived(session: Session, limit: int = LEDGER_ARCHIVE_BATCH) -> int:
+    """Delete up to ``limit`` hot entries whose archive copy is committed.
+
+    Must run in a later transaction than :func:`archive_ledger`. Returns how
+    many were deleted; call again (after committing) until 0.
+    """
+    rows = session.execute(
+        select(LedgerEntry.id, LedgerEntry.user_id)
+        .join(LedgerArchive, LedgerArchive.id == LedgerEntry.id)
+        .order_by(LedgerEntry.id)
+        .limit(limit)
+    ).all()
+    if not rows:
+        return 0
+    # same lock order as the wallet writers: a replay of one of these keys
+    # waits here and then finds it in the archive
+    uids = sorted({r.user_id for r in rows})
+    session.execute(select(Wallet.user_id).where(Wallet.user_id.in_(uids)).order_by(Wallet.user_id).with_for_update())
+    session.execute(delete(LedgerEntry).where(LedgerEntry.id.in_([r.id for r in rows])))
+    return len(rows)
+
+
+def replay(
+    opening: Optional[Decimal], entries: Iterable[Tuple[int, Decimal, Decimal]]
+) -> Tuple[Optional[Decimal], int, List[int]]:
+    """Walk ``(id, amount, balance_after)`` rows in id order.
+
+    Returns the ledger balance, the number of entries and the ids whose
+    ``balance_after`` does not follow from the previous balance (a movement
+    outside the ledger, e.g. an admin credit, or a corrupt row). Without an
+    ``opening`` balance the first entry's own is used.
+    """
+    balance = opening
+    count = 0
+    breaks: List[int] = []
+    for entry_id, amount, balance_after in entries:
+        if balance is None:
+            balance = balance_after - amount
+        if balance + amount != balance_after:
+            breaks.append(entry_id)
+        balance = balance_after
+        count += 1
+    return balance, count, breaks
+
+
+def verify_balance(session: Session, user_id: str) -> Dict[str, Any]:
+    """Rebuild ``user_id``'s balance from its last checkpoint and compare it
+    with the wallet."""
+    mark = session.execute(
+        select(BalanceCheckpoint.ledger_id, BalanceCheckpoint.balance)
+        .where(BalanceCheckpoint.user_id == user_id)
+        .order_by(BalanceCheckpoint.ledger_id.desc())
+        .limit(1)
+    ).first()
+    after = mark.ledger_id if mark else 0
+    rows = session.execute(
+        select(LedgerEntry.id, LedgerEntry.amount, LedgerEntry.balance_after)
+        .where(LedgerEntry.user_id == user_id, LedgerEntry.id > after)
+        .order_by(LedgerEntry.id)
+    ).tuples()
+    balance, count, breaks = replay(mark.balance if mark else None, rows)
+    wallet = session.scalar(select(Wallet.balance).where(Wallet.user_id == user_id))
+    return {
+        "user_id": user_id,
+        "checkpoint": mark.ledger_id if mark else None,
+        "entries": count,
+        "ledger_balance": balance,
+        "wallet_balance": wallet,
+        "breaks": breaks,
+        # with no entries the ledger says nothing about the balance
+        "ok": not breaks and (balance is None or balance == wallet),
+    }
+
+
+def _batch(db: Any, step: Callable[[Session], int]) -> int:
+    with db.SessionLocal() as s, s.begin():
+        return step(s)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from .. import db
+
+    p = argparse.ArgumentParser(prog="python -m api.services.ledger")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("checkpoint")
+    arc = sub.add_parser("archive")
+    arc.add_argument("--days", type=int, default=LEDGER_ARCHIVE_DAYS)
+    ver = sub.add_parser("verify")
+    ver.add_argument("user_id")
+    a = p.parse_args(argv)
+    if a.cmd == "checkpoint":
+        with db.SessionLocal() as s, s.begin():
+            print(json.dumps({"checkpoints": take_checkpoints(s)}))
+    elif a.cmd == "archive":
+        cutoff = datetime.now(timezone.utc) - timedelta(days=a.days)
+        moved = purged = 0
+        # one batch per transaction keeps locks and WAL growth bounded; every
+        # copy is committed before the first purge
+        while n := _batch(db, lambda s: archive_ledger(s, cutoff)):
+            moved += n
+        while n := _batch(db, purge_archived):
+            purged += n
+        print(json.dumps({"archived": moved, "purged": purged}))
+    else:
+        with db.SessionLocal() as s:
+            print(json.dumps(verify_balance(s, a.user_id), default=str))
+
+
+if __name__ == "__main__":  # pragma: no cover - maintenance task
+    main()
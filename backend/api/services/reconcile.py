@@ -0,0 +1,190 @@
+"""Wallet-vs-ledger reconciliation.
+
+Streams ``ledger_entries`` ordered by ``(user_id, id)`` through a server-side
+cursor (``yield_per``), with each user's wallet balance joined in by the
+database, and checks per user that every ``balance_after`` follows from the
+previous one and that the last one matches ``Wallet.balance``. Memory stays
+flat whatever the size of the ledger: only the current row batch is held.
+
+Users are split into contiguous ``user_id`` ranges, one per worker process,
+using the database's own ordering of ``wallets``; each worker opens its own
+connection. The report is JSON lines, one per user with a discrepancy, plus a
+final ``summary`` line::
+
+    python -m api.services.reconcile --workers 8 --out report.jsonl
+    python -m api.services.reconcile --from-checkpoint   # only after the last checkpoint
+
+Kinds: ``chain`` (a ``balance_after`` jump: a movement outside the ledger,
+e.g. an admin credit or decision), ``balance`` (last entry != wallet) and
+``no_wallet``. Wallets without entries are not checked: the ledger says
+nothing about them.
+"""
+import argparse
+import itertools
+import json
+import math
+import operator
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, create_engine, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from ..models import BalanceCheckpoint, LedgerEntry, Wallet
+from .ledger import checkpoint_marks, replay
+
+RECONCILE_BATCH = 10_000
+
+Range = Tuple[Optional[str], Optional[str]]  # [lo, hi); None = open end
+
+
+def partition(session: Session, parts: int) -> List[Range]:
+    """Split the user id space in ``parts`` ranges with about as many wallets each."""
+    total = session.scalar(select(func.count()).select_from(Wallet)) or 0
+    if parts <= 1 or total <= parts:
+        return [(None, None)]
+    step = math.ceil(total / parts)
+    numbered = select(
+        Wallet.user_id, func.row_number().over(order_by=Wallet.user_id).label("rn")
+    ).subquery()
+    bounds: List[Optional[str]] = list(
+        session.scalars(
+            select(numbered.c.user_id)
+            .where(numbered.c.rn > 1, (numbered.c.rn - 1) % step == 0)
+            .order_by(numbered.c.rn)
+        )
+    )
+    edges = [None, *bounds, None]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _stream(session: Session, lo: Optional[str], hi: Optional[str], from_checkpoint: bool, batch: int) -> Iterator[Any]:
+    cols = [
+        LedgerEntry.user_id,
+        LedgerEntry.id,
+        LedgerEntry.amount,
+        LedgerEntry.balance_after,
+        Wallet.balance.label("wallet"),
+    ]
+    q = select(*cols).outerjoin(Wallet, Wallet.user_id == LedgerEntry.user_id)
+    if from_checkpoint:
+        marks = checkpoint_marks()
+        q = (
+            q.add_columns(BalanceCheckpoint.balance.label("opening"))
+            .outerjoin(marks, marks.c.user_id == LedgerEntry.user_id)
+            .outerjoin(
+                BalanceCheckpoint,
+                and_(
+                    BalanceCheckpoint.user_id == marks.c.user_id,
+                    BalanceCheckpoint.ledger_id == marks.c.ledger_id,
+                ),
+            )
+            .where(func.coalesce(marks.c.ledger_id, 0) < LedgerEntry.id)
+        )
+    if lo is not None:
+        q = q.where(LedgerEntry.user_id >= lo)
+    if hi is not None:
+        q = q.where(LedgerEntry.user_id < hi)
+    q = q.order_by(LedgerEntry.user_id, LedgerEntry.id)
+    # Core rather than ORM execution: no per-row ORM loading, a row is a tuple
+    conn = session.connection().execution_options(yield_per=batch)
+    return conn.execute(q)
+
+
+def check_range(
+    url: str, lo: Optional[str] = None, hi: Optional[str] = None, from_checkpoint: bool = False, batch: int = RECONCILE_BATCH
+) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """Reconcile one user range on its own connection (runs in a worker)."""
+    engine = create_engine(url, poolclass=NullPool)
+    found: List[Dict[str, Any]] = []
+    users = entries = 0
+    try:
+        with Session(engine) as s:
+            rows = _stream(s, lo, hi, from_checkpoint, batch)
+            for user_id, group in itertools.groupby(rows, key=operator.itemgetter(0)):
+                first = next(group)
+                opening = first[5] if from_checkpoint else None
+                balance, count, breaks = replay(
+                    opening, (r[1:4] for r in itertools.chain([first], group))
+                )
+                users += 1
+                entries += count
+                item = _discrepancy(user_id, balance, first[4], breaks)
+                if item:
+                    found.append(item)
+    finally:
+        engine.dispose()
+    return found, {"users": users, "entries": entries}
+
+
+def _discrepancy(user_id: str, balance: Any, wallet: Any, breaks: List[int]) -> Optional[Dict[str, Any]]:
+    if wallet is None:
+        kind = "no_wallet"
+    elif breaks:
+        kind = "chain"
+    elif balance != wallet:
+        kind = "balance"
+    else:
+        return None
+    item: Dict[str, Any] = {"user_id": user_id, "kind": kind, "ledger": str(balance), "wallet": None if wallet is None else str(wallet)}
+    if breaks:
+        item.update(breaks=len(breaks), first_break=breaks[0])
+    return item
+
+
+def reconcile(
+    url: str, workers: int = 1, from_checkpoint: bool = False, batch: int = RECONCILE_BATCH
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Reconcile the whole ledger; returns the discrepancies and a summary."""
+    t = time.perf_counter()
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        with Session(engine) as s:
+            ranges = partition(s, workers)
+    finally:
+        engine.dispose()
+    args = [(url, lo, hi, from_checkpoint, batch) for lo, hi in ranges]
+    if len(args) == 1:
+        results = [check_range(*args[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(args)) as pool:
+            results = list(pool.map(check_range, *zip(*args)))
+    found = [item for items, _ in results for item in items]
+    summary = {
+        "users": sum(r[1]["users"] for r in results),
+        "entries": sum(r[1]["entries"] for r in results),
+        "discrepancies": len(found),
+        "ranges": len(ranges),
+        "seconds": round(time.perf_counter() - t, 3),
+    }
+    return found, summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from .. import db
+
+    p = argparse.ArgumentParser(prog="python -m api.services.reconcile")
+    p.add_argument("--url", default=db.engine.url.render_as_string(hide_password=False))
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--batch", type=int, default=RECONCILE_BATCH)
+    p.add_argument("--from-checkpoint", action="store_true")
+    p.add_argument("--out", help="report file (JSON lines); stdout by default")
+    a = p.parse_args(argv)
+    found, summary = reconcile(a.url, a.workers, a.from_checkpoint, a.batch)
+    out = open(a.out, "w") if a.out else sys.stdout
+    try:
+        for item in found:
+            out.write(json.dumps(item) + "\n")
+        out.write(json.dumps({"summary": summary}) + "\n")
+    finally:
+        if a.out:
+            out.close()
+    if a.out:
+        print(json.dumps(summary))
+
+
+if __name__ == "__main__":  # pragma: no cover - maintenance task
+    main()
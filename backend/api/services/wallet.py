@@ -1,10 +1,154 @@
+from datetime import datetime, timezone
 from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
 from fastapi import HTTPException
-from sqlalchemy import select
+from sqlalchemy import Executable, cast, exists, insert, select, true, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from ..models import Wallet, LedgerEntry
+from ..models import LedgerArchive, LedgerEntry, Wallet
+from .balance_cache import touch
+
+# (user_id, amount, reason, idempotency_key) for apply_transactions_bulk
+Movement = Tuple[str, Decimal, str, str]
+
+# IN lists are split to stay under driver bind-parameter limits
+BULK_CHUNK = 1000
+
+# Dialects with a single-statement fast path; anything else takes the
+# SELECT ... FOR UPDATE path below.
+FAST_DIALECTS = {"postgresql", "sqlite"}
+
+_LEDGER_COLUMNS = ["user_id", "amount", "currency", "reason", "idempotency_key", "created_at", "balance_after"]
+
+
+def _dialect(session: Any) -> str:
+    return session.get_bind().dialect.name
+
+
+def _archived(key: str) -> Any:
+    # keys moved to ledger_archive stay spent (see services.ledger)
+    return exists().where(LedgerArchive.idempotency_key == key)
+
+
+def _from_archive(row: LedgerArchive) -> LedgerEntry:
+    # transient copy of an archived entry, returned for a replayed key
+    return _entry(row.id, row.user_id, row.amount, row.reason, row.idempotency_key, row.created_at, row.balance_after)
+
+
+def _pg_apply(user_id: str, amount: Decimal, reason: str, key: str, now: datetime) -> Executable:
+    """One round trip on Postgres.
+
+    ``w`` locks the wallet row, ``ins`` writes the ledger entry (skipped on a
+    replayed key, hot or archived, or a short balance) and ``upd`` moves the balance only if the
+    entry was written. A concurrent replay of the same key waits on the wallet
+    lock and then hits the unique index, so it never moves the balance twice.
+    Returns no row if the wallet does not exist, ``id`` NULL if nothing was
+    applied.
+    """
+    w = select(Wallet.balance).where(Wallet.user_id == user_id).with_for_update().cte("w")
+    amt = cast(amount, LedgerEntry.amount.type)
+    src = select(
+        cast(user_id, LedgerEntry.user_id.type),
+        amt,
+        cast("USD", LedgerEntry.currency.type),
+        cast(reason, LedgerEntry.reason.type),
+        cast(key, LedgerEntry.idempotency_key.type),
+        cast(now, LedgerEntry.created_at.type),
+        w.c.balance + amt,
+    ).where(~_archived(key))
+    if amount < 0:
+        src = src.where(w.c.balance >= -amt)
+    ins = (
+        postgresql.insert(LedgerEntry)
+        .from_select(_LEDGER_COLUMNS, src)
+        .on_conflict_do_nothing(index_elements=["idempotency_key"])
+        .returning(LedgerEntry.id, LedgerEntry.balance_after)
+        .cte("ins")
+    )
+    upd = (
+        update(Wallet)
+        .where(Wallet.user_id == user_id, ins.c.id.is_not(None))
+        .values(balance=ins.c.balance_after)
+        .returning(Wallet.user_id)
+        .cte("upd")
+    )
+    return select(ins.c.id, ins.c.balance_after).select_from(w.outerjoin(ins, true())).add_cte(upd)
+
+
+def _sqlite_debit(user_id: str, amount: Decimal, key: str) -> Executable:
+    """Guarded ``UPDATE ... RETURNING`` for SQLite.
+
+    SQLite serializes writers on the database lock, so the key check and the
+    balance condition hold until the ledger insert that follows; no row means
+    nothing was applied.
+    """
+    cond = [Wallet.user_id == user_id, ~exists().where(LedgerEntry.idempotency_key == key), ~_archived(key)]
+    if amount < 0:
+        cond.append(Wallet.balance >= -amount)
+    return (
+        update(Wallet)
+        .where(*cond)
+        .values(balance=Wallet.balance + amount)
+        .returning(Wallet.balance)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _ledger_insert(user_id: str, amount: Decimal, reason: str, key: str, now: datetime, balance: Decimal) -> Executable:
+    return (
+        insert(LedgerEntry)
+        .values(
+            user_id=user_id,
+            amount=amount,
+            currency="USD",
+            reason=reason,
+            idempotency_key=key,
+            created_at=now,
+            balance_after=balance,
+        )
+        .returning(LedgerEntry.id)
+    )
+
+
+def _entry(
+    entry_id: int, user_id: str, amount: Decimal, reason: str, key: str, now: datetime, balance: Decimal
+) -> LedgerEntry:
+    return LedgerEntry(
+        id=entry_id,
+        user_id=user_id,
+        amount=amount,
+        currency="USD",
+        reason=reason,
+        idempotency_key=key,
+        created_at=now,
+        balance_after=balance,
+    )
+
+
+def _replayed(session: Session, key: str) -> Optional[LedgerEntry]:
+    """The entry ``key`` already posted, from the hot table or the archive."""
+    existing = session.scalar(select(LedgerEntry).where(LedgerEntry.idempotency_key == key))
+    if existing is None:
+        row = session.scalar(select(LedgerArchive).where(LedgerArchive.idempotency_key == key))
+        return _from_archive(row) if row is not None else None
+    return existing
+
+
+async def _replayed_async(session: AsyncSession, key: str) -> Optional[LedgerEntry]:
+    existing = await session.scalar(select(LedgerEntry).where(LedgerEntry.idempotency_key == key))
+    if existing is None:
+        row = await session.scalar(select(LedgerArchive).where(LedgerArchive.idempotency_key == key))
+        return _from_archive(row) if row is not None else None
+    return existing
+
+
+def _new_wallet(user_id: str) -> Executable:
+    # Core insert: an ORM Wallet in the identity map would go stale under
+    # the statements above
+    return insert(Wallet).values(user_id=user_id, balance=Decimal("100"))
 
 
 def apply_transaction(
@@ -14,10 +158,222 @@ def apply_transaction(
     reason: str,
     idempotency_key: str,
 ) -> LedgerEntry:
-    """Apply a wallet transaction with idempotency."""
-    existing = session.scalar(
-        select(LedgerEntry).where(LedgerEntry.idempotency_key == idempotency_key)
+    """Apply a wallet transaction with idempotency.
+
+    On Postgres and SQLite the idempotency check, the conditional balance
+    update and the ledger insert go out as one statement (two on SQLite); the
+    extra lookups below only run when nothing was applied. The user's cached
+    balance is invalidated when the session commits.
+    """
+    touch(session, [user_id])
+    if _dialect(session) not in FAST_DIALECTS:
+        return _apply_locked(session, user_id, amount, reason, idempotency_key)
+    now = datetime.now(timezone.utc)
+    applied: Optional[tuple] = None
+    if _dialect(session) == "postgresql":
+        row = session.execute(_pg_apply(user_id, amount, reason, idempotency_key, now)).first()
+        if row is not None and row.id is not None:
+            applied = (row.id, row.balance_after)
+    else:
+        balance = session.scalar(_sqlite_debit(user_id, amount, idempotency_key))
+        if balance is not None:
+            entry_id = session.scalar(_ledger_insert(user_id, amount, reason, idempotency_key, now, balance))
+            applied = (entry_id, balance)
+    if applied is not None:
+        return _entry(applied[0], user_id, amount, reason, idempotency_key, now, applied[1])
+
+    # nothing applied: replayed key, missing wallet or short balance
+    existing = _replayed(session, idempotency_key)
+    if existing:
+        return existing
+    if session.scalar(select(Wallet.user_id).where(Wallet.user_id == user_id)) is None:
+        session.execute(_new_wallet(user_id))
+        return apply_transaction(session, user_id, amount, reason, idempotency_key)
+    raise HTTPException(400, "Insufficient balance")
+
+
+async def apply_transaction_async(
+    session: AsyncSession,
+    user_id: str,
+    amount: Decimal,
+    reason: str,
+    idempotency_key: str,
+) -> LedgerEntry:
+    """Async variant of :func:`apply_transaction` for ``AsyncSession``."""
+    touch(session, [user_id])
+    if _dialect(session) not in FAST_DIALECTS:
+        return await _apply_locked_async(session, user_id, amount, reason, idempotency_key)
+    now = datetime.now(timezone.utc)
+    applied: Optional[tuple] = None
+    if _dialect(session) == "postgresql":
+        row = (await session.execute(_pg_apply(user_id, amount, reason, idempotency_key, now))).first()
+        if row is not None and row.id is not None:
+            applied = (row.id, row.balance_after)
+    else:
+        balance = await session.scalar(_sqlite_debit(user_id, amount, idempotency_key))
+        if balance is not None:
+            entry_id = await session.scalar(_ledger_insert(user_id, amount, reason, idempotency_key, now, balance))
+            applied = (entry_id, balance)
+    if applied is not None:
+        return _entry(applied[0], user_id, amount, reason, idempotency_key, now, applied[1])
+
+    existing = await _replayed_async(session, idempotency_key)
+    if existing:
+        return existing
+    if await session.scalar(select(Wallet.user_id).where(Wallet.user_id == user_id)) is None:
+        await session.execute(_new_wallet(user_id))
+        return await apply_transaction_async(session, user_id, amount, reason, idempotency_key)
+    raise HTTPException(400, "Insufficient balance")
+
+
+def _chunks(values: Sequence[Any]) -> Iterator[Sequence[Any]]:
+    for i in range(0, len(values), BULK_CHUNK):
+        yield values[i : i + BULK_CHUNK]
+
+
+def _lock_wallets(uids: Sequence[str]) -> Executable:
+    # sorted ids + ORDER BY: every bulk caller takes row locks in the same order
+    return (
+        select(Wallet.user_id, Wallet.balance)
+        .where(Wallet.user_id.in_(uids))
+        .order_by(Wallet.user_id)
+        .with_for_update()
     )
+
+
+def _plan(
+    items: Sequence[Movement],
+    balances: Dict[str, Decimal],
+    existing: Dict[str, LedgerEntry],
+) -> Tuple[List[Any], List[Dict[str, Any]]]:
+    """Walk the movements in order against running balances.
+
+    Returns the results known so far (replays and rejections) and the ledger
+    rows to insert. A key repeated within ``items`` gets the outcome of its
+    first occurrence.
+    """
+    now = datetime.now(timezone.utc)
+    results: List[Any] = [None] * len(items)
+    rows: List[Dict[str, Any]] = []
+    applied: Set[str] = set()
+    rejected: Dict[str, HTTPException] = {}
+    for n, (user_id, amount, reason, key) in enumerate(items):
+        if key in existing:
+            results[n] = existing[key]
+        elif key in rejected:
+            results[n] = rejected[key]
+        elif key not in applied:
+            balance = balances[user_id]
+            if amount < 0 and balance < -amount:
+                results[n] = rejected[key] = HTTPException(400, "Insufficient balance")
+                continue
+            balances[user_id] = balance + amount
+            applied.add(key)
+            rows.append({
+                "user_id": user_id,
+                "amount": amount,
+                "currency": "USD",
+                "reason": reason,
+                "idempotency_key": key,
+                "created_at": now,
+                "balance_after": balances[user_id],
+            })
+    return results, rows
+
+
+def _fill(items: Sequence[Movement], results: List[Any], entries: Sequence[LedgerEntry]) -> List[Any]:
+    # RETURNING order is not guaranteed across batches: match on the key
+    by_key = {entry.idempotency_key: entry for entry in entries}
+    for n, item in enumerate(items):
+        if results[n] is None:
+            results[n] = by_key[item[3]]
+    return results
+
+
+def _ledger_bulk_insert() -> Executable:
+    # multi-row INSERT ... VALUES (...), (...) RETURNING
+    return insert(LedgerEntry).returning(LedgerEntry)
+
+
+def apply_transactions_bulk(
+    session: Session, items: Sequence[Movement]
+) -> List[Union[LedgerEntry, HTTPException]]:
+    """Apply many wallet movements in the caller's transaction.
+
+    Wallets are locked first, in user id order, so concurrent bulk calls
+    cannot deadlock and every earlier write to those wallets is visible to the
+    single key lookup that follows. Balances are then worked out in memory and
+    written back with one bulk UPDATE, and all ledger rows go in with one
+    multi-row INSERT. Each item gets its ``LedgerEntry`` (new or replayed) or
+    the ``HTTPException`` that rejected it; rejected items write nothing.
+    """
+    if not items:
+        return []
+    uids = sorted({item[0] for item in items})
+    touch(session, uids)
+    balances: Dict[str, Decimal] = {}
+    for chunk in _chunks(uids):
+        balances.update(session.execute(_lock_wallets(chunk)).tuples().all())
+    missing = [uid for uid in uids if uid not in balances]
+    if missing:
+        session.execute(insert(Wallet), [{"user_id": uid, "balance": Decimal("100")} for uid in missing])
+        balances.update((uid, Decimal("100")) for uid in missing)
+    keys = list({item[3] for item in items})
+    existing: Dict[str, LedgerEntry] = {}
+    for chunk in _chunks(keys):
+        for entry in session.scalars(select(LedgerEntry).where(LedgerEntry.idempotency_key.in_(chunk))):
+            existing[entry.idempotency_key] = entry
+        for row in session.scalars(select(LedgerArchive).where(LedgerArchive.idempotency_key.in_(chunk))):
+            existing.setdefault(row.idempotency_key, _from_archive(row))
+    results, rows = _plan(items, balances, existing)
+    if not rows:
+        return results
+    touched = {row["user_id"] for row in rows}
+    session.execute(update(Wallet), [{"user_id": uid, "balance": balances[uid]} for uid in sorted(touched)])
+    entries = session.scalars(_ledger_bulk_insert(), rows).all()
+    return _fill(items, results, entries)
+
+
+async def apply_transactions_bulk_async(
+    session: AsyncSession, items: Sequence[Movement]
+) -> List[Union[LedgerEntry, HTTPException]]:
+    """Async variant of :func:`apply_transactions_bulk` for ``AsyncSession``."""
+    if not items:
+        return []
+    uids = sorted({item[0] for item in items})
+    touch(session, uids)
+    balances: Dict[str, Decimal] = {}
+    for chunk in _chunks(uids):
+        balances.update((await session.execute(_lock_wallets(chunk))).tuples().all())
+    missing = [uid for uid in uids if uid not in balances]
+    if missing:
+        await session.execute(insert(Wallet), [{"user_id": uid, "balance": Decimal("100")} for uid in missing])
+        balances.update((uid, Decimal("100")) for uid in missing)
+    keys = list({item[3] for item in items})
+    existing: Dict[str, LedgerEntry] = {}
+    for chunk in _chunks(keys):
+        for entry in await session.scalars(select(LedgerEntry).where(LedgerEntry.idempotency_key.in_(chunk))):
+            existing[entry.idempotency_key] = entry
+        for row in await session.scalars(select(LedgerArchive).where(LedgerArchive.idempotency_key.in_(chunk))):
+            existing.setdefault(row.idempotency_key, _from_archive(row))
+    results, rows = _plan(items, balances, existing)
+    if not rows:
+        return results
+    touched = {row["user_id"] for row in rows}
+    await session.execute(update(Wallet), [{"user_id": uid, "balance": balances[uid]} for uid in sorted(touched)])
+    entries = (await session.scalars(_ledger_bulk_insert(), rows)).all()
+    return _fill(items, results, entries)
+
+
+def _apply_locked(
+    session: Session,
+    user_id: str,
+    amount: Decimal,
+    reason: str,
+    idempotency_key: str,
+) -> LedgerEntry:
+    """Generic path: lookup, ``SELECT ... FOR UPDATE`` and flush."""
+    existing = _replayed(session, idempotency_key)
     if existing:
         return existing
 
@@ -43,3 +399,40 @@ def apply_transaction(
     session.add(entry)
     session.flush()
     return entry
+
+
+async def _apply_locked_async(
+    session: AsyncSession,
+    user_id: str,
+    amount: Decimal,
+    reason: str,
+    idempotency_key: str,
+) -> LedgerEntry:
+    existing = await _replayed_async(session, idempotency_key)
+    if existing:
+        return existing
+
+    acc = (
+        await session.execute(
+            select(Wallet).where(Wallet.user_id == user_id).with_for_update()
+        )
+    ).scalar_one_or_none()
+    if not acc:
+        acc = Wallet(user_id=user_id, balance=Decimal("100"))
+        session.add(acc)
+        await session.flush()
+
+    if amount < 0 and acc.balance < -amount:
+        raise HTTPException(400, "Insufficient balance")
+
+    acc.balance += amount
+    entry = LedgerEntry(
+        user_id=user_id,
+        amount=amount,
+        reason=reason,
+        idempotency_key=idempotency_key,
+        balance_after=acc.balance,
+    )
+    session.add(entry)
+    await session.flush()
+    return entry
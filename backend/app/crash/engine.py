@@ -5,12 +5,12 @@ import random
 import time
 from collections import defaultdict
 from dataclasses import dataclass
-from typing import Dict, Optional, Set
+from typing import Awaitable, Callable, Dict, Optional, Set
 
 from fastapi import WebSocket
 
 
-@dataclass
+@dataclass(slots=True)
 class Bet:
     amount: float
     auto_cashout: Optional[float]
@@ -20,7 +20,14 @@ class Bet:
 class CrashEngine:
     """Simple in-memory crash game engine with rounds."""
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        now: Callable[[], float] = time.time,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ) -> None:
+        # injectable clock (e.g. api.crash.clock.VirtualClock's now/sleep)
+        self.now = now
+        self.sleep = sleep
         self.betting_seconds = float(os.getenv("CRASH_BETTING_SECONDS", "6"))
         self.intermission_seconds = float(os.getenv("CRASH_INTERMISSION_SECONDS", "4"))
         self.tick_ms = int(os.getenv("CRASH_TICK_MS", "100"))
@@ -51,22 +58,22 @@ class CrashEngine:
             self.round_id += 1
             self.phase = "BETTING"
             self.bets = {}
-            start = time.time()
+            start = self.now()
             while True:
-                elapsed = time.time() - start
+                elapsed = self.now() - start
                 left = self.betting_seconds - elapsed
                 self.seconds_left = max(0.0, round(left, 2))
                 await self.broadcast({"t": "betting", "left": self.seconds_left})
                 if left <= 0:
                     break
-                await asyncio.sleep(0.5)
+                await self.sleep(0.5)
 
             self.phase = "RUNNING"
             self.multiplier = 1.0
             self.crash_at = self._generate_crash_at()
-            t0 = time.time()
+            t0 = self.now()
             while True:
-                elapsed = time.time() - t0
+                elapsed = self.now() - t0
                 m = round(math.exp(self.growth_rate * elapsed), 2)
                 self.multiplier = m
                 await self.broadcast({"t": "tick", "m": m})
@@ -85,9 +92,9 @@ class CrashEngine:
                                 self.balances[pid] -= bet.amount
                                 bet.cashed = True
                     break
-                await asyncio.sleep(self.tick_ms / 1000)
+                await self.sleep(self.tick_ms / 1000)
 
-            await asyncio.sleep(self.intermission_seconds)
+            await self.sleep(self.intermission_seconds)
 
     async def broadcast(self, data: dict) -> None:
         dead: Set[WebSocket] = set()
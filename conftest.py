@@ -8,3 +8,7 @@ if str(backend_path) not in sys.path:
     sys.path.insert(0, str(backend_path))
 
 os.environ.setdefault("ALLOWED_ORIGINS", '["http://localhost:5173"]')
+
+# varios módulos pisan DATABASE_URL con uno de mentira antes de importar la
+# app; la base con la que se lanzó la suite queda en TEST_DATABASE_URL
+os.environ.setdefault("TEST_DATABASE_URL", os.environ.get("DATABASE_URL", ""))
@@ -3,12 +3,17 @@ import { API_URL, WS_URL } from "@/lib/env";
 import { postJSON } from "@/lib/http";
 
 type Phase = "BETTING" | "RUNNING" | "CRASHED";
+type Pending = { resolve: (r: any) => void; reject: (e: Error) => void };
+
 export function useCrashData() {
   const [phase, setPhase] = useState<Phase>("BETTING");
   const [multiplier, setMultiplier] = useState(1);
   const [minBet, setMinBet] = useState(1);
   const [error, setError] = useState<string | null>(null);
   const wsRef = useRef<WebSocket | null>(null);
+  // comandos enviados por el WS esperando su ack, por id
+  const pendingRef = useRef(new Map<number, Pending>());
+  const nextIdRef = useRef(0);
 
   // Carga inicial
   useEffect(() => {
@@ -25,42 +30,121 @@ export function useCrashData() {
     })();
   }, []);
 
-  // WS
+  // WS en modo keyframes: el server manda start/sync y la curva se calcula acá
   useEffect(() => {
-    const ws = new WebSocket(`${WS_URL}/crash/stream`);
-    wsRef.current = ws;
-    ws.onmessage = (ev) => {
-      try {
-        const msg = JSON.parse(ev.data);
-        if (msg.t === "state") {
-          if (msg.phase) setPhase(msg.phase);
-          if (typeof msg.m === "number") setMultiplier(msg.m);
-          if (typeof msg.min_bet === "number") setMinBet(msg.min_bet);
-        } else if (msg.t === "start") {
-          setPhase("RUNNING");
-          setMultiplier(1);
-        } else if (msg.t === "tick") {
-          setPhase("RUNNING");
-          if (typeof msg.m === "number") setMultiplier(msg.m);
-        } else if (msg.t === "crash") {
-          setPhase("CRASHED");
-        } else if (msg.t === "betting") {
-          setPhase("BETTING");
-          setMultiplier(1);
+    let k = 0;
+    let seq: number | null = null; // último "s" recibido, para reconectar con since
+    let ep: number | null = null; // epoch del server: su "s" sólo vale con el mismo
+    let disposed = false;
+    let retry: ReturnType<typeof setTimeout> | undefined;
+    let t0: number | null = null; // performance.now() equivalente al arranque
+    let raf = 0;
+
+    const frame = () => {
+      if (t0 === null) return;
+      const m = Math.exp((k * (performance.now() - t0)) / 1000);
+      setMultiplier(Math.floor(m * 100) / 100);
+      raf = requestAnimationFrame(frame);
+    };
+    const run = (elapsedMs: number) => {
+      t0 = performance.now() - elapsedMs;
+      cancelAnimationFrame(raf);
+      raf = requestAnimationFrame(frame);
+    };
+    const stop = () => {
+      t0 = null;
+      cancelAnimationFrame(raf);
+    };
+
+    const handle = (msg: any) => {
+      if (typeof msg.s === "number") seq = msg.s;
+      if (typeof msg.ep === "number") ep = msg.ep;
+      if (msg.t === "ack") {
+        const p = pendingRef.current.get(msg.id);
+        pendingRef.current.delete(msg.id);
+        if (msg.ok) p?.resolve(msg.r);
+        else p?.reject(new Error(msg.err));
+      } else if (msg.t === "batch") {
+        // eventos de una misma ventana agrupados en un solo frame
+        for (const e of msg.ev ?? []) handle(e);
+      } else if (msg.t === "state") {
+        if (msg.phase) setPhase(msg.phase);
+        if (typeof msg.m === "number") setMultiplier(msg.m);
+        if (typeof msg.min_bet === "number") setMinBet(msg.min_bet);
+        if (msg.phase === "RUNNING" && typeof msg.k === "number") {
+          k = msg.k;
+          run(msg.e ?? 0);
         }
-      } catch {}
+      } else if (msg.t === "start") {
+        setPhase("RUNNING");
+        setMultiplier(1);
+        if (typeof msg.k === "number") k = msg.k;
+        run(0);
+      } else if (msg.t === "sync") {
+        // corrige la deriva contra el reloj del server
+        if (typeof msg.e === "number") run(msg.e);
+      } else if (msg.t === "tick") {
+        setPhase("RUNNING");
+        if (typeof msg.m === "number") setMultiplier(msg.m);
+      } else if (msg.t === "crash") {
+        stop();
+        setPhase("CRASHED");
+        if (typeof msg.at === "number") setMultiplier(msg.at);
+      } else if (msg.t === "betting") {
+        stop();
+        setPhase("BETTING");
+        setMultiplier(1);
+      }
+    };
+
+    const connect = () => {
+      const since = seq === null || ep === null ? "" : `&since=${seq}&ep=${ep}`;
+      const ws = new WebSocket(`${WS_URL}/crash/stream?mode=keyframes${since}`);
+      wsRef.current = ws;
+      ws.onmessage = (ev) => {
+        try {
+          handle(JSON.parse(ev.data));
+        } catch {}
+      };
+      ws.onerror = () => setError("WS error");
+      ws.onclose = () => {
+        stop();
+        // sin ack no se sabe si se aplicó: el llamador vuelve a pedir el estado
+        for (const p of pendingRef.current.values()) p.reject(new Error("WS_CLOSED"));
+        pendingRef.current.clear();
+        if (disposed) return;
+        // con jitter: después de un corte no reconectan todos a la vez
+        retry = setTimeout(connect, 500 + Math.random() * 1000);
+      };
+    };
+    connect();
+
+    return () => {
+      disposed = true;
+      clearTimeout(retry);
+      stop();
+      wsRef.current?.close();
     };
-    ws.onerror = () => setError("WS error");
-    ws.onclose = () => {};
-    return () => ws.close();
   }, []);
 
+  // por el socket ya abierto (sin handshake HTTP ni auth por request); si no
+  // está conectado, por HTTP como antes
+  function command(op: string, args: Record<string, unknown> = {}) {
+    const ws = wsRef.current;
+    if (!ws || ws.readyState !== WebSocket.OPEN) return null;
+    const id = ++nextIdRef.current;
+    return new Promise<any>((resolve, reject) => {
+      pendingRef.current.set(id, { resolve, reject });
+      ws.send(JSON.stringify({ id, op, ...args }));
+    });
+  }
+
   async function bet(amount: number, auto?: number | null) {
-    return postJSON("/crash/bet", { amount, auto_cashout: auto ?? null });
+    return command("bet", { amount, auto: auto ?? null }) ?? postJSON("/crash/bet", { amount, auto_cashout: auto ?? null });
   }
 
   async function cashout() {
-    return postJSON("/crash/cashout", {});
+    return command("cashout") ?? postJSON("/crash/cashout", {});
   }
 
   return { phase, multiplier, minBet, error, bet, cashout };
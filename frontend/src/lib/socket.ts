@@ -1,9 +1,21 @@
 import { useGameStore } from "./store";
-import { WS_URL } from "./env";
+import { API_URL, WS_URL } from "./env";
 
 let socket: WebSocket | null = null;
 const store = useGameStore.getState();
 
+// al (re)conectar se recupera el historial sin esperar nuevas rondas
+async function backfill() {
+  try {
+    const r = await fetch(`${API_URL}/crash/history`);
+    if (!r.ok) return;
+    const rounds: { crash_at: number }[] = await r.json();
+    store.setRounds(rounds.map((x) => x.crash_at));
+  } catch (err) {
+    console.error("history error", err);
+  }
+}
+
 function connect() {
   const url = `${WS_URL}/crash/stream`;
   if (socket && socket.url === url) {
@@ -13,6 +25,9 @@ function connect() {
     socket.close();
   }
   socket = new WebSocket(url);
+  socket.onopen = () => {
+    backfill();
+  };
   socket.onmessage = (ev) => {
     try {
       const msg = JSON.parse(ev.data);
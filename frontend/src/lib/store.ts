@@ -15,6 +15,7 @@ interface GameState {
   setAutoCashout: (a: number) => void;
   setBalance: (b: number) => void;
   addRound: (m: number) => void;
+  setRounds: (rounds: number[]) => void;
   reset: () => void;
 }
 
@@ -31,5 +32,6 @@ export const useGameStore = create<GameState>((set) => ({
   setAutoCashout: (autoCashout) => set({ autoCashout }),
   setBalance: (balance) => set({ balance }),
   addRound: (m) => set((s) => ({ lastRounds: [m, ...s.lastRounds].slice(0, 10) })),
+  setRounds: (rounds) => set({ lastRounds: rounds.slice(0, 10) }),
   reset: () => set({ phase: "idle", multiplier: 1, bet: 0 }),
 }));
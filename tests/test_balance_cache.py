@@ -0,0 +1,101 @@
+import asyncio
+from decimal import Decimal
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from api.models import Base, User, Wallet
+from api.services import balance_cache
+from api.services.balance_cache import BalanceCache, UnixBus, balances
+from api.services.wallet import apply_transaction
+
+
+def test_lru_and_stale_fill():
+    cache = BalanceCache(size=2)
+    v = cache.version
+    assert cache.fill("a", Decimal("1"), v) and cache.fill("b", Decimal("2"), v)
+    assert cache.get("a") == Decimal("1")  # "a" pasa a ser el más reciente
+    cache.fill("c", Decimal("3"), v)
+    assert cache.get("b") is None and len(cache) == 2
+    # una lectura que empezó antes de la invalidación no se cachea
+    v = cache.version
+    cache.invalidate(["a"])
+    assert cache.get("a") is None
+    assert not cache.fill("a", Decimal("1"), v)
+    assert cache.fill("a", Decimal("5"), cache.version)
+    assert cache.read("a", lambda: None) == Decimal("5")
+    assert cache.read("zz", lambda: None) is None
+
+
+def test_expires_after_ttl(monkeypatch):
+    cache = BalanceCache(size=2, ttl=5)
+    now = [100.0]
+    monkeypatch.setattr(balance_cache.time, "monotonic", lambda: now[0])
+    cache.fill("a", Decimal("1"), cache.version)
+    now[0] += 4.9
+    assert cache.get("a") == Decimal("1")
+    # sin invalidación (datagrama perdido): igual vence
+    now[0] += 0.2
+    assert cache.get("a") is None and len(cache) == 0
+
+
+def test_invalidated_on_commit(monkeypatch):
+    # sin BALANCE_CACHE_BUS el caché global viene apagado
+    monkeypatch.setattr(balances, "size", 100)
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as s, s.begin():
+        s.add(User(id="u1", email="u1@example.com", username="u1", password_hash="x"))
+        s.add(Wallet(user_id="u1", balance=Decimal("100")))
+    balances.clear()
+
+    def load():
+        with Session(engine) as s:
+            return s.get(Wallet, "u1").balance
+
+    assert balances.read("u1", load) == Decimal("100")
+    with Session(engine) as s, s.begin():
+        apply_transaction(s, "u1", Decimal("-10"), "bet", "k1")
+        # sin commit todavía: el caché sigue con el saldo confirmado
+        assert balances.get("u1") == Decimal("100")
+    assert balances.get("u1") is None
+    assert balances.read("u1", load) == Decimal("90")
+    # escritura ORM (como el crédito de admin)
+    with Session(engine) as s, s.begin():
+        s.get(Wallet, "u1").balance += Decimal("5")
+    assert balances.read("u1", load) == Decimal("95")
+
+
+def test_off_cache_skips_hooks():
+    # apagado (sin bus ni tamaño) las escrituras no pagan el registro
+    assert not balances.enabled
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as s, s.begin():
+        s.add(Wallet(user_id="u1", balance=Decimal("100")))
+    with Session(engine) as s, s.begin():
+        apply_transaction(s, "u1", Decimal("-10"), "bet", "k1")
+        assert not s.info
+
+
+def test_invalidations_cross_workers(tmp_path):
+    a, b = BalanceCache(size=100), BalanceCache(size=100)
+
+    async def run():
+        a.start_bus(str(tmp_path))
+        # el otro worker: su propio socket en el mismo directorio
+        b.bus = UnixBus(str(tmp_path), lambda uids: b.invalidate(uids, publish=False))
+        b.bus.addr = str(tmp_path / "peer.sock")
+        b.bus.start()
+        b.fill("u1", Decimal("7"), b.version)
+        a.invalidate(["u1", "u2"])
+        for _ in range(100):
+            if b.get("u1") is None:
+                break
+            await asyncio.sleep(0.01)
+        a.stop_bus()
+        b.stop_bus()
+
+    asyncio.run(run())
+    assert b.get("u1") is None and b.version == 1
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,114 @@
+import asyncio
+
+from api.crash.betbook import BetBook, cents
+from api.crash.engine import CrashEngine
+
+
+def _running_engine() -> CrashEngine:
+    engine = CrashEngine()
+    engine.started = True  # evitar autostart del loop
+    return engine
+
+
+def test_only_due_auto_cashouts_settle():
+    async def run():
+        engine = _running_engine()
+        await engine.place_bet("a", 10, auto=1.5)
+        await engine.place_bet("b", 10, auto=3.0)
+        await engine.place_bet("c", 10)
+        engine.phase = "RUNNING"
+        engine.multiplier = 1.2
+        assert engine._settle_due_autos() == 0
+        engine.multiplier = 1.6
+        assert engine._settle_due_autos() == 1
+        return engine
+
+    engine = asyncio.run(run())
+    # cobra a su objetivo, no al tick que lo pasó
+    assert engine.bets["a"]["cashed"] and engine.bets["a"]["cash_at"] == 1.5
+    assert engine.bets["a"]["payout"] == 15.0
+    assert not engine.bets["b"]["cashed"]
+    assert not engine.bets["c"]["cashed"]
+    assert engine.bets.pending_autos() == 1
+
+
+def test_payouts_truncate_to_cents():
+    assert cents(1.15) == 1.15 and cents(2.999) == 2.99
+    book = BetBook()
+    book.add("a", 10.0, auto=1.239)
+    assert book.next_auto() == 1.23
+    assert book.pop_due(1.25) == [0]
+    assert book["a"]["cash_at"] == 1.23 and book["a"]["payout"] == 12.3
+
+
+def test_manual_cashout_is_not_paid_twice():
+    async def run():
+        engine = _running_engine()
+        await engine.place_bet("a", 10, auto=2.0)
+        engine.phase = "RUNNING"
+        engine.multiplier = 1.5
+        await engine.cashout("a")
+        engine.multiplier = 2.5
+        return engine, engine._settle_due_autos()
+
+    engine, n = asyncio.run(run())
+    assert n == 0
+    assert engine.bets["a"]["cash_at"] == 1.5
+
+
+def test_betbook_settlement():
+    book = BetBook()
+    for i in range(1000):
+        book.add(f"p{i}", 10.0, auto=1.5 if i % 2 else None)
+    book.cash(book.index["p0"], 2.0)
+    due = book.pop_due(1.5)
+    assert len(due) == 500
+    losers = book.losers()
+    assert len(losers) == 499 and "p0" not in losers
+    assert book.total_wagered() == 10000.0
+    assert book.total_paid() == 20.0 + 500 * 15.0
+    assert book.nbytes() == 1000 * 4 * 8
+
+
+def test_cashout_uses_exact_multiplier_at_request_time():
+    import math
+    import time
+
+    from api.crash.engine import CRASH_GROWTH_RATE
+
+    async def run():
+        engine = _running_engine()
+        await engine.place_bet("a", 10)
+        await engine.place_bet("b", 10)
+        engine.phase = "RUNNING"
+        engine.crash_at = 3.0
+        engine.multiplier = 1.5  # último tick, viejo
+        engine.t0 = time.perf_counter() - math.log(2.0) / CRASH_GROWTH_RATE
+        first = await engine.cashout("a")
+        # la curva ya pasó el crash aunque el loop todavía no lo publicó
+        engine.t0 = time.perf_counter() - math.log(3.5) / CRASH_GROWTH_RATE
+        try:
+            await engine.cashout("b")
+        except RuntimeError as exc:
+            return first, str(exc)
+        return first, None
+
+    first, err = asyncio.run(run())
+    assert first["at"] == 2.0 and first["payout"] == 20.0
+    assert err == "NOT_RUNNING"
+
+
+def test_betbook_seal_keeps_manual_cashouts():
+    book = BetBook()
+    book.add("a", 10.0, auto=2.0)
+    book.add("b", 10.0)
+    book.add("c", 10.0, auto=1.5)
+    book.add("d", 10.0, auto=1.8)
+    book.cash(book.index["d"], 1.2)  # cobró a mano antes del objetivo
+    book.seal()
+    assert book.players == ["b", "c", "d", "a"] and book.index["a"] == 3
+    due = book.pop_due(1.9)
+    assert [book.players[i] for i in due] == ["c"]
+    assert book["d"]["cash_at"] == 1.2 and book["d"]["payout"] == 12.0
+    assert book["c"]["payout"] == 15.0
+    assert book.losers() == ["b", "a"]
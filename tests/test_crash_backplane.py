@@ -0,0 +1,131 @@
+import asyncio
+import json
+
+import pytest
+
+from api.crash.backplane import RemoteEngine, UnixSocketBackplane
+from api.crash.engine import CrashEngine
+
+
+class FakeWS:
+    def __init__(self) -> None:
+        self.frames: list[str] = []
+
+    async def send_text(self, data: str) -> None:
+        self.frames.append(data)
+
+
+def _factory() -> CrashEngine:
+    eng = CrashEngine()
+    eng.started = True  # evitar autostart del loop
+    eng.coalesce_ms = 0
+    return eng
+
+
+def test_unix_backplane_shares_one_round(tmp_path):
+    path = str(tmp_path / "crash.sock")
+
+    async def run():
+        producer = UnixSocketBackplane(_factory, path)
+        worker = UnixSocketBackplane(_factory, path)
+        assert producer.is_producer and not worker.is_producer
+        assert isinstance(worker.engine, RemoteEngine)
+        await producer.start()
+        await worker.start()
+        remote = worker.engine
+        for _ in range(100):
+            if remote._writer is not None:
+                break
+            await asyncio.sleep(0.01)
+        assert remote.round_id == producer.engine.round_id
+
+        ws = FakeWS()
+        remote.fanout.add(ws)
+        info = await remote.place_bet("u1", 5.0)
+        assert info["rid"] == producer.engine.round_id
+        assert "u1" in producer.engine.bets
+        with pytest.raises(RuntimeError, match="ALREADY_BET"):
+            await remote.place_bet("u1", 5.0)
+        with pytest.raises(ValueError, match="MIN_BET"):
+            await remote.place_bet("u2", 0.0)
+        await asyncio.sleep(0.05)
+
+        await remote.fanout.close()
+        await worker.stop()
+        await producer.stop()
+        return ws
+
+    ws = asyncio.run(run())
+    assert [json.loads(f)["t"] for f in ws.frames] == ["player_bet"]
+
+
+async def _connected(remote: RemoteEngine) -> None:
+    for _ in range(200):
+        if remote._writer is not None:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("worker never connected")
+
+
+def test_snapshot_hides_crash_at_while_running(tmp_path):
+    path = str(tmp_path / "crash.sock")
+
+    async def run():
+        producer = UnixSocketBackplane(_factory, path)
+        eng = producer.engine
+        eng.phase, eng.crash_at = "RUNNING", 7.5
+        running = producer._snapshot()["at"]
+        worker = UnixSocketBackplane(_factory, path)
+        await producer.start()
+        await worker.start()
+        await _connected(worker.engine)
+        mirrored = worker.engine.crash_at
+        eng.phase = "CRASHED"
+        crashed = producer._snapshot()["at"]
+        await worker.stop()
+        await producer.stop()
+        return running, mirrored, crashed
+
+    assert asyncio.run(run()) == (None, None, 7.5)
+
+
+def test_worker_takes_over_when_producer_dies(tmp_path, monkeypatch):
+    import api.crash.backplane as backplane_mod
+
+    monkeypatch.setattr(backplane_mod, "CRASH_BACKPLANE_RETRY_MS", 10)
+    path = str(tmp_path / "crash.sock")
+
+    async def run():
+        producer = UnixSocketBackplane(_factory, path)
+        worker = UnixSocketBackplane(_factory, path)
+        promoted: list = []
+
+        async def on_promote(eng):
+            promoted.append(eng)
+
+        worker.on_promote = on_promote
+        await producer.start()
+        await worker.start()
+        remote = worker.engine
+        await _connected(remote)
+        old_rid = remote.round_id
+        await producer.stop()  # libera el flock como si el proceso muriera
+        for _ in range(200):
+            if worker.is_producer:
+                break
+            await asyncio.sleep(0.01)
+        assert worker.is_producer and promoted == [remote]
+        assert remote.local and remote.phase == "BETTING" and remote.round_id != old_rid
+        remote.started = True  # evitar autostart del loop
+        info = await remote.place_bet("u1", 5.0)
+        assert "u1" in remote.bets and info["rid"] == remote.round_id
+        # un worker nuevo se engancha al promovido
+        late = UnixSocketBackplane(_factory, path)
+        assert not late.is_producer
+        await late.start()
+        await _connected(late.engine)
+        assert late.engine.round_id == remote.round_id
+        await late.stop()
+        await worker.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,81 @@
+import hashlib
+
+import pytest
+
+from api.crash.hashchain import HashChain, generate
+from api.services.rng import crash_multiplier
+
+
+def test_chain_links_to_terminal():
+    chain = HashChain.in_memory(50, seed=b"s" * 32, salt="salt", house_edge=0.01)
+    for g in range(1, 51):
+        assert hashlib.sha256(bytes.fromhex(chain.hash(g))).hexdigest() == chain.hash(g - 1)
+    g, m = chain.take()
+    assert g == 1
+    assert m == crash_multiplier(chain.hash(1), "salt", 1, 0.01)
+
+
+def test_take_is_ordered_with_lookahead():
+    chain = HashChain.in_memory(100, seed=b"s" * 32, lookahead=8)
+    games = []
+    for _ in range(30):
+        chain.ensure_lookahead()
+        games.append(chain.take())
+    assert [g for g, _ in games] == list(range(1, 31))
+    assert all(m == chain.outcome(g) for g, m in games)
+
+
+def test_exhausted():
+    chain = HashChain.in_memory(2, seed=b"s" * 32)
+    chain.take()
+    chain.take()
+    with pytest.raises(RuntimeError, match="CHAIN_EXHAUSTED"):
+        chain.take()
+
+
+def test_verify_detects_tampering():
+    buf = HashChain.in_memory(20, seed=b"s" * 32)._buf
+    chain = HashChain(buf)
+    res = chain.verify(5, 9)
+    assert res["ok"] and [r["game"] for r in res["rounds"]] == [5, 6, 7, 8, 9]
+    buf[3 * 32] ^= 1
+    assert not HashChain(buf).verify(5, 9)["ok"]
+
+
+def test_verify_walks_to_terminal_once():
+    buf = HashChain.in_memory(20, seed=b"s" * 32)._buf
+    chain = HashChain(buf)
+    assert chain.verify(5, 9)["ok"] and chain._verified == 9
+    # lo ya enlazado con h[0] no se vuelve a recorrer
+    buf[3 * 32] ^= 1
+    assert chain.verify(12, 14)["ok"] and chain._verified == 14
+    # un tramo adulterado no avanza la marca
+    buf[16 * 32] ^= 1
+    assert not chain.verify(16, 18)["ok"] and chain._verified == 14
+
+
+def test_file_chain_never_replays_after_restart(tmp_path):
+    path = str(tmp_path / "chain.bin")
+    generate(path, 1000)
+    chain = HashChain.open(path, lookahead=16)
+    chain.ensure_lookahead()
+    taken = [chain.take()[0] for _ in range(3)]
+    chain._filling.result()
+    again = HashChain.open(path)
+    assert again.terminal == chain.terminal
+    # lo reservado por el lookahead se saltea: nunca se repite un juego
+    assert again.take()[0] > max(taken)
+
+
+def test_cursor_writers_do_not_clobber_each_other(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    path = str(tmp_path / "chain.bin")
+    generate(path, 10)
+    chain = HashChain.open(path)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(chain._save_cursor, list(range(2, 400)) * 4))
+    # el cursor persistido nunca retrocede y no quedan temporales
+    with open(f"{path}.pos") as f:
+        assert f.read() == "399"
+    assert not (tmp_path / "chain.bin.pos.tmp").exists()
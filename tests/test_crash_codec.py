@@ -0,0 +1,48 @@
+import uuid
+
+import pytest
+
+from api.crash.codec import decode_binary, encode, encode_binary, encode_json
+
+RID = str(uuid.uuid4())
+
+
+@pytest.mark.parametrize(
+    "msg",
+    [
+        {"t": "tick", "m": 1.23},
+        {"t": "player_cash", "at": 2.5, "p": 25.0},
+        {"t": "player_bet", "a": 10.0},
+        {"t": "start", "rid": RID, "ts": 123456789, "k": 0.06, "g": 42},
+        {"t": "start", "rid": RID, "ts": 123456789, "k": 0.06},
+        {"t": "sync", "ts": 123456789, "e": 1500, "m": 1.09},
+        {"t": "crash", "at": 4.56, "g": 42, "h": "ab" * 32},
+        {"t": "crash", "at": 4.56},
+        {"t": "betting", "rid": RID},
+        {"t": "state", "phase": "RUNNING", "rid": RID, "m": 1.5, "k": 0.06, "e": 700},
+        {"t": "tick", "m": 1.23, "s": 70000},
+        {"t": "state", "phase": "BETTING", "rid": RID, "m": 1.0, "k": 0.0, "e": 0, "s": 12, "ep": 987654321},
+    ],
+)
+def test_binary_roundtrip(msg):
+    assert decode_binary(encode_binary(msg)) == msg
+
+
+def test_binary_frames_are_compact():
+    assert len(encode_binary({"t": "tick", "m": 1.23, "s": 1})) == 9
+    assert len(encode_binary({"t": "player_cash", "at": 2.5, "p": 25.0, "s": 2})) == 17
+
+
+def test_binary_batch_roundtrip():
+    msg = {"t": "batch", "ev": [{"t": "tick", "m": 1.5}, {"t": "player_cash", "at": 1.5, "p": 15.0}]}
+    frame = encode_binary(msg)
+    assert len(frame) == 3 + 2 + 9 + 2 + 17
+    assert decode_binary(frame) == msg
+
+
+def test_unknown_events_fall_back_to_generic_json():
+    msg = {"t": "history", "rounds": [{"id": RID, "at": 1.5}]}
+    frame = encode(msg, "bin1")
+    assert frame[0] == 0
+    assert decode_binary(frame) == msg
+    assert encode(msg) == encode_json(msg)
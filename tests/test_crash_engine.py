@@ -1,15 +1,15 @@
-import pytest
-pytestmark = pytest.mark.skip(reason="crash engine tests timing-sensitive")
-
+import asyncio
+import math
 import os
 import sys
-import time
 from pathlib import Path
 
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.append(str(ROOT / "backend"))
+sys.path.append(str(ROOT / "tools"))
 
 # set basic envs
 os.environ.setdefault("DATABASE_URL", "sqlite://")
@@ -17,24 +17,102 @@ os.environ.setdefault("JWT_SECRET", "secret")
 os.environ.setdefault("ALLOWED_ORIGINS", "[]")
 os.environ.setdefault("RATE_LIMIT_PER_MIN", "1000")
 
+import api.crash.engine as api_engine  # noqa: E402
+from bench_crash import play  # noqa: E402
+from api.crash.clock import VirtualClock  # noqa: E402
 
-def create_client():
-    import importlib
-    import app.crash.engine as eng
-    importlib.reload(eng)
-    import api.main as main
-    importlib.reload(main)
-    return TestClient(main.app)
 
+def test_bet_validation():
+    import app.crash.engine as eng
+    from app.crash.router import router
 
-def test_bet_validation(monkeypatch):
-    monkeypatch.setenv("CRASH_BETTING_SECONDS", "0.2")
-    monkeypatch.setenv("CRASH_INTERMISSION_SECONDS", "0.1")
-    client = create_client()
+    legacy = FastAPI()
+    legacy.include_router(router)
+    client = TestClient(legacy)
     r = client.post("/crash/bet", json={"amount": 0})
     assert r.status_code == 422
-    import app.crash.engine as eng
     eng.engine.phase = "RUNNING"
-    r2 = client.post("/crash/bet", json={"amount": 1})
+    try:
+        r2 = client.post("/crash/bet", json={"amount": 1})
+    finally:
+        eng.engine.phase = "BETTING"
     assert r2.status_code == 409
 
+
+def test_legacy_round_in_virtual_time():
+    from app.crash.engine import CrashEngine as LegacyEngine
+
+    async def run():
+        clock = VirtualClock()
+        engine = LegacyEngine(now=clock.now, sleep=clock.sleep)
+        engine.betting_seconds, engine.growth_rate = 6.0, 0.06
+        engine._generate_crash_at = lambda: 2.0  # type: ignore[method-assign]
+        task = asyncio.create_task(engine.run())
+        await clock.advance(1.0)
+        await engine.place_bet("a", 10.0, 1.5)
+        await engine.place_bet("b", 10.0, None)
+        # apuestas (6 s) + curva hasta 2x (~11.6 s): casi instantáneo en tiempo real
+        await clock.advance(5.0 + math.log(2.0) / 0.06 + 0.2)
+        state = engine.get_state("a")
+        task.cancel()
+        return state, dict(engine.balances)
+
+    state, balances = asyncio.run(run())
+    assert state["phase"] == "CRASHED" and state["crash_at"] == 2.0
+    assert balances["a"] >= 15.0 and balances["b"] == -10.0
+
+
+def _api_engine(clock: VirtualClock, crash_at: float) -> api_engine.CrashEngine:
+    engine = api_engine.CrashEngine(clock=clock)
+    engine._gen_crash_at = lambda: crash_at  # type: ignore[method-assign]
+    return engine
+
+
+def test_round_timing_is_exact_in_virtual_time(monkeypatch):
+    monkeypatch.setattr(api_engine, "CRASH_TICK_MS", 100)
+    monkeypatch.setattr(api_engine, "CRASH_GROWTH_RATE", 0.06)
+    monkeypatch.setattr(api_engine, "CRASH_INTERMISSION_SECONDS", 4)
+    clock = VirtualClock()
+    engine = _api_engine(clock, 2.0)
+    events: list[tuple[float, dict]] = []
+    publish = engine.fanout.publish_events
+    engine.fanout.publish_events = lambda out: (events.extend((clock.now(), m) for m, _ in out), publish(out))  # type: ignore[method-assign]
+
+    async def run():
+        engine.bets.add("a", 10.0)
+        await engine.place_bet("b", 10.0)
+        await clock.advance(5.0)
+        cash = await engine.cashout("a")
+        await clock.run(engine._runner_task)
+        return cash
+
+    cash = asyncio.run(run())
+    t_crash = math.log(2.0) / 0.06
+    ticks = [m for _, m in events if m["t"] == "tick"]
+    crash_t = next(t for t, m in events if m["t"] == "crash")
+    # siempre lo mismo: 115 ticks de 100 ms y el crash justo en ln(2)/k
+    assert len(ticks) == int(t_crash / 0.1)
+    assert abs(crash_t - t_crash) < 1e-9
+    assert cash == {"at": 1.34, "payout": 13.4, "rid": cash["rid"]}
+    assert engine.phase == "BETTING" and clock.now() == t_crash + 4
+
+
+def test_bench_plays_rounds_in_virtual_time():
+    result = asyncio.run(play(rounds=30, bettors=10))
+    assert result["rounds"] == 30 and result["bets"] == 300
+    assert result["history"] == 30
+    assert result["virtual_seconds"] > result["seconds"]
+    assert result["mem_bytes_per_bet"] > 0
+    # misma semilla, mismas rondas
+    again = asyncio.run(play(rounds=30, bettors=10))
+    assert again["virtual_seconds"] == result["virtual_seconds"]
+
+
+def test_bench_settles_on_its_own_sessions():
+    import api.db as db
+
+    sessions, bind = db.AsyncSessionLocal, db.AsyncSessionLocal.kw["bind"]
+    result = asyncio.run(play(rounds=3, bettors=5, settle="sqlite"))
+    assert result["settle_us_per_bet"] is not None
+    # la app sigue apuntando a su base
+    assert db.AsyncSessionLocal is sessions and db.AsyncSessionLocal.kw["bind"] is bind
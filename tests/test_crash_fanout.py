@@ -0,0 +1,184 @@
+import asyncio
+import json
+
+from api.crash.fanout import Fanout
+
+
+class FakeWS:
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.frames: list[str] = []
+        self.closed_code: int | None = None
+
+    async def send_text(self, data: str) -> None:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.frames.append(data)
+
+    async def close(self, code: int = 1000) -> None:
+        self.closed_code = code
+
+    async def accept(self, subprotocol=None) -> None:
+        pass
+
+
+def test_publish_reaches_every_subscriber_in_order():
+    async def run():
+        fan = Fanout(queue_size=8)
+        socks = [FakeWS() for _ in range(5)]
+        for ws in socks:
+            fan.add(ws)
+        fan.publish({"t": "tick", "m": 1.01})
+        fan.publish({"t": "tick", "m": 1.02})
+        await asyncio.sleep(0.01)
+        await fan.close()
+        return socks
+
+    socks = asyncio.run(run())
+    for ws in socks:
+        assert [json.loads(f)["m"] for f in ws.frames] == [1.01, 1.02]
+
+
+def test_slow_consumer_is_evicted_without_blocking_others():
+    async def run():
+        fan = Fanout(queue_size=2)
+        fast, slow = FakeWS(), FakeWS(delay=1.0)
+        fan.add(fast)
+        fan.add(slow)
+        await asyncio.sleep(0)
+        for i in range(5):
+            fan.publish({"t": "tick", "i": i})
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        assert slow not in fan
+        assert fast in fan
+        await fan.close()
+        return fan, fast, slow
+
+    fan, fast, slow = asyncio.run(run())
+    assert len(fast.frames) == 5
+    assert slow.closed_code == 1013
+    assert fan.evicted == 1
+
+
+def test_dead_socket_is_dropped():
+    class DeadWS(FakeWS):
+        async def send_text(self, data: str) -> None:
+            raise RuntimeError("closed")
+
+    async def run():
+        fan = Fanout()
+        ws = DeadWS()
+        fan.add(ws)
+        fan.publish({"t": "tick"})
+        await asyncio.sleep(0.01)
+        return fan
+
+    assert len(asyncio.run(run())) == 0
+
+
+def test_engine_publishes_outside_the_lock():
+    from api.crash.engine import CrashEngine
+
+    async def run():
+        engine = CrashEngine()
+        seen: list[bool] = []
+        engine.fanout.publish = lambda msg, mode=None: seen.append(engine._lock.locked())  # type: ignore[method-assign]
+        engine.phase = "RUNNING"
+        engine.multiplier = 2.0
+        engine.bets.add("p1", 10.0)
+        await engine.cashout("p1")
+        await asyncio.sleep(engine.coalesce_ms / 1000 + 0.05)
+        return seen
+
+    assert asyncio.run(run()) == [False]
+
+
+def test_publish_by_mode():
+    async def run():
+        fan = Fanout()
+        ticks, keys = FakeWS(), FakeWS()
+        fan.add(ticks)
+        fan.add(keys, "keyframes")
+        fan.publish({"t": "tick"}, "ticks")
+        fan.publish({"t": "sync"}, "keyframes")
+        fan.publish({"t": "crash"})
+        await asyncio.sleep(0.01)
+        await fan.close()
+        return ticks, keys
+
+    ticks, keys = asyncio.run(run())
+    assert [json.loads(f)["t"] for f in ticks.frames] == ["tick", "crash"]
+    assert [json.loads(f)["t"] for f in keys.frames] == ["sync", "crash"]
+
+
+def test_batch_and_compat_subscribers():
+    async def run():
+        fan = Fanout()
+        batched, single = FakeWS(), FakeWS()
+        fan.add(batched)
+        fan.add(single, batch=False)
+        fan.publish_batch([{"t": "player_bet", "a": 1.0}, {"t": "player_bet", "a": 2.0}])
+        await asyncio.sleep(0.01)
+        await fan.close()
+        return batched, single
+
+    batched, single = asyncio.run(run())
+    assert [json.loads(f)["t"] for f in batched.frames] == ["batch"]
+    assert [json.loads(f)["a"] for f in single.frames] == [1.0, 2.0]
+
+
+def test_engine_coalesces_events_in_window():
+    from api.crash.engine import CrashEngine
+
+    async def run():
+        engine = CrashEngine()
+        engine.coalesce_ms = 20
+        ws = FakeWS()
+        engine.fanout.add(ws)
+        engine.started = True  # evitar autostart del loop
+        for i in range(50):
+            await engine.place_bet(f"p{i}", 1.0)
+        await asyncio.sleep(0.05)
+        await engine.fanout.close()
+        return ws
+
+    ws = asyncio.run(run())
+    assert len(ws.frames) == 1
+    assert len(json.loads(ws.frames[0])["ev"]) == 50
+
+
+def test_reconnect_replays_missed_events_by_seq():
+    from api.crash.engine import CrashEngine
+
+    async def run():
+        engine = CrashEngine()
+        engine._replay = type(engine._replay)(maxlen=4)
+        for i in range(6):
+            # por el outbox, como place_bet: un flush por evento
+            engine._emit({"t": "player_bet", "a": float(i)})
+            engine._flush()
+        engine._emit({"t": "tick", "m": 1.5}, "ticks")
+        engine._flush()
+        fresh, behind, stale, current, rebooted = FakeWS(), FakeWS(), FakeWS(), FakeWS(), FakeWS()
+        ep = engine.epoch
+        await engine.subscribe(fresh)
+        await engine.subscribe(behind, "keyframes", since=5, epoch=ep)
+        await engine.subscribe(stale, since=1, epoch=ep)
+        await engine.subscribe(current, since=engine.seq, epoch=ep)
+        # el mismo seq de otro arranque del server: resync completo
+        await engine.subscribe(rebooted, since=5, epoch=ep + 1)
+        await asyncio.sleep(0.01)
+        await engine.fanout.close()
+        return engine, fresh, behind, stale, current, rebooted
+
+    engine, fresh, behind, stale, current, rebooted = asyncio.run(run())
+    assert engine.seq == 7
+    # 6 y 7 se perdieron; el tick no es del modo keyframes
+    assert [json.loads(f) for f in behind.frames] == [{"t": "player_bet", "a": 5.0, "s": 6}]
+    # demasiado atrás (fuera del replay): snapshot compacto
+    assert [json.loads(f)["t"] for f in stale.frames] == ["state"]
+    assert json.loads(fresh.frames[0])["s"] == 7
+    assert json.loads(fresh.frames[0])["ep"] == engine.epoch
+    assert [json.loads(f)["t"] for f in rebooted.frames] == ["state"]
+    assert current.frames == []
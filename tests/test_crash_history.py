@@ -0,0 +1,49 @@
+import asyncio
+from decimal import Decimal
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+import api.db as db
+from api.crash.history import RoundHistory
+from api.models import Base, CrashBet, CrashRound, User
+
+
+def test_ring_buffer_keeps_latest_first():
+    h = RoundHistory(size=3)
+    etag = h.etag
+    for i in range(5):
+        h.add(f"r{i}", 1.5 + i, 2, 20.0, 15.0)
+    assert [r["rid"] for r in h.items()] == ["r4", "r3", "r2"]
+    assert h.etag == '"r4"' != etag
+    assert h.body.startswith(b'[{"rid":"r4"')
+
+
+def test_warm_from_db(monkeypatch, tmp_path):
+    path = tmp_path / "hist.db"
+    eng = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(eng)
+    with Session(eng) as s, s.begin():
+        s.add(User(id="u1", email="u1@example.com", username="u1", password_hash="x"))
+        s.add(CrashRound(id="old", crash_at=3.0))
+        s.add(CrashRound(id="empty", crash_at=1.2))
+        s.add(CrashRound(id="vip1", crash_at=4.0, room="vip"))
+        s.add(CrashBet(round_id="old", user_id="u1", amount=Decimal("10"), payout=Decimal("25")))
+    async_eng = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    monkeypatch.setattr(db, "AsyncSessionLocal", async_sessionmaker(async_eng))
+
+    h = RoundHistory(size=10)
+    h.add("live", 2.0, 1, 5.0, 0.0)
+    asyncio.run(h.warm())
+    rounds = {r["rid"]: r for r in h.items()}
+    assert h.items()[0]["rid"] == "live"
+    assert rounds["old"] == {"rid": "old", "crash_at": 3.0, "players": 1, "wagered": 10.0, "paid": 25.0}
+    assert rounds["empty"]["players"] == 0
+    assert "vip1" not in rounds
+
+    # otra sala sólo ve sus rondas
+    vip = RoundHistory(size=10)
+    asyncio.run(vip.warm("vip"))
+    assert [r["rid"] for r in vip.items()] == ["vip1"]
@@ -0,0 +1,98 @@
+import asyncio
+
+import api.crash.engine as engine_mod
+from api.crash.clock import VirtualClock
+from api.crash.engine import CrashEngine
+from api.crash.rooms import RoomRegistry
+
+
+def _room_engine(crash_at: float, clock: VirtualClock | None = None) -> CrashEngine:
+    engine = CrashEngine(clock=clock)
+    engine.schedule = "events"
+    engine._gen_crash_at = lambda: crash_at  # type: ignore[method-assign]
+    return engine
+
+
+def test_many_rooms_share_one_scheduler_task(monkeypatch):
+    monkeypatch.setattr(engine_mod, "CRASH_GROWTH_RATE", 0.06)
+    monkeypatch.setattr(engine_mod, "CRASH_INTERMISSION_SECONDS", 4)
+    n = 200
+    clock = VirtualClock()
+
+    async def run():
+        registry = RoomRegistry(lambda: _room_engine(1.0 + len(registry) / 100, clock), clock=clock)
+        for i in range(n):
+            registry.add(f"r{i}")
+        crashes: dict[str, float] = {}
+        for name in registry:
+            e = registry.get(name)
+
+            async def on_crash(rid, losers, name=name, e=e):
+                crashes[name] = e.history.items()[0]["crash_at"]
+
+            e.on_crash = on_crash
+            await e.place_bet("p1", 1.0)
+        tasks_during = len(asyncio.all_tasks())
+        # la más larga llega a 2.99x en ~18 s simulados, más 4 s de intermedio
+        await clock.advance(30.0)
+        phases = {registry.get(name).phase for name in registry}
+        await registry.scheduler.stop()
+        return crashes, tasks_during, phases, registry.scheduler.wakeups
+
+    crashes, tasks_during, phases, wakeups = asyncio.run(run())
+    assert len(crashes) == n
+    # cada sala crashea en su propio punto
+    assert crashes["r0"] == 1.0 and crashes["r150"] == 2.5
+    assert phases == {"BETTING"}
+    # una tarea (el scheduler) + la principal, no una por sala
+    assert tasks_during <= 2
+    # sin espectadores, en tiempo virtual exacto: begin + crash + reset
+    assert wakeups == 3 * n
+
+
+def test_rooms_are_independent(monkeypatch):
+    monkeypatch.setattr(engine_mod, "CRASH_GROWTH_RATE", 20.0)
+    monkeypatch.setattr(engine_mod, "CRASH_INTERMISSION_SECONDS", 0)
+
+    async def run():
+        registry = RoomRegistry(lambda: _room_engine(3.0))
+        vip, low = registry.add("vip"), registry.add("low")
+        await vip.place_bet("p1", 5.0)
+        running = (vip.phase, low.phase, low.round_id != vip.round_id)
+        await low.place_bet("p1", 1.0)  # el mismo jugador en otra sala
+        await asyncio.sleep(0.01)
+        data = await vip.cashout("p1")
+        low_has_bet = "p1" in low.bets
+        await registry.scheduler.stop()
+        return running, data, low_has_bet
+
+    running, data, low_has_bet = asyncio.run(run())
+    assert running == ("RUNNING", "BETTING", True)
+    assert data["at"] >= 1.0
+    assert low_has_bet
+
+
+def test_stop_leaves_running_rounds_undecided(monkeypatch):
+    monkeypatch.setattr(engine_mod, "CRASH_GROWTH_RATE", 0.06)
+    clock = VirtualClock()
+
+    async def run():
+        registry = RoomRegistry(lambda: _room_engine(50.0, clock), clock=clock)
+        room = registry.add("vip")
+        settled: list = []
+
+        async def on_crash(rid, losers):
+            settled.append((rid, losers))
+
+        room.on_crash = on_crash
+        await room.place_bet("alice", 5.0)
+        await clock.advance(1.0)
+        revealed = room.revealed
+        await registry.scheduler.stop()
+        return room, settled, revealed
+
+    room, settled, revealed = asyncio.run(run())
+    # apagar no crashea la ronda ni liquida a nadie
+    assert settled == []
+    assert room.phase == "RUNNING" and room.bets["alice"]["cashed"] is False
+    assert room.revealed == revealed
@@ -0,0 +1,91 @@
+import asyncio
+from decimal import Decimal
+from functools import partial
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+import api.db as db
+from api.crash.settlement import SettlementPipeline, settle_bet, settle_cashout
+from api.models import Base, CrashBet, CrashRound, LedgerEntry, User, Wallet
+
+
+@pytest.fixture
+def engine(monkeypatch, tmp_path):
+    # archivo compartido: el pipeline escribe por aiosqlite, el test lee sincrónico
+    path = tmp_path / "settle.db"
+    eng = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(eng)
+    async_eng = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    monkeypatch.setattr(db, "AsyncSessionLocal", async_sessionmaker(async_eng, expire_on_commit=False))
+    with Session(eng) as s, s.begin():
+        for i in range(50):
+            s.add(User(id=f"u{i}", email=f"u{i}@example.com", username=f"u{i}", password_hash="x"))
+            s.add(Wallet(user_id=f"u{i}", balance=Decimal("100")))
+    return eng
+
+
+def test_bets_are_applied_in_few_batches(engine):
+    pipe = SettlementPipeline(window_ms=20, max_batch=500)
+
+    async def run():
+        ops = [pipe.submit(partial(settle_bet, "r1", 2.0, f"u{i}", 10.0, "vip")) for i in range(50)]
+        # una apuesta sin saldo sólo falla ella
+        ops.append(pipe.submit(partial(settle_bet, "r2", 2.0, "u0", 500.0, None)))
+        return await asyncio.gather(*ops, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(r is None for r in results[:50])
+    assert isinstance(results[50], HTTPException)
+    assert pipe.batches == 1
+    with Session(engine) as s:
+        assert s.scalar(select(func.count()).select_from(CrashBet)) == 50
+        assert s.get(Wallet, "u1").balance == Decimal("90")
+        assert s.get(CrashRound, "r1").room == "vip"
+
+
+def test_cashout_is_idempotent_across_batches(engine):
+    pipe = SettlementPipeline()
+
+    async def run():
+        await pipe.submit(partial(settle_bet, "r1", 2.0, "u1", 10.0, None))
+        await asyncio.gather(
+            pipe.submit(partial(settle_cashout, "r1", "u1", 2.0, 20.0)),
+            pipe.submit(partial(settle_cashout, "r1", "u1", 2.0, 20.0)),
+        )
+
+    asyncio.run(run())
+    with Session(engine) as s:
+        assert s.get(Wallet, "u1").balance == Decimal("110")
+        assert s.scalar(select(func.count()).select_from(LedgerEntry)) == 2
+
+
+def test_rejected_op_rolls_back_its_writes(engine):
+    pipe = SettlementPipeline(window_ms=20)
+
+    async def half_written(s, ctx):
+        s.add(CrashRound(id="r-bad", crash_at=1.0))
+        await s.flush()
+        raise HTTPException(400, "NOPE")
+
+    async def run():
+        return await asyncio.gather(
+            pipe.submit(partial(settle_bet, "r1", 2.0, "u1", 10.0, None)),
+            pipe.submit(half_written),
+            pipe.submit(partial(settle_cashout, "r1", "u1", 1.5, 15.0)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], HTTPException)
+    assert pipe.batches == 1
+    with Session(engine) as s:
+        # el lote se aplicó, pero nada de la op rechazada
+        assert s.get(CrashRound, "r-bad") is None
+        assert s.get(Wallet, "u1").balance == Decimal("105")
+        assert s.scalars(select(CrashBet)).one().status == "CASHED"
@@ -1,13 +1,17 @@
 import os
 import sys
 from pathlib import Path
+import tempfile
 import time
 
 import pytest
 from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
 from sqlalchemy import create_engine, select
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool, StaticPool
 
+import api.crash.engine as engine_mod
 from api.crash.engine import CrashEngine
 import api.crash.router as crash_router
 from api.models import CrashBet, Base
@@ -23,15 +27,25 @@ import api.db as db  # noqa: E402
 import api.auth as auth  # noqa: E402
 
 
-# In-memory SQLite for tests
+# SQLite en un archivo temporal: el crash escribe por aiosqlite y el resto lee sincrónico
+_db_path = Path(tempfile.mkdtemp()) / "crash_smoke.db"
 test_engine = create_engine(
-    "sqlite://",
+    f"sqlite:///{_db_path}",
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
-db.engine = test_engine
-auth.engine = test_engine
-db.SessionLocal.configure(bind=test_engine)
+test_async_engine = create_async_engine(f"sqlite+aiosqlite:///{_db_path}", poolclass=NullPool)
+
+
+def _bind_test_db():
+    # otros módulos de tests rebindean los mismos globals al importarse
+    db.engine = test_engine
+    auth.engine = test_engine
+    db.SessionLocal.configure(bind=test_engine)
+    db.AsyncSessionLocal.configure(bind=test_async_engine)
+
+
+_bind_test_db()
 Base.metadata.drop_all(db.engine)
 Base.metadata.create_all(db.engine)
 
@@ -40,6 +54,7 @@ client = TestClient(main.app)
 
 @pytest.fixture(autouse=True)
 def _fresh_db():
+    _bind_test_db()
     Base.metadata.drop_all(db.engine)
     Base.metadata.create_all(db.engine)
     yield
@@ -82,13 +97,7 @@ def test_cashout_is_idempotent():
     engine = main.app.state.crash_engine
     engine.phase = "RUNNING"
     engine.multiplier = 2.0
-    engine.bets[uid] = {
-        "amount": 10.0,
-        "auto": None,
-        "cashed": False,
-        "payout": None,
-        "cash_at": None,
-    }
+    engine.bets.add(uid, 10.0)
     r1 = client.post("/crash/cashout", headers=headers)
     assert r1.status_code == 200
     data1 = r1.json()
@@ -117,12 +126,115 @@ def test_wallet_and_cashout_flow():
         assert bet.status == "CASHED"
 
 
-def test_phase_cycle():
+def test_phase_cycle(monkeypatch):
+    monkeypatch.setattr(engine_mod, "CRASH_INTERMISSION_SECONDS", 0.1)
     uid, headers = _register_user("e@example.com")
     engine = main.app.state.crash_engine
     engine._gen_crash_at = lambda: 1.01
-    r = client.post("/crash/bet", json={"amount": 10}, headers=headers)
+    # con el cliente abierto la ronda corre en un solo loop (cerrarlo no la crashea)
+    with TestClient(main.app) as c:
+        r = c.post("/crash/bet", json={"amount": 10}, headers=headers)
+        assert r.status_code == 201
+        # esperar a que crashee y reinicie
+        time.sleep(0.5)
+        assert engine.phase == "BETTING"
+
+
+def test_verify_only_revealed_games():
+    engine = main.app.state.crash_engine
+    g, m = engine.chain.take()
+    engine.revealed = engine.chain.reveal(g)
+    r = client.get(f"/crash/verify?start={g}&end={g}")
+    assert r.status_code == 200
+    data = r.json()
+    assert data["ok"] and data["rounds"][0]["crash_at"] == m
+    assert data["terminal"] == client.get("/crash/chain").json()["terminal"]
+    assert client.get(f"/crash/verify?start={g}&end={g + 1}").status_code == 400
+
+
+def test_history_etag():
+    engine = main.app.state.crash_engine
+    engine.history.add("r1", 2.5, 3, 30.0, 20.0)
+    r = client.get("/crash/history")
+    assert r.status_code == 200
+    assert r.json()[0] == {"rid": "r1", "crash_at": 2.5, "players": 3, "wagered": 30.0, "paid": 20.0}
+    etag = r.headers["etag"]
+    assert client.get("/crash/history", headers={"If-None-Match": etag}).status_code == 304
+    engine.history.add("r2", 1.1, 1, 5.0, 0.0)
+    assert client.get("/crash/history", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_room_routes():
+    uid, headers = _register_user("f@example.com")
+    vip = main.rooms.get("vip") or main.rooms.add("vip")
+    vip.started = True  # evitar autostart
+    assert client.get("/crash/nope/state", headers=headers).status_code == 404
+    assert "vip" in [r["room"] for r in client.get("/crash/rooms").json()]
+    r = client.post("/crash/vip/bet", json={"amount": 10}, headers=headers)
     assert r.status_code == 201
-    # esperar a que crashee y reinicie
-    time.sleep(0.5)
-    assert engine.phase == "BETTING"
+    assert uid in vip.bets
+    assert uid not in main.app.state.crash_engine.bets
+    assert client.get("/crash/vip/state", headers=headers).json()["round_id"] == vip.round_id
+
+
+def _ack(ws, cid):
+    # el ack viaja por la cola de eventos: puede venir suelto o dentro de un batch
+    while True:
+        msg = ws.receive_json()
+        for m in msg["ev"] if msg["t"] == "batch" else [msg]:
+            if m["t"] == "ack" and m["id"] == cid:
+                return m
+
+
+def test_ws_commands():
+    uid, headers = _register_user("g@example.com")
+    engine = main.app.state.crash_engine
+    engine.started = True  # evitar autostart
+    with client.websocket_connect("/crash/stream", headers=headers) as ws:
+        ws.send_text("ping")  # texto suelto: se ignora como antes
+        ws.send_json({"id": 1, "op": "bet", "amount": 10, "auto": 1.0})
+        assert _ack(ws, 1) == {"t": "ack", "id": 1, "ok": False, "err": "BAD_AUTO"}
+        ws.send_json({"id": 2, "op": "bet", "amount": 10})
+        ack = _ack(ws, 2)
+        assert ack["ok"] and ack["r"] == {"rid": engine.round_id}
+        # el ack sale con el débito ya aplicado
+        assert client.get("/wallet/balance", headers=headers).json()["balance"] == 90.0
+        ws.send_json({"id": 3, "op": "bet", "amount": 10})
+        assert _ack(ws, 3)["err"] == "ALREADY_BET"
+        engine.phase = "RUNNING"
+        engine.multiplier = 2.0
+        engine.crash_at = 10.0
+        ws.send_json({"id": 4, "op": "cashout"})
+        assert _ack(ws, 4)["r"] == {"at": 2.0, "payout": 20.0}
+        ws.send_json({"id": 5, "op": "state"})
+        assert _ack(ws, 5)["r"]["phase"] == "RUNNING"
+        ws.send_text('{"id": 6, "op": "bet", "amount": NaN}')
+        assert _ack(ws, 6)["err"] == "BAD_AMOUNT"
+        ws.send_text('{"id": 7, "op": "bet", "amount": 10, "auto": Infinity}')
+        assert _ack(ws, 7)["err"] == "BAD_AUTO"
+    assert client.get("/wallet/balance", headers=headers).json()["balance"] == 110.0
+
+
+def test_ws_commands_need_auth():
+    uid, headers = _register_user("h@example.com")
+    client.cookies.clear()
+    with client.websocket_connect("/crash/stream") as ws:
+        ws.send_json({"id": 1, "op": "cashout"})
+        assert _ack(ws, 1)["err"] == "UNAUTHORIZED"
+        ws.send_json({"id": 2, "op": "auth", "token": "nope"})
+        assert _ack(ws, 2)["err"] == "UNAUTHORIZED"
+        ws.send_json({"id": 3, "op": "auth", "token": headers["Authorization"][7:]})
+        assert _ack(ws, 3)["r"] == {"user": uid}
+        ws.send_json({"id": 4, "op": "cashout"})
+        assert _ack(ws, 4)["err"] == "NOT_RUNNING"
+
+
+def test_ws_rejects_foreign_origin():
+    _, headers = _register_user("i@example.com")
+    with pytest.raises(WebSocketDisconnect) as exc:
+        with client.websocket_connect("/crash/stream", headers={**headers, "origin": "https://evil.example"}) as ws:
+            ws.receive_text()
+    assert exc.value.code == 1008
+    # el propio origen (y los de ALLOWED_ORIGINS) sí
+    with client.websocket_connect("/crash/stream", headers={**headers, "origin": "http://testserver"}) as ws:
+        assert ws.receive_json()["t"] == "state"
@@ -0,0 +1,147 @@
+import asyncio
+import math
+import time
+from decimal import Decimal
+from functools import partial
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+import api.db as db
+from api.crash import snapshot
+from api.crash.betbook import BetBook
+from api.crash.engine import CrashEngine
+from api.crash.settlement import pipeline, settle_bet
+from api.models import Base, CrashBet, User, Wallet
+
+
+@pytest.fixture
+def engine(monkeypatch, tmp_path):
+    path = tmp_path / "snap.db"
+    eng = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(eng)
+    async_eng = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    monkeypatch.setattr(db, "AsyncSessionLocal", async_sessionmaker(async_eng, expire_on_commit=False))
+    with Session(eng) as s, s.begin():
+        for i in range(4):
+            s.add(User(id=f"u{i}", email=f"u{i}@example.com", username=f"u{i}", password_hash="x"))
+            s.add(Wallet(user_id=f"u{i}", balance=Decimal("100")))
+    return eng
+
+
+def _running(crash_at: float, elapsed_s: float) -> CrashEngine:
+    eng = CrashEngine()
+    eng.phase, eng.started, eng.crash_at = "RUNNING", True, crash_at
+    eng.t0 = time.perf_counter() - elapsed_s
+    eng.bets.add("u0", 10.0)
+    eng.bets.add("u1", 10.0, 1.5)
+    eng.bets.add("u2", 10.0, 5.0)
+    eng.bets.add("u3", 10.0)
+    eng.bets.cash(eng.bets.index["u3"], 1.2)  # cobró antes del corte
+    return eng
+
+
+def test_betbook_dump_roundtrip():
+    book = BetBook()
+    book.add("a", 5.0, 2.0)
+    book.add("b", 7.0)
+    book.add("c", 1.0, 1.5)
+    book.cash(1, 1.3)
+    loaded = BetBook.load(book.dump())
+    assert list(loaded) == ["a", "b", "c"]
+    assert loaded["b"] == book["b"]
+    assert loaded.next_auto() == 1.5
+    due = loaded.pop_due(2.0)
+    assert [loaded.players[i] for i in due] == ["c", "a"]
+    assert loaded["b"]["cash_at"] == 1.3 and loaded["a"]["payout"] == 10.0
+
+
+def test_outcome_depends_on_wall_clock():
+    snap = snapshot.take(_running(3.0, 0.0))
+    k = snap["k"]
+    # caído poco: la curva no llegó al crash; la auto de 1.5x sí cobra
+    book, crashed, m = snapshot.outcome(snap, snap["wall"] + math.log(2.0) / k)
+    assert not crashed and m == pytest.approx(2.0)
+    assert book["u1"]["cash_at"] == 1.5 and book["u2"]["cashed"] is False
+    # caído mucho: crasheó en 3.0x y la auto de 5x pierde
+    book, crashed, m = snapshot.outcome(snap, snap["wall"] + 600)
+    assert crashed and m == 3.0
+    assert book.losers() == ["u0", "u2"]
+
+
+def test_restore_resettles_interrupted_round(engine, tmp_path):
+    path = str(tmp_path / "crash.snap")
+    old = _running(1.3, 60.0)  # la curva ya pasó el crash
+
+    async def run():
+        for p in old.bets.players:
+            await pipeline.submit(partial(settle_bet, old.round_id, old.crash_at, p, 10.0, None))
+        snap = snapshot.Snapshotter(old, path)
+        await snap.save()
+        fresh = CrashEngine()
+        assert await snapshot.restore(fresh, path)
+        return fresh
+
+    fresh = asyncio.run(run())
+    assert fresh.history.items()[0]["rid"] == old.round_id
+    with Session(engine) as s:
+        bets = {b.user_id: b for b in s.scalars(select(CrashBet))}
+        assert bets["u3"].status == "CASHED" and s.get(Wallet, "u3").balance == Decimal("102")
+        assert bets["u0"].status == "LOST" and s.get(Wallet, "u0").balance == Decimal("90")
+        assert bets["u1"].status == "LOST"  # 1.5x nunca llegó: crash en 1.3x
+    assert snapshot.read(path) is None
+
+
+def test_restore_refunds_round_that_had_not_crashed(engine, tmp_path):
+    path = str(tmp_path / "crash.snap")
+    old = _running(1000.0, 0.0)
+
+    async def run():
+        for p in old.bets.players:
+            await pipeline.submit(partial(settle_bet, old.round_id, old.crash_at, p, 10.0, None))
+        snapshot.write(path, snapshot.take(old))
+        return await snapshot.restore(CrashEngine(), path)
+
+    assert asyncio.run(run())
+    with Session(engine) as s:
+        assert s.get(Wallet, "u0").balance == Decimal("100")
+        assert s.get(Wallet, "u3").balance == Decimal("102")
+        assert {b.status for b in s.scalars(select(CrashBet))} == {"CASHED"}
+
+
+def test_shutdown_mid_round_keeps_open_bets(monkeypatch, tmp_path):
+    import api.main as main
+
+    path = str(tmp_path / "crash.snap")
+    monkeypatch.setattr(main, "CRASH_SNAPSHOT_PATH", path)
+    monkeypatch.setattr(main, "snapshot_path", partial(snapshot.snapshot_path, base=path))
+    eng = main.backplane.engine
+    monkeypatch.setattr(eng, "_gen_crash_at", lambda: 50.0)
+    settled: list = []
+
+    async def on_crash(rid, losers):
+        settled.append((rid, losers))
+
+    monkeypatch.setattr(eng, "on_crash", on_crash)
+
+    async def run():
+        async with main.lifespan(main.app):
+            await eng.place_bet("alice", 10.0)
+            await asyncio.sleep(0.05)
+            assert eng.phase == "RUNNING"
+        return eng.round_id
+
+    try:
+        rid = asyncio.run(run())
+    finally:
+        eng._reset()
+    # el apagado no liquida la ronda: queda entera en el snapshot
+    assert settled == []
+    snap = snapshot.read(path)
+    assert snap is not None and snap["phase"] == "RUNNING" and snap["rid"] == rid
+    book, crashed, _ = snapshot.outcome(snap, snap["wall"])
+    assert not crashed
+    assert list(book) == ["alice"] and book.is_open(0)
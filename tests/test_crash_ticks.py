@@ -0,0 +1,79 @@
+import asyncio
+from contextlib import suppress
+
+import pytest
+
+import api.crash.engine as engine_mod
+from api.crash.clock import VirtualClock
+from api.crash.engine import CrashEngine
+from api.crash.metrics import TICK_LATENESS, TICKS_SKIPPED
+
+
+def test_tick_loop_skips_missed_deadlines(monkeypatch):
+    monkeypatch.setattr(engine_mod, "CRASH_TICK_MS", 20)
+    monkeypatch.setattr(engine_mod, "CRASH_INTERMISSION_SECONDS", 0)
+    skipped_before = TICKS_SKIPPED._value.get()
+    lateness_before = TICK_LATENESS._sum.get()
+    clock = VirtualClock()
+
+    async def run():
+        engine = CrashEngine(clock=clock)
+        ticks: list[float] = []
+        settle = engine._settle_due_autos
+
+        def work():
+            ticks.append(clock.now())
+            if len(ticks) == 5:
+                clock._now += 0.07  # el loop queda trabado 3.5 ticks
+            return settle()
+
+        engine._settle_due_autos = work  # type: ignore[method-assign]
+        engine._gen_crash_at = lambda: 1000.0  # type: ignore[method-assign]
+        await engine.place_bet("p1", 1.0)
+        await clock.advance(0.49)
+        task = engine._runner_task
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await clock.run(task)  # el cierre de la ronda también espera en el reloj
+        await engine.fanout.close()
+        return ticks
+
+    ticks = asyncio.run(run())
+    assert TICKS_SKIPPED._value.get() - skipped_before == 2
+    assert TICK_LATENESS._sum.get() > lateness_before
+    # sin acumular: un tick atrasado (0.17) y de vuelta en la grilla de 20 ms
+    assert ticks[:6] == pytest.approx([0.02, 0.04, 0.06, 0.08, 0.10, 0.17])
+    assert ticks[6:] == pytest.approx([0.18 + 0.02 * i for i in range(16)])
+
+
+def test_event_schedule_without_spectators_wakes_only_for_due_events(monkeypatch):
+    monkeypatch.setattr(engine_mod, "CRASH_TICK_MS", 1)
+    monkeypatch.setattr(engine_mod, "CRASH_GROWTH_RATE", 5.0)
+    monkeypatch.setattr(engine_mod, "CRASH_INTERMISSION_SECONDS", 0)
+
+    async def run():
+        engine = CrashEngine()
+        engine.schedule = "events"
+        engine._gen_crash_at = lambda: 1.5  # type: ignore[method-assign]
+        wakes = 0
+        sleep_until = engine._sleep_until
+
+        async def counted(deadline):
+            nonlocal wakes
+            wakes += 1
+            await sleep_until(deadline)
+
+        engine._sleep_until = counted  # type: ignore[method-assign]
+        cashes = []
+        publish = engine.fanout.publish_events
+        engine.fanout.publish_events = lambda out: (cashes.extend(m for m, _ in out if m["t"] == "player_cash"), publish(out))  # type: ignore[method-assign]
+        for i, auto in enumerate((1.1, 1.2, 1.3)):
+            engine.bets.add(f"p{i}", 1.0, auto)
+        await engine.place_bet("p3", 1.0, 2.0)  # arranca la ronda
+        await engine._runner_task
+        return wakes, cashes
+
+    wakes, cashes = asyncio.run(run())
+    # ~80 ticks de 1 ms hasta 1.5x; acá: 3 autos + crash (+ algún reintento por redondeo)
+    assert wakes <= 6
+    assert [c["at"] for c in cashes] == [1.1, 1.2, 1.3]
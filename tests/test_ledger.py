@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+from api.models import Base, BalanceCheckpoint, LedgerArchive, LedgerEntry, User, Wallet
+from api.services.ledger import archive_ledger, purge_archived, take_checkpoints, verify_balance
+from api.services.wallet import apply_transaction, apply_transactions_bulk
+
+
+def _engine():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as s, s.begin():
+        for uid in ("u1", "u2"):
+            s.add(User(id=uid, email=f"{uid}@example.com", username=uid, password_hash="x"))
+            s.add(Wallet(user_id=uid, balance=Decimal("100")))
+    return engine
+
+
+def _count(s, model):
+    return s.scalar(select(func.count()).select_from(model))
+
+
+def test_checkpoint_archive_and_verify():
+    engine = _engine()
+    with Session(engine) as s, s.begin():
+        for i in range(5):
+            apply_transaction(s, "u1", Decimal("-10"), "bet", f"a{i}")
+        apply_transaction(s, "u2", Decimal("7"), "win", "b0")
+        assert take_checkpoints(s) == 2
+        assert take_checkpoints(s) == 0  # nada nuevo
+        apply_transaction(s, "u1", Decimal("25"), "win", "a5")
+    with Session(engine) as s, s.begin():
+        v = verify_balance(s, "u1")
+        # sólo lee lo posterior al checkpoint
+        assert v["entries"] == 1 and v["ledger_balance"] == Decimal("75") and v["ok"]
+        assert take_checkpoints(s) == 1
+        # todo lo cubierto por un checkpoint y anterior al corte
+        cutoff = datetime.now(timezone.utc) + timedelta(days=1)
+        assert archive_ledger(s, cutoff, limit=4) == 4
+        assert archive_ledger(s, cutoff) == 3
+        assert archive_ledger(s, cutoff) == 0
+        # primero se copia; el borrado va en otra transacción
+        assert _count(s, LedgerEntry) == 7 and _count(s, LedgerArchive) == 7
+    with Session(engine) as s, s.begin():
+        assert purge_archived(s) == 7 and purge_archived(s) == 0
+        assert _count(s, LedgerEntry) == 0 and _count(s, LedgerArchive) == 7
+        assert _count(s, BalanceCheckpoint) == 3
+        v = verify_balance(s, "u1")
+        assert v["entries"] == 0 and v["ok"]
+        assert v["ledger_balance"] == v["wallet_balance"] == Decimal("75")
+
+
+def test_verify_flags_movements_outside_the_ledger():
+    engine = _engine()
+    with Session(engine) as s, s.begin():
+        apply_transaction(s, "u1", Decimal("-10"), "bet", "a0")
+        s.get(Wallet, "u1").balance += Decimal("50")  # crédito de admin, sin asiento
+    with Session(engine) as s, s.begin():
+        assert not verify_balance(s, "u1")["ok"]
+        entry = apply_transaction(s, "u1", Decimal("-10"), "bet", "a1")
+        v = verify_balance(s, "u1")
+        assert v["breaks"] == [entry.id] and not v["ok"]
+        # el checkpoint toma el saldo del ledger: lo anterior ya no se relee
+        take_checkpoints(s)
+        assert verify_balance(s, "u1")["ok"]
+
+
+def test_archived_keys_are_not_applied_again():
+    engine = _engine()
+    with Session(engine, expire_on_commit=False) as s, s.begin():
+        first = apply_transaction(s, "u1", Decimal("-10"), "bet", "a0")
+        take_checkpoints(s)
+        archive_ledger(s, datetime.now(timezone.utc) + timedelta(days=1))
+    with Session(engine) as s, s.begin():
+        purge_archived(s)
+    with Session(engine) as s, s.begin():
+        # reintento con una clave que ya sólo está en el archivo
+        again = apply_transaction(s, "u1", Decimal("-10"), "bet", "a0")
+        assert (again.id, again.balance_after) == (first.id, Decimal("90"))
+        [bulk] = apply_transactions_bulk(s, [("u1", Decimal("-10"), "bet", "a0")])
+        assert bulk.id == first.id
+        assert s.get(Wallet, "u1").balance == Decimal("90")
+        assert _count(s, LedgerEntry) == 0
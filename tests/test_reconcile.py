@@ -0,0 +1,51 @@
+from decimal import Decimal
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from api.models import Base, LedgerEntry, User, Wallet
+from api.services.ledger import take_checkpoints
+from api.services.reconcile import partition, reconcile
+from api.services.wallet import apply_transaction
+
+
+def _seed(url):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with Session(engine) as s, s.begin():
+        for i in range(30):
+            s.add(User(id=f"u{i:02}", email=f"u{i}@example.com", username=f"u{i}", password_hash="x"))
+            s.add(Wallet(user_id=f"u{i:02}", balance=Decimal("100")))
+        s.add(User(id="zz", email="zz@example.com", username="zz", password_hash="x"))
+    with Session(engine) as s, s.begin():
+        for i in range(30):
+            for j in range(3):
+                apply_transaction(s, f"u{i:02}", Decimal(j - 1), "bet", f"k{i}-{j}")
+        # crédito de admin entre dos asientos: salto en la cadena
+        s.get(Wallet, "u03").balance += Decimal("50")
+        apply_transaction(s, "u03", Decimal("-1"), "bet", "k3-x")
+        # crédito de admin después del último asiento: no coincide el saldo
+        s.get(Wallet, "u17").balance += Decimal("5")
+        s.add(LedgerEntry(user_id="zz", amount=Decimal("1"), reason="x", idempotency_key="z", balance_after=Decimal("1")))
+    return engine
+
+
+def test_reconcile_finds_discrepancies(tmp_path):
+    url = f"sqlite:///{tmp_path / 'rec.db'}"
+    engine = _seed(url)
+    with Session(engine) as s:
+        assert len(partition(s, 3)) == 3
+    found, summary = reconcile(url, workers=1, batch=7)
+    assert [(f["user_id"], f["kind"]) for f in found] == [("u03", "chain"), ("u17", "balance"), ("zz", "no_wallet")]
+    assert found[1] == {"user_id": "u17", "kind": "balance", "ledger": "100.000000", "wallet": "105.000000"}
+    assert summary["users"] == 31 and summary["entries"] == 92
+    # en varios procesos, mismo resultado
+    found3, summary3 = reconcile(url, workers=3, batch=7)
+    assert sorted(found3, key=lambda f: f["user_id"]) == found
+    assert summary3["ranges"] == 3 and summary3["entries"] == 92
+    # desde el último checkpoint sólo se relee lo nuevo
+    with Session(engine) as s, s.begin():
+        take_checkpoints(s)
+        apply_transaction(s, "u05", Decimal("2"), "win", "k5-x")
+    found, summary = reconcile(url, from_checkpoint=True)
+    assert summary["entries"] == 1 and found == []
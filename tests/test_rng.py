@@ -13,8 +13,12 @@ os.environ.setdefault("RNG_HOUSE_EDGE", "0.01")
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.append(str(ROOT / "backend"))
 
+import api.services.rng as rng  # noqa: E402
 from api.services.rng import SEEDS, app, hmac_sha256, verify_signature  # noqa: E402
 
+# el engine del crash puede haber importado el servicio antes que este módulo
+rng.ADMIN_TOKEN = os.environ["ADMIN_TOKEN"]
+
 client = TestClient(app)
 
 
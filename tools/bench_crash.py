@@ -0,0 +1,196 @@
+"""Benchmark del engine del crash en tiempo virtual.
+
+Juega miles de rondas con apostadores sintéticos sobre un ``VirtualClock``:
+las esperas (ticks, intermedio) no cuestan tiempo real, así que lo que se mide
+es CPU del engine y, con ``--settle sqlite``, la liquidación contra una base
+SQLite temporal por un ``SettlementPipeline`` como el de la API (con sus
+propias sesiones: la base de la app no se toca)::
+
+    python tools/bench_crash.py --rounds 2000 --bettors 100 --schedule events
+
+Reporta rondas/s, costo de liquidación por apuesta y memoria por apuesta.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from decimal import Decimal
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+# api.db crea las tablas de DATABASE_URL al importarse; sin una configurada,
+# en memoria (el default deja un test.db suelto en el directorio actual)
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from api.crash.clock import VirtualClock  # noqa: E402
+from api.crash.engine import CrashEngine  # noqa: E402
+from api.crash.hashchain import HashChain  # noqa: E402
+from api.crash.settlement import (  # noqa: E402
+    Op,
+    SettlementPipeline,
+    settle_bet,
+    settle_cashout,
+    settle_losers,
+)
+
+
+class BenchEngine(CrashEngine):
+    """Engine que al crashear arma la liquidación completa de la ronda
+    (apuestas, cobros y perdedores); el benchmark la corre fuera del reloj
+    virtual, que sólo tiene sentido para el engine."""
+
+    def __init__(self, *args, **kw) -> None:
+        super().__init__(*args, **kw)
+        self.settle = False
+        self.ops: List[Op] = []
+
+    async def _settle_losers(self, round_id: str, losers: List[str]) -> None:
+        if not self.settle:
+            return
+        book = self.bets
+        ops: List[Op] = [partial(settle_bet, round_id, self.crash_at, p, book.amount[i], None) for i, p in enumerate(book.players)]
+        ops += [
+            partial(settle_cashout, round_id, p, book.cash_at[i], book.payout[i])
+            for i, p in enumerate(book.players)
+            if not book.is_open(i)
+        ]
+        if losers:
+            ops.append(partial(settle_losers, round_id, losers))
+        self.ops = ops
+
+
+async def _setup_sqlite(path: str, bettors: int) -> SettlementPipeline:
+    """Crea la base del benchmark y un pipeline con sesiones propias."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.orm import Session
+    from sqlalchemy.pool import NullPool
+
+    from api.models import Base, User, Wallet
+
+    sync = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(sync)
+    with Session(sync) as s, s.begin():
+        for i in range(bettors):
+            s.add(User(id=f"b{i}", email=f"b{i}@bench", username=f"b{i}", password_hash="x"))
+            s.add(Wallet(user_id=f"b{i}", balance=Decimal("1000000000")))
+    sync.dispose()
+    async_eng = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    return SettlementPipeline(sessions=async_sessionmaker(async_eng, expire_on_commit=False))
+
+
+def _fill(engine: CrashEngine, rng: random.Random, n: int, auto_share: float = 0.5) -> None:
+    # autos con objetivo exponencial: la mayoría cerca de 2x, alguna muy arriba
+    for i in range(n):
+        auto = round(1.01 + rng.expovariate(1.0), 2) if rng.random() < auto_share else None
+        engine.bets.add(f"b{i}", rng.choice((1.0, 5.0, 10.0, 50.0)), auto)
+
+
+async def _cashout(engine: CrashEngine, player_id: str) -> None:
+    try:
+        await engine.cashout(player_id)
+    except RuntimeError:
+        pass  # ya crasheó
+
+
+async def play(
+    rounds: int = 1000,
+    bettors: int = 50,
+    schedule: str = "events",
+    auto_share: float = 0.5,
+    manual_share: float = 0.3,
+    seed: int = 1,
+    settle: Optional[str] = None,
+) -> Dict:
+    """Juega ``rounds`` rondas de ``bettors`` apuestas; devuelve las métricas."""
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    chain = HashChain.in_memory(rounds, seed=hashlib.sha256(str(seed).encode()).digest())
+    engine = BenchEngine(chain=chain, clock=clock)
+    engine.schedule = schedule
+    tmp = tempfile.TemporaryDirectory()
+    pipeline: Optional[SettlementPipeline] = None
+    if settle == "sqlite":
+        pipeline = await _setup_sqlite(os.path.join(tmp.name, "bench.db"), bettors)
+        engine.settle = True
+    tasks = set()
+
+    def spawn_cashout(player_id: str) -> None:
+        tasks.add(asyncio.ensure_future(_cashout(engine, player_id)))
+
+    # memoria por apuesta: sólo lo que crece el libro
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    _fill(engine, rng, bettors)
+    mem_per_bet = (tracemalloc.get_traced_memory()[0] - before) / max(1, bettors)
+    tracemalloc.stop()
+    engine.bets.clear()
+
+    async def round_():
+        # BETTING sin espera: el libro se llena directo y la última apuesta
+        # entra por place_bet, que arranca la ronda
+        _fill(engine, rng, bettors - 1, auto_share)
+        await engine.place_bet(f"b{bettors - 1}", 10.0)
+        for i in range(bettors - 1):
+            if rng.random() < manual_share:
+                clock.call_later(rng.uniform(0.0, 20.0), spawn_cashout, f"b{i}")
+        assert engine._runner_task is not None
+        await engine._runner_task
+
+    engine_s = settle_s = 0.0
+    for _ in range(rounds):
+        t = time.perf_counter()
+        await clock.run(round_())
+        engine_s += time.perf_counter() - t
+        if engine.ops:
+            assert pipeline is not None
+            t = time.perf_counter()
+            await asyncio.gather(*(pipeline.submit(op) for op in engine.ops))
+            settle_s += time.perf_counter() - t
+            engine.ops = []
+    for task in tasks:
+        task.cancel()
+    tmp.cleanup()
+    bets = rounds * bettors
+    return {
+        "rounds": rounds,
+        "bets": bets,
+        "schedule": schedule,
+        "seconds": round(engine_s + settle_s, 3),
+        "virtual_seconds": round(clock.now(), 1),
+        "rounds_per_sec": round(rounds / (engine_s + settle_s), 1),
+        "engine_us_per_bet": round(engine_s / bets * 1e6, 2),
+        "settle_us_per_bet": round(settle_s / bets * 1e6, 2) if engine.settle else None,
+        "mem_bytes_per_bet": round(mem_per_bet, 1),
+        "timers_fired": clock.fired,
+        "history": len(engine.history),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    p = argparse.ArgumentParser(prog="python tools/bench_crash.py")
+    p.add_argument("--rounds", type=int, default=1000)
+    p.add_argument("--bettors", type=int, default=50)
+    p.add_argument("--schedule", choices=("ticks", "events"), default="events")
+    p.add_argument("--auto-share", type=float, default=0.5)
+    p.add_argument("--manual-share", type=float, default=0.3)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--settle", choices=("none", "sqlite"), default="sqlite")
+    a = p.parse_args(argv)
+    result = asyncio.run(play(
+        a.rounds, a.bettors, a.schedule, a.auto_share, a.manual_share, a.seed,
+        None if a.settle == "none" else a.settle,
+    ))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":  # pragma: no cover - herramienta de medición
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark cashout latency on the crash engine with many connected sockets.
+
+Run with:
+    python tools/bench_crash_cashout.py --sockets 10000 --players 2000
+
+Sockets are in-process fakes, so the numbers measure engine and fan-out cost
+(lock hold time, serialization, queueing), not network time.
+"""
+
+import argparse
+import asyncio
+import math
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+from api.crash.engine import CrashEngine  # noqa: E402
+
+
+class NullSocket:
+    """WebSocket stand-in that accepts frames after a fixed delay."""
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+
+    async def send_text(self, data: str) -> None:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+    async def close(self, code: int = 1000) -> None:
+        pass
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values_sorted = sorted(values)
+    k = (len(values_sorted) - 1) * pct
+    f, c = math.floor(k), math.ceil(k)
+    if f == c:
+        return values_sorted[int(k)]
+    return values_sorted[f] * (c - k) + values_sorted[c] * (k - f)
+
+
+async def run_benchmark(sockets: int, players: int, send_delay: float) -> List[float]:
+    engine = CrashEngine()
+    for _ in range(sockets):
+        engine.fanout.add(NullSocket(send_delay))  # type: ignore[arg-type]
+    engine.phase = "RUNNING"
+    engine.started = True
+    engine.multiplier = 1.5
+    engine.crash_at = 1000.0
+    for i in range(players):
+        engine.bets.add(f"p{i}", 10.0)
+
+    latencies: List[float] = []
+
+    async def one(pid: str) -> None:
+        t0 = time.perf_counter()
+        await engine.cashout(pid)
+        latencies.append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(one(f"p{i}") for i in range(players)))
+    await engine.fanout.close()
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure crash cashout latency under fan-out load")
+    parser.add_argument("--sockets", type=int, default=10_000, help="Connected sockets")
+    parser.add_argument("--players", type=int, default=2_000, help="Concurrent cashouts")
+    parser.add_argument("--send-delay", type=float, default=0.0, help="Per-frame socket delay in seconds")
+    args = parser.parse_args()
+
+    lat = asyncio.run(run_benchmark(args.sockets, args.players, args.send_delay))
+    print(f"Sockets: {args.sockets}")
+    print(f"Cashouts: {len(lat)}")
+    print(f"P50: {percentile(lat, 0.50) * 1000:.3f} ms")
+    print(f"P99: {percentile(lat, 0.99) * 1000:.3f} ms")
+    print(f"Max: {max(lat) * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()